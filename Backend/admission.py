@@ -0,0 +1,110 @@
+"""Inbound admission control for api_server.
+
+Every app instance polls /users every 3 seconds and runs a 1-second alert
+loop, so one misbehaving or duplicated client can starve everyone else of
+request threads and Telegram budget. Before a request reaches its route:
+
+- a token bucket per client IP, with separate budgets for reads (/users,
+  /health, ...) and sends (/send, /send-message, /alerts), answers a fast
+  429 with Retry-After once the client is over budget;
+- a token bucket per target username caps how often any one guardian can
+  be messaged, whoever is sending;
+- a bounded number of concurrent send requests per worker sheds load with a
+  503 before request threads pile up waiting on slow Telegram calls.
+
+Budgets are kept per API worker process.
+"""
+import math
+import threading
+import time
+
+from dispatch import TokenBucket
+from user_store import normalize_username
+
+READ = 'read'
+SEND = 'send'
+
+
+class KeyedBuckets:
+    """Token buckets keyed by client IP or username, created on first use."""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, now):
+        """Take a token for key. Returns 0, or seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    # Forget clients whose bucket has refilled; they start from full anyway
+                    self._buckets = {k: b for k, b in self._buckets.items() if not b.is_idle(now)}
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            wait = bucket.wait_time(now)
+            if wait:
+                return wait
+            bucket.consume()
+            return 0.0
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionController:
+    """Decides whether a request may run. A rate of 0 disables that budget."""
+
+    def __init__(self, read_rate=2.0, read_burst=10, send_rate=10.0, send_burst=30,
+                 target_rate=5.0, target_burst=10, max_concurrent_sends=8):
+        self.clients = {
+            READ: KeyedBuckets(read_rate, read_burst),
+            SEND: KeyedBuckets(send_rate, send_burst),
+        }
+        self.targets = KeyedBuckets(target_rate, target_burst)
+        self.max_concurrent_sends = max_concurrent_sends
+        self._slots = threading.BoundedSemaphore(max_concurrent_sends) if max_concurrent_sends > 0 else None
+        self._lock = threading.Lock()
+        self.counters = {'client_limited': 0, 'target_limited': 0, 'shed': 0}
+
+    def check(self, budget, client, targets=()):
+        """Take tokens for one request. Returns None if admitted, else (reason, retry_after)."""
+        now = time.monotonic()
+        wait = self.clients[budget].take(client, now)
+        if wait:
+            return self._reject('client_limited', wait)
+        for target in targets:
+            wait = self.targets.take(normalize_username(target), now)
+            if wait:
+                return self._reject('target_limited', wait)
+        return None
+
+    def acquire_send_slot(self):
+        """Reserve one concurrent send without waiting. Returns False when saturated."""
+        if self._slots is None or self._slots.acquire(blocking=False):
+            return True
+        self._reject('shed', 1.0)
+        return False
+
+    def release_send_slot(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    def _reject(self, reason, retry_after):
+        with self._lock:
+            self.counters[reason] += 1
+        return reason, retry_after
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, tracked_clients=len(self.clients[READ]) + len(self.clients[SEND]),
+                        tracked_targets=len(self.targets))
+
+
+def retry_after_header(seconds):
+    """Retry-After takes whole seconds; round up so clients don't come back too early."""
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,317 @@
+"""Server-side alert sessions.
+
+When a ward stops breathing, the app starts one alert session instead of
+calling /send-message every second. A scheduler thread walks all active
+sessions in deadline order and queues the repeated Telegram messages through
+the dispatcher, then sends the final message when the session runs out.
+
+Sessions live in a small SQLite database (alerts.db) rather than in memory,
+so every API worker process sees the same sessions: any worker can answer
+GET/DELETE /alerts/<id>, and each round is claimed in a transaction so only
+one worker's scheduler sends it. Active sessions also survive a restart.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+from dispatch import HIGH, NORMAL
+
+log = logging.getLogger(__name__)
+
+ACTIVE = 'active'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+
+
+class AlertSession:
+    """One ward's alert: who to message, what to say, and how often."""
+
+    def __init__(self, guardians, messages, cadence, duration, final_message=None):
+        self.id = uuid.uuid4().hex
+        self.guardians = guardians
+        self.messages = messages
+        self.cadence = cadence
+        self.duration = duration
+        self.final_message = final_message
+        self.status = ACTIVE
+        self.started_at = time.time()
+        self.ends_at = self.started_at + duration
+        self.finished_at = None
+        self.rounds = 0
+        self.messages_queued = 0
+        self.messages_sent = 0
+        self.messages_failed = 0
+        self.unknown_guardians = set()
+
+    @classmethod
+    def from_row(cls, row):
+        session = cls.__new__(cls)
+        (session.id, session.status, guardians, messages, session.final_message,
+         session.cadence, session.duration, session.started_at, session.ends_at,
+         session.finished_at, session.rounds, session.messages_queued,
+         session.messages_sent, session.messages_failed, unknown) = row
+        session.guardians = json.loads(guardians)
+        session.messages = json.loads(messages)
+        session.unknown_guardians = set(json.loads(unknown))
+        return session
+
+    def to_dict(self):
+        remaining = max(0.0, self.ends_at - time.time()) if self.status == ACTIVE else 0.0
+        return {
+            'alert_id': self.id,
+            'status': self.status,
+            'guardians': self.guardians,
+            'cadence': self.cadence,
+            'duration': self.duration,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'remaining': round(remaining, 1),
+            'rounds': self.rounds,
+            'messages_queued': self.messages_queued,
+            'messages_sent': self.messages_sent,
+            'messages_failed': self.messages_failed,
+            'unknown_guardians': sorted(self.unknown_guardians),
+        }
+
+
+class AlertStore:
+    """SQLite table of alert sessions shared by every API worker process."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS alert_sessions (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            guardians TEXT NOT NULL,
+            messages TEXT NOT NULL,
+            final_message TEXT,
+            cadence REAL NOT NULL,
+            duration REAL NOT NULL,
+            started_at REAL NOT NULL,
+            ends_at REAL NOT NULL,
+            finished_at REAL,
+            rounds INTEGER NOT NULL DEFAULT 0,
+            messages_queued INTEGER NOT NULL DEFAULT 0,
+            messages_sent INTEGER NOT NULL DEFAULT 0,
+            messages_failed INTEGER NOT NULL DEFAULT 0,
+            unknown_guardians TEXT NOT NULL DEFAULT '[]',
+            next_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_alert_sessions_due ON alert_sessions(status, next_at);
+    """
+
+    COLUMNS = ('id, status, guardians, messages, final_message, cadence, duration, started_at, '
+               'ends_at, finished_at, rounds, messages_queued, messages_sent, messages_failed, '
+               'unknown_guardians')
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def insert(self, session):
+        self._connect().execute(
+            'INSERT INTO alert_sessions (id, status, guardians, messages, final_message, cadence, '
+            'duration, started_at, ends_at, next_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (session.id, session.status, json.dumps(session.guardians), json.dumps(session.messages),
+             session.final_message, session.cadence, session.duration, session.started_at,
+             session.ends_at, session.started_at)
+        )
+
+    def get(self, alert_id):
+        row = self._connect().execute(
+            f'SELECT {self.COLUMNS} FROM alert_sessions WHERE id = ?', (alert_id,)
+        ).fetchone()
+        return AlertSession.from_row(row) if row else None
+
+    def cancel(self, alert_id, now):
+        self._connect().execute(
+            'UPDATE alert_sessions SET status = ?, finished_at = ? WHERE id = ? AND status = ?',
+            (CANCELLED, now, alert_id, ACTIVE)
+        )
+
+    def claim_due(self, now):
+        """Claim every session due at `now` and advance it past this round.
+
+        Returns [(session, message, final)] for the rounds to send, where
+        session reflects the state before the claim. The claim runs in one write
+        transaction, so two workers never send the same round.
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                f'SELECT {self.COLUMNS} FROM alert_sessions WHERE status = ? AND next_at <= ?',
+                (ACTIVE, now)
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                session = AlertSession.from_row(row)
+                if now >= session.ends_at:
+                    conn.execute(
+                        'UPDATE alert_sessions SET status = ?, finished_at = ? WHERE id = ?',
+                        (COMPLETED, now, session.id)
+                    )
+                    if session.final_message:
+                        claimed.append((session, session.final_message, True))
+                    continue
+                message = session.messages[session.rounds % len(session.messages)]
+                conn.execute(
+                    'UPDATE alert_sessions SET rounds = rounds + 1, next_at = ? WHERE id = ?',
+                    (min(now + session.cadence, session.ends_at), session.id)
+                )
+                claimed.append((session, message, False))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return claimed
+
+    def next_due(self):
+        """Wall-clock time the next active session is due, or None."""
+        row = self._connect().execute(
+            'SELECT MIN(next_at) FROM alert_sessions WHERE status = ?', (ACTIVE,)
+        ).fetchone()
+        return row[0]
+
+    def record_round(self, alert_id, queued, unknown_guardians):
+        self._connect().execute(
+            'UPDATE alert_sessions SET messages_queued = messages_queued + ?, unknown_guardians = ? '
+            'WHERE id = ?',
+            (queued, json.dumps(sorted(unknown_guardians)), alert_id)
+        )
+
+    def record_delivery(self, alert_id, ok):
+        column = 'messages_sent' if ok else 'messages_failed'
+        self._connect().execute(
+            f'UPDATE alert_sessions SET {column} = {column} + 1 WHERE id = ?', (alert_id,)
+        )
+
+    def purge(self, before):
+        """Delete sessions that finished before `before`."""
+        self._connect().execute(
+            'DELETE FROM alert_sessions WHERE status != ? AND finished_at < ?', (ACTIVE, before)
+        )
+
+    def counts(self):
+        row = self._connect().execute(
+            'SELECT SUM(status = ?), COUNT(*) FROM alert_sessions', (ACTIVE,)
+        ).fetchone()
+        return {'active': row[0] or 0, 'tracked': row[1]}
+
+
+class AlertScheduler:
+    """Runs every active alert session from one thread per process.
+
+    resolve_chat_id(username) maps a guardian to a chat_id (or None), and
+    dispatcher is a TelegramDispatcher used to queue the actual sends.
+    Finished sessions are kept for `retention` seconds so clients can read
+    their final progress. Sessions created by other worker processes are
+    picked up within `poll_interval` seconds.
+    """
+
+    PURGE_INTERVAL = 60
+
+    def __init__(self, dispatcher, resolve_chat_id, store, retention=600, poll_interval=1.0):
+        self.dispatcher = dispatcher
+        self.resolve_chat_id = resolve_chat_id
+        self.store = store
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._last_purge = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='alert-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+
+    def create(self, guardians, messages, cadence, duration, final_message=None):
+        """Start a new session; the first round is sent immediately."""
+        session = AlertSession(guardians, messages, cadence, duration, final_message)
+        self.store.insert(session)
+        with self._cond:
+            self._cond.notify()
+        return session
+
+    def get(self, alert_id):
+        return self.store.get(alert_id)
+
+    def cancel(self, alert_id):
+        """Cancel an active session. Returns the session, or None if unknown."""
+        self.store.cancel(alert_id, time.time())
+        return self.store.get(alert_id)
+
+    def stats(self):
+        return self.store.counts()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+            try:
+                self._tick()
+                next_due = self.store.next_due()
+            except sqlite3.Error as e:
+                log.error("Alert scheduler error", extra={'error': str(e)})
+                next_due = None
+            except Exception:
+                # One bad session must not stop every other alert in this worker
+                log.exception("Alert scheduler tick failed")
+                next_due = None
+            timeout = self.poll_interval
+            if next_due is not None:
+                timeout = max(0.0, min(timeout, next_due - time.time()))
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(timeout)
+
+    def _tick(self):
+        """Send one round (or the final message) for every due session."""
+        now = time.time()
+        for session, message, final in self.store.claim_due(now):
+            self._send_round(session, message, final)
+        if now - self._last_purge >= self.PURGE_INTERVAL:
+            self.store.purge(now - self.retention)
+            self._last_purge = now
+
+    def _send_round(self, session, message, final=False):
+        messages = []
+        unknown = set()
+        for guardian in session.guardians:
+            chat_id = self.resolve_chat_id(guardian)
+            if chat_id is None:
+                unknown.add(guardian)
+                continue
+            messages.append((chat_id, message))
+        if messages:
+            # One outbox write for the whole round; the final message skips coalescing
+            self.dispatcher.enqueue_many(messages, on_done=self._progress_callback(session.id),
+                                         priority=HIGH if final else NORMAL)
+        self.store.record_round(session.id, len(messages), unknown)
+
+    def _progress_callback(self, alert_id):
+        def on_done(message_id, ok):
+            self.store.record_delivery(alert_id, ok)
+        return on_done
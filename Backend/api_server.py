@@ -1,12 +1,38 @@
-from flask import Flask, request, jsonify
-import requests
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
+import hashlib
+import hmac
 import json
+import logging
+import math
 import os
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
+from user_registry import UserRegistry
+from user_store import open_user_store
+from dispatch import NORMAL, PRIORITIES, TelegramDispatcher
+from telegram_client import TelegramClient
+from alerts import AlertScheduler, AlertStore
+from outbox import Outbox, FAILED, SENT
+from idempotency import SendGuard
+from admission import READ, SEND, AdmissionController, retry_after_header
+from registry_notify import ChangeListener
+from metrics import CONTENT_TYPE, MetricsRegistry, telegram_call_metrics
+from profiling import Profiler
+import logs
 
 # Load environment variables from .env file
 load_dotenv()
 
+logs.setup('api_server')
+log = logging.getLogger('api_server')
+
+# Access log: every LOG_ACCESS_EVERY-th request, plus every 5xx and every
+# request slower than LOG_SLOW_REQUEST seconds (long polls and streams aside)
+LOG_ACCESS_EVERY = int(os.getenv('LOG_ACCESS_EVERY', 10))
+LOG_SLOW_REQUEST = float(os.getenv('LOG_SLOW_REQUEST', 1))
+
 app = Flask(__name__)
 
 # Configuration
@@ -14,37 +40,275 @@ BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 if not BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable is required. Please create a .env file in the Backend directory.")
 
-# Get the directory where this script is located (same as bot_server.py)
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-USERS_FILE = os.path.join(SCRIPT_DIR, 'users.json')  # Always use absolute path
-TELEGRAM_API_URL = f'https://api.telegram.org/bot{BOT_TOKEN}/sendMessage'
+# Number of API worker processes (set by serve_api.py in production mode)
+API_WORKERS = max(1, int(os.getenv('API_WORKERS', 1)))
+
+# Prometheus metrics served on /metrics; worker processes share them through METRICS_DIR
+metrics = MetricsRegistry(os.getenv('METRICS_DIR') if API_WORKERS > 1 else None)
+HTTP_REQUESTS = metrics.counter('http_requests_total', 'API requests by route, method and status',
+                                ['route', 'method', 'status'])
+HTTP_LATENCY = metrics.histogram('http_request_duration_seconds', 'API request latency by route',
+                                 ['route', 'method'])
+HTTP_IN_FLIGHT = metrics.gauge('http_requests_in_flight', 'API requests currently being served', ['route'])
+REGISTRY_LOAD = metrics.histogram('registry_load_duration_seconds', 'Time to reload the user registry')
+REGISTRY_USERS = metrics.gauge('registry_users', 'Users in the registry at the last reload', mode='max')
+
+# Keep-alive connection pool shared by /send and the dispatch workers
+telegram = TelegramClient(
+    BOT_TOKEN,
+    pool_size=int(os.getenv('DISPATCH_WORKERS', 4)) + 4,
+    on_call=telegram_call_metrics(metrics)
+)
+
+
+def record_registry_reload(seconds, user_count):
+    REGISTRY_LOAD.observe(seconds)
+    REGISTRY_USERS.set(user_count)
+
+
+# Shared across request threads; only reloads when the user store changes
+registry = UserRegistry(open_user_store(), on_reload=record_registry_reload)
+
+# bot_server pings us after every registry write so waiters wake immediately
+change_listener = ChangeListener(registry.refresh)
 
 
 def load_users():
-    """Load users from users.json file."""
-    if not os.path.exists(USERS_FILE):
-        return {}
-    
-    try:
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {}
-
-
-def send_telegram_message(chat_id, message):
-    """Send a message to Telegram using the Bot API."""
-    payload = {
-        'chat_id': chat_id,
-        'text': message
-    }
-    
+    """Load users from the cached registry."""
+    return registry.users()
+
+
+def deliver_queued_message(chat_id, message):
+    """Send one queued message; the dispatcher handles 429s and retries itself."""
+    return telegram.send_message(chat_id, message, retries=0)
+
+
+# Outbound queue for /send-message: workers deliver while respecting Telegram's
+# per-chat (~1/s) and global (~30/s) rate limits. Every API worker process has
+# its own queue, so the global budget is split between them. Messages are
+# persisted in the outbox first, so unsent ones resume after a restart.
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTBOX_DB_FILE = os.path.join(BACKEND_DIR, os.getenv('OUTBOX_DB_FILE', 'outbox.db'))
+outbox = Outbox(OUTBOX_DB_FILE)
+dispatcher = TelegramDispatcher(
+    deliver_queued_message,
+    workers=int(os.getenv('DISPATCH_WORKERS', 4)),
+    global_rate=float(os.getenv('TELEGRAM_GLOBAL_RATE', 30)) / API_WORKERS,
+    per_chat_rate=float(os.getenv('TELEGRAM_CHAT_RATE', 1)),
+    outbox=outbox,
+    # Optional: combine messages to the same chat queued within this many seconds
+    coalesce_window=float(os.getenv('COALESCE_WINDOW', 0)),
+    coalesce_max_messages=int(os.getenv('COALESCE_MAX_MESSAGES', 10)),
+    coalesce_max_length=int(os.getenv('COALESCE_MAX_LENGTH', 4096)),
+)
+
+# Alert sessions live in alerts.db so every worker process sees the same ones;
+# each process runs a scheduler thread that claims and sends the due rounds
+ALERTS_DB_FILE = os.path.join(BACKEND_DIR, os.getenv('ALERTS_DB_FILE', 'alerts.db'))
+alert_scheduler = AlertScheduler(dispatcher, registry.get, AlertStore(ALERTS_DB_FILE))
+
+# Idempotency-Key replays and identical (chat_id, text) sends within
+# DUPLICATE_WINDOW seconds are answered with the earlier message
+send_guard = SendGuard(
+    outbox,
+    window=float(os.getenv('DUPLICATE_WINDOW', 2)),
+    key_ttl=float(os.getenv('IDEMPOTENCY_TTL', 86400)),
+    maxsize=int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000)),
+)
+
+metrics.gauge('dispatch_pending', 'Messages waiting in the dispatch queue').set_function(dispatcher.pending)
+metrics.counter('dispatch_messages_total', 'Dispatch queue outcomes', ['outcome']).set_function(
+    lambda: {(outcome,): count for outcome, count in dispatcher.stats().items() if outcome != 'pending'}
+)
+metrics.counter('send_deduplicated_total', 'Send requests answered without a new message', ['reason']).set_function(
+    lambda: {(reason,): count for reason, count in send_guard.stats().items() if reason != 'cached_keys'}
+)
+metrics.counter('admission_rejections_total', 'Requests rejected before reaching a route', ['reason']).set_function(
+    lambda: {(reason,): admission.counters[reason] for reason in ('client_limited', 'target_limited', 'shed')}
+)
+metrics.counter('log_records_dropped_total', 'Log records dropped because the log queue was full').set_function(
+    logs.dropped
+)
+metrics.gauge('alerts_active', 'Active alert sessions', mode='max').set_function(
+    lambda: alert_scheduler.stats()['active']
+)
+
+
+def start_background_services():
+    """Start the worker threads and listeners behind the API routes."""
+    dispatcher.start()
+    alert_scheduler.start()
+    change_listener.start()
+    metrics.start_flushing()
+
+
+def stop_background_services():
+    """Stop scheduling alerts, then let the dispatcher drain its queue."""
+    change_listener.stop()
+    alert_scheduler.stop()
+    dispatcher.stop()
+
+
+# Under the debug reloader only the serving child process starts them (see __main__)
+if __name__ != '__main__':
+    start_background_services()
+
+MAX_PRESENCE_WAIT = float(os.getenv('MAX_PRESENCE_WAIT', 30))
+MAX_PRESENCE_USERNAMES = int(os.getenv('MAX_PRESENCE_USERNAMES', 500))
+EVENTS_KEEPALIVE = float(os.getenv('EVENTS_KEEPALIVE', 15))
+MIN_ALERT_CADENCE = float(os.getenv('MIN_ALERT_CADENCE', 1))
+MAX_ALERT_DURATION = float(os.getenv('MAX_ALERT_DURATION', 600))
+# How long /send waits for delivery before answering 202 with the message id
+SEND_TIMEOUT = float(os.getenv('SEND_TIMEOUT', 15))
+
+# Per-client and per-guardian request budgets, plus a cap on concurrent sends
+# per worker so slow Telegram calls can't tie up every request thread
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'on').lower() not in ('0', 'off', 'false', 'no')
+ADMISSION_TRUST_PROXY = os.getenv('ADMISSION_TRUST_PROXY', '0').lower() in ('1', 'on', 'true', 'yes')
+admission = AdmissionController(
+    read_rate=float(os.getenv('ADMISSION_READ_RATE', 2)),
+    read_burst=float(os.getenv('ADMISSION_READ_BURST', 10)),
+    send_rate=float(os.getenv('ADMISSION_SEND_RATE', 10)),
+    send_burst=float(os.getenv('ADMISSION_SEND_BURST', 30)),
+    target_rate=float(os.getenv('ADMISSION_TARGET_RATE', 5)),
+    target_burst=float(os.getenv('ADMISSION_TARGET_BURST', 10)),
+    max_concurrent_sends=int(os.getenv('ADMISSION_MAX_CONCURRENT_SENDS',
+                                       max(1, int(os.getenv('API_THREADS', 16)) // 2))),
+)
+# Sampled request profiles and slow-request captures, toggled at runtime via
+# /admin/profiling (shared with bot_server through PROFILE_DIR)
+profiler = Profiler.from_env('api_server')
+# /admin/* routes need `Authorization: Bearer <ADMIN_TOKEN>`; without ADMIN_TOKEN they don't exist
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Routes that message guardians; everything else uses the read budget
+SEND_ROUTES = {('/send', 'POST'), ('/send-message', 'POST'), ('/alerts', 'POST')}
+ADMISSION_EXEMPT_ROUTES = {'/metrics'}
+
+
+@app.before_request
+def start_request_metrics():
+    # Label by URL rule (e.g. /alerts/<alert_id>) so ids don't explode the label set
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc(route=g.metrics_route)
+    if not long_lived_request():
+        g.profile = profiler.start('request', f'{request.method} {g.metrics_route}')
+
+
+def long_lived_request():
+    """Streams and long polls, which are slow by design."""
+    return request.path == '/users/events' or 'wait' in request.args
+
+
+def client_address():
+    """Client IP; behind a reverse proxy (ADMISSION_TRUST_PROXY) the first X-Forwarded-For hop."""
+    if ADMISSION_TRUST_PROXY:
+        forwarded = request.headers.get('X-Forwarded-For', '')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.remote_addr or 'unknown'
+
+
+def send_targets():
+    """Guardian usernames a send request would message."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return []
+    if request.url_rule.rule == '/alerts':
+        guardians = data.get('guardians')
+        return [name for name in guardians if isinstance(name, str)] if isinstance(guardians, list) else []
+    target = data.get('target_username') or data.get('username')
+    return [target] if isinstance(target, str) else []
+
+
+@app.before_request
+def admit_request():
+    """Reject over-budget clients with 429 and shed sends with 503 when saturated."""
+    if not ADMISSION_CONTROL or request.url_rule is None or request.url_rule.rule in ADMISSION_EXEMPT_ROUTES:
+        return None
+    is_send = (request.url_rule.rule, request.method) in SEND_ROUTES
+    rejected = admission.check(SEND if is_send else READ, client_address(), send_targets() if is_send else ())
+    if rejected is not None:
+        reason, retry_after = rejected
+        message = 'Too many messages to this user' if reason == 'target_limited' else 'Too many requests'
+        response = jsonify({'error': message, 'retry_after': round(retry_after, 2)})
+        response.headers['Retry-After'] = retry_after_header(retry_after)
+        return response, 429
+    if is_send:
+        if not admission.acquire_send_slot():
+            response = jsonify({'error': 'Server busy, retry shortly'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        g.admission_slot = True
+    return None
+
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def release_send_slot(error):
+    if g.pop('admission_slot', False):
+        admission.release_send_slot()
+
+
+@app.teardown_request
+def finish_request_metrics(error):
+    if 'metrics_started' not in g:
+        return
+    profiler.finish(g.pop('profile', None))
+    route = g.metrics_route
+    elapsed = time.perf_counter() - g.metrics_started
+    status = g.get('metrics_status', 500)
+    HTTP_IN_FLIGHT.dec(route=route)
+    HTTP_LATENCY.observe(elapsed, route=route, method=request.method)
+    HTTP_REQUESTS.inc(route=route, method=request.method, status=status)
+
+    entry = {'method': request.method, 'route': route, 'status': status, 'duration_ms': round(elapsed * 1000, 1)}
+    if status >= 500:
+        log.error("Request failed", extra=entry)
+    elif elapsed >= LOG_SLOW_REQUEST and not long_lived_request():
+        log.warning("Slow request", extra=entry)
+    else:
+        log.info("Request", extra=dict(entry, every=LOG_ACCESS_EVERY))
+
+
+def queue_send(chat_id, message, on_done=None, priority=NORMAL):
+    """Queue a message unless it replays an Idempotency-Key or repeats a recent send.
+
+    Returns (message_id, reason): reason is None for a newly queued message,
+    otherwise 'replay', 'duplicate' or 'conflict' and message_id is the earlier one.
+    """
+    key = request.headers.get('Idempotency-Key') or None
+    message_id = uuid.uuid4().hex
+    earlier = send_guard.claim(message_id, chat_id, message, key)
+    if earlier is not None:
+        reason, earlier_id = earlier
+        return earlier_id, reason
     try:
-        response = requests.post(TELEGRAM_API_URL, json=payload, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Telegram API error: {str(e)}")
+        dispatcher.enqueue(chat_id, message, on_done=on_done, message_id=message_id, priority=priority)
+    except Exception:
+        send_guard.release(message_id, chat_id, message, key)
+        raise
+    send_guard.sent(message_id, chat_id, message, key)
+    return message_id, None
+
+
+def send_response(body, status, reason):
+    """Mark replayed/deduplicated answers so clients can tell nothing new was sent."""
+    if reason is not None:
+        body['deduplicated'] = reason
+    response = jsonify(body)
+    if reason == 'replay':
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response, status
+
+
+KEY_CONFLICT = {'error': 'Idempotency-Key was already used for a different message'}
 
 
 @app.route('/send', methods=['POST'])
@@ -66,34 +330,59 @@ def send_message():
         
         if not message:
             return jsonify({'error': 'Message is required'}), 400
+
+        # Checked before the idempotency and duplicate lookups, which expect text
+        if not isinstance(username, str) or not isinstance(message, str):
+            return jsonify({'error': 'username and message must be strings'}), 400
+
+        # 'high' skips the coalescing window (e.g. the final alert message)
+        priority = data.get('priority', NORMAL)
+        if priority not in PRIORITIES:
+            return jsonify({'error': f'priority must be one of {", ".join(PRIORITIES)}'}), 400
         
-        # Load users database
-        users = load_users()
-        
-        # Find chat_id for username
-        if username not in users:
+        # Find chat_id for username (exact match, then normalized)
+        chat_id = registry.get(username)
+        if chat_id is None:
             return jsonify({
                 'error': f'User "{username}" not found in database'
             }), 404
         
-        chat_id = users[username]
-        
-        # Send message via Telegram API
-        try:
-            result = send_telegram_message(chat_id, message)
-            return jsonify({
+        # Queue through the outbox and wait for the delivery outcome
+        delivered = threading.Event()
+        message_id, reason = queue_send(chat_id, message, on_done=lambda _id, ok: delivered.set(),
+                                       priority=priority)
+        if reason == 'conflict':
+            return jsonify(KEY_CONFLICT), 422
+        if reason is None and not (delivered.wait(SEND_TIMEOUT) and outbox.sync(SEND_TIMEOUT)):
+            record = None
+        else:
+            # A replay or duplicate answers with the earlier message's current state
+            record = outbox.get(message_id)
+
+        if record is None or record['status'] not in (SENT, FAILED):
+            # Still retrying (e.g. rate limited); the client can poll /messages/<id>
+            return send_response({
                 'success': True,
-                'message': 'Message sent successfully',
-                'chat_id': chat_id,
-                'telegram_response': result
-            }), 200
-        except Exception as e:
-            return jsonify({
+                'message': 'Message queued',
+                'message_id': message_id,
+                'chat_id': chat_id
+            }, 202, reason)
+        if record['status'] == FAILED:
+            return send_response({
                 'error': 'Failed to send message via Telegram API',
-                'details': str(e)
-            }), 500
+                'details': record['error'],
+                'message_id': message_id
+            }, 500, reason)
+        return send_response({
+            'success': True,
+            'message': 'Message sent successfully',
+            'message_id': message_id,
+            'chat_id': chat_id,
+            'telegram_response': {'ok': True, 'result': {'message_id': record['telegram_message_id']}}
+        }, 200, reason)
             
     except Exception as e:
+        log.exception("Send failed", extra={'route': request.path})
         return jsonify({
             'error': 'Internal server error',
             'details': str(e)
@@ -102,7 +391,7 @@ def send_message():
 
 @app.route('/send-message', methods=['POST'])
 def send_message_alt():
-    """Alternative endpoint that accepts target_username instead of username."""
+    """Alternative endpoint that accepts target_username; queues the message and returns 202."""
     try:
         # Get JSON data from request
         data = request.get_json()
@@ -120,67 +409,376 @@ def send_message_alt():
         
         if not message:
             return jsonify({'error': 'Message is required'}), 400
+
+        # Checked before the idempotency and duplicate lookups, which expect text
+        if not isinstance(username, str) or not isinstance(message, str):
+            return jsonify({'error': 'username and message must be strings'}), 400
+
+        # 'high' skips the coalescing window (e.g. the final alert message)
+        priority = data.get('priority', NORMAL)
+        if priority not in PRIORITIES:
+            return jsonify({'error': f'priority must be one of {", ".join(PRIORITIES)}'}), 400
         
-        # Load users database
-        users = load_users()
-        
-        # Find chat_id for username
-        if username not in users:
+        # Find chat_id for username (exact match, then normalized)
+        chat_id = registry.get(username)
+        if chat_id is None:
             return jsonify({
                 'error': f'User "{username}" not found in database'
             }), 404
         
-        chat_id = users[username]
-        
-        # Send message via Telegram API
-        try:
-            result = send_telegram_message(chat_id, message)
-            return jsonify({
-                'success': True,
-                'message': 'Message sent successfully',
-                'chat_id': chat_id,
-                'telegram_response': result
-            }), 200
-        except Exception as e:
-            return jsonify({
-                'error': 'Failed to send message via Telegram API',
-                'details': str(e)
-            }), 500
+        # Queue for delivery; the dispatcher handles rate limits and retries
+        message_id, reason = queue_send(chat_id, message, priority=priority)
+        if reason == 'conflict':
+            return jsonify(KEY_CONFLICT), 422
+        return send_response({
+            'success': True,
+            'message': 'Message queued',
+            'message_id': message_id,
+            'chat_id': chat_id
+        }, 202, reason)
             
     except Exception as e:
+        log.exception("Send failed", extra={'route': request.path})
         return jsonify({
             'error': 'Internal server error',
             'details': str(e)
         }), 500
 
 
+@app.route('/messages/<message_id>', methods=['GET'])
+def get_message(message_id):
+    """Delivery status of a queued message: queued, sent or failed (with Telegram's message_id)."""
+    record = outbox.get(message_id)
+    if record is None:
+        return jsonify({'error': f'Message "{message_id}" not found'}), 404
+    return jsonify(dict(record, success=True)), 200
+
+
+@app.route('/alerts', methods=['POST'])
+def create_alert():
+    """Start a server-side alert session that messages guardians on a fixed cadence."""
+    try:
+        data = request.get_json(silent=True)
+
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+
+        guardians = data.get('guardians')
+        messages = data.get('messages') or ([data['message']] if data.get('message') else None)
+        final_message = data.get('final_message')
+
+        # Validate required fields
+        if not guardians or not isinstance(guardians, list) or \
+                not all(isinstance(g, str) and g.strip() for g in guardians):
+            return jsonify({'error': 'guardians must be a non-empty list of usernames'}), 400
+
+        if not messages or not isinstance(messages, list) or \
+                not all(isinstance(m, str) and m.strip() for m in messages):
+            return jsonify({'error': 'messages (list of strings) or message is required'}), 400
+
+        if final_message is not None and not isinstance(final_message, str):
+            return jsonify({'error': 'final_message must be a string'}), 400
+
+        try:
+            cadence = float(data.get('cadence', 1))
+            duration = float(data.get('duration', 60))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'cadence and duration must be numbers (seconds)'}), 400
+
+        if not (math.isfinite(cadence) and math.isfinite(duration)):
+            return jsonify({'error': 'cadence and duration must be finite numbers (seconds)'}), 400
+
+        if cadence < MIN_ALERT_CADENCE:
+            return jsonify({'error': f'cadence must be at least {MIN_ALERT_CADENCE} seconds'}), 400
+
+        if not 0 < duration <= MAX_ALERT_DURATION:
+            return jsonify({'error': f'duration must be between 0 and {MAX_ALERT_DURATION} seconds'}), 400
+
+        session = alert_scheduler.create(guardians, messages, cadence, duration, final_message)
+        return jsonify(dict(session.to_dict(), success=True)), 201
+
+    except Exception as e:
+        log.exception("Creating alert failed", extra={'route': request.path})
+        return jsonify({
+            'error': 'Internal server error',
+            'details': str(e)
+        }), 500
+
+
+@app.route('/alerts/<alert_id>', methods=['GET'])
+def get_alert(alert_id):
+    """Report an alert session's progress (messages sent so far)."""
+    session = alert_scheduler.get(alert_id)
+    if session is None:
+        return jsonify({'error': f'Alert "{alert_id}" not found'}), 404
+    return jsonify(dict(session.to_dict(), success=True)), 200
+
+
+@app.route('/alerts/<alert_id>', methods=['DELETE'])
+def cancel_alert(alert_id):
+    """Cancel an alert session (e.g. false alarm). No final message is sent."""
+    session = alert_scheduler.cancel(alert_id)
+    if session is None:
+        return jsonify({'error': f'Alert "{alert_id}" not found'}), 404
+    return jsonify(dict(session.to_dict(), success=True)), 200
+
+
+USERS_PAGE_DEFAULT = int(os.getenv('USERS_PAGE_DEFAULT', 100))
+USERS_PAGE_MAX = int(os.getenv('USERS_PAGE_MAX', 1000))
+# Usernames per write when streaming /users?format=ndjson
+USERS_STREAM_CHUNK = 500
+
+# Full /users body, serialized once per registry reload: (reload_count, body)
+users_body = (None, None)
+
+
+def stream_usernames(usernames):
+    """NDJSON lines, written in chunks as the registry snapshot is walked."""
+    chunk = []
+    for username in usernames:
+        chunk.append(json.dumps({'username': username}) + '\n')
+        if len(chunk) >= USERS_STREAM_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
 @app.route('/users', methods=['GET'])
 def get_users():
-    """Endpoint to get list of all users."""
+    """Registered usernames.
+
+    Without parameters: every username in one JSON list (cached per registry reload).
+    ?limit=&after=&prefix=: one page in sorted order, with `next` as the cursor for the
+    following page. ?format=ndjson streams every match as one JSON object per line.
+    """
+    global users_body
     try:
-        users = load_users()
-        # Return just the usernames as a list
-        return jsonify({
-            'success': True,
-            'users': list(users.keys())
-        }), 200
+        args = request.args
+        prefix = args.get('prefix', '')
+        after = args.get('after')
+        if args.get('format') == 'ndjson':
+            return Response(stream_usernames(registry.iter_usernames(after, prefix)),
+                            mimetype='application/x-ndjson')
+
+        if 'limit' in args or after is not None or prefix:
+            try:
+                limit = int(args.get('limit', USERS_PAGE_DEFAULT))
+            except ValueError:
+                return jsonify({'error': 'limit must be an integer'}), 400
+            if not 1 <= limit <= USERS_PAGE_MAX:
+                return jsonify({'error': f'limit must be between 1 and {USERS_PAGE_MAX}'}), 400
+            usernames, next_cursor = registry.page(after, prefix, limit)
+            return jsonify({'success': True, 'users': usernames, 'next': next_cursor}), 200
+
+        registry.refresh()
+        # Read before loading: a reload in between only makes the cached body look older than it is
+        reload_count = registry.reload_count
+        cached_reload, body = users_body
+        if cached_reload != reload_count:
+            # Return just the usernames as a list
+            body = json.dumps({'success': True, 'users': list(load_users().keys())})
+            users_body = (reload_count, body)
+        return Response(body, status=200, mimetype='application/json')
     except Exception as e:
+        log.exception("Loading users failed", extra={'route': request.path})
         return jsonify({
             'error': 'Failed to load users',
             'details': str(e)
         }), 500
 
 
+def presence_etag(presence):
+    """Stable ETag for a presence answer."""
+    body = json.dumps(sorted(presence.items()), separators=(',', ':'))
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()[:16]
+
+
+@app.route('/users/presence', methods=['POST'])
+def users_presence():
+    """Endpoint to check whether specific usernames have started the bot.
+
+    Supports If-None-Match (304 when unchanged) and ?wait=<seconds> to hold
+    the request open until the answer changes, e.g. a guardian connects.
+    """
+    try:
+        data = request.get_json(silent=True)
+
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+
+        usernames = data.get('usernames')
+        if not usernames or not isinstance(usernames, list) or not all(isinstance(u, str) for u in usernames):
+            return jsonify({'error': 'usernames must be a non-empty list of strings'}), 400
+
+        if len(usernames) > MAX_PRESENCE_USERNAMES:
+            return jsonify({'error': f'at most {MAX_PRESENCE_USERNAMES} usernames per request'}), 400
+
+        try:
+            wait = min(float(request.args.get('wait', 0)), MAX_PRESENCE_WAIT)
+        except ValueError:
+            return jsonify({'error': 'wait must be a number (seconds)'}), 400
+
+        presence = registry.presence(usernames)
+        etag = presence_etag(presence)
+
+        if wait > 0:
+            # Wait for a change relative to what the client already has or,
+            # without an ETag, until someone who isn't connected yet connects
+            if request.if_none_match:
+                baseline = etag if request.if_none_match.contains(etag) else None
+            else:
+                baseline = etag if not all(presence.values()) else None
+
+            deadline = time.monotonic() + wait
+            while baseline is not None and etag == baseline:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                registry.wait_for_change(registry.reload_count, remaining)
+                presence = registry.presence(usernames)
+                etag = presence_etag(presence)
+
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = jsonify({
+                'success': True,
+                'users': presence,
+                'connected': [name for name, connected in presence.items() if connected]
+            })
+        response.set_etag(etag)
+        return response
+
+    except Exception as e:
+        log.exception("Presence check failed", extra={'route': request.path})
+        return jsonify({
+            'error': 'Failed to check presence',
+            'details': str(e)
+        }), 500
+
+
+def format_sse(event):
+    """Serialize a registry change event as a Server-Sent Events message."""
+    data = json.dumps({'username': event['username'], 'at': event['at']})
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+@app.route('/users/events', methods=['GET'])
+def users_events():
+    """Stream user_registered / chat_id_changed events as Server-Sent Events.
+
+    Resume with ?cursor=<id> or the Last-Event-ID header; without either the
+    stream starts from now. ?cursor=0 replays the retained history.
+    """
+    cursor = request.args.get('cursor', request.headers.get('Last-Event-ID'))
+    try:
+        cursor = int(cursor) if cursor is not None else registry.latest_event_id()
+    except ValueError:
+        return jsonify({'error': 'cursor must be an integer event id'}), 400
+
+    def generate(cursor):
+        # Tell EventSource clients how long to wait before reconnecting
+        yield "retry: 3000\n\n"
+        while True:
+            seen = registry.reload_count
+            events = registry.events_since(cursor)
+            for event in events:
+                cursor = event['id']
+                yield format_sse(event)
+            if not events and not registry.wait_for_change(seen, EVENTS_KEEPALIVE):
+                yield ": keepalive\n\n"
+
+    return Response(
+        stream_with_context(generate(cursor)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
-    return jsonify({'status': 'ok'}), 200
+    return jsonify({
+        'status': 'ok',
+        'registry': registry.stats(),
+        'dispatch': dispatcher.stats(),
+        'outbox': outbox.stats(),
+        'send_guard': send_guard.stats(),
+        'admission': admission.stats(),
+        'alerts': alert_scheduler.stats(),
+        'profiling': profiler.stats(),
+        'telegram': telegram.stats()
+    }), 200
+
+
+def admin_denied():
+    """Error response unless the request carries ADMIN_TOKEN, else None."""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    header = request.headers.get('Authorization', '')
+    token = header[len('Bearer '):] if header.startswith('Bearer ') else ''
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Admin token required'}), 401
+    return None
+
+
+@app.route('/admin/profiling', methods=['GET'])
+def get_profiling():
+    """Profiling settings, counters and the kept captures of every service."""
+    denied = admin_denied()
+    if denied:
+        return denied
+    return jsonify({'profiling': profiler.stats(), 'captures': profiler.captures()}), 200
+
+
+@app.route('/admin/profiling', methods=['POST'])
+def set_profiling():
+    """Switch profiling on/off or change its settings, for every API worker and bot_server."""
+    denied = admin_denied()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    enabled = data.get('enabled')
+    sample_rate = data.get('sample_rate')
+    slow_threshold = data.get('slow_threshold')
+    if enabled is not None and not isinstance(enabled, bool):
+        return jsonify({'error': 'enabled must be true or false'}), 400
+    if sample_rate is not None and (not isinstance(sample_rate, (int, float)) or not 0 <= sample_rate <= 1):
+        return jsonify({'error': 'sample_rate must be between 0 and 1'}), 400
+    if slow_threshold is not None and (not isinstance(slow_threshold, (int, float)) or slow_threshold <= 0):
+        return jsonify({'error': 'slow_threshold must be a positive number of seconds'}), 400
+    settings = profiler.configure(enabled=enabled, sample_rate=sample_rate, slow_threshold=slow_threshold)
+    log.warning("Profiling settings changed", extra=settings)
+    return jsonify(settings), 200
+
+
+@app.route('/admin/profiles/<capture_id>', methods=['GET'])
+def download_profile(capture_id):
+    """One capture as ?format=collapsed (flamegraph.pl / speedscope) or ?format=pstats (pstats/snakeviz)."""
+    denied = admin_denied()
+    if denied:
+        return denied
+    fmt = request.args.get('format', 'collapsed')
+    path = profiler.capture_path(capture_id, fmt)
+    if path is None:
+        return jsonify({'error': f'No {fmt} profile for {capture_id}'}), 404
+    mimetype = 'text/plain' if fmt == 'collapsed' else 'application/octet-stream'
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=f'{capture_id}.{fmt}')
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics (request latency, Telegram calls, registry, dispatch)."""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
 
 
 if __name__ == '__main__':
     host = os.getenv('FLASK_HOST', '0.0.0.0')
     port = int(os.getenv('FLASK_PORT', 5000))
-    print("🚀 Flask API Server starting...")
-    print(f"📡 Server will be available at http://{host}:{port}")
-    print("💡 Use your local IP address (e.g., http://192.168.1.5:5000) to access from mobile devices")
+    # Use your local IP address (e.g. http://192.168.1.5:5000) to reach it from mobile devices
+    log.info("Flask API server starting (debug)", extra={'url': f"http://{host}:{port}"})
+    # The reloader's watcher process also runs this file; only the child serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
     app.run(host=host, port=port, debug=True)
@@ -0,0 +1,11 @@
+"""Load tests and benchmarks for api_server and bot_server.
+
+Everything runs locally against a stand-in Telegram Bot API
+(bench/fake_telegram.py), so no real messages are sent. Run from Backend/:
+
+    python -m bench.run wards --wards 200 --duration 30
+    python -m bench.run alerts --storms 10 --guardians 3 --duration 20
+    python -m bench.run registrations --users 20000
+
+See `python -m bench.run --help` for all options.
+"""
@@ -0,0 +1,195 @@
+"""Local stand-in for the Telegram Bot API.
+
+Implements getMe, getUpdates (with long polling), sendMessage, setWebhook and
+deleteWebhook under /bot<token>/<method>. Point a server at it with
+TELEGRAM_API_BASE=http://127.0.0.1:<port>.
+
+Latency and rate limiting are configurable:
+
+- `latency` (+ up to `jitter`) seconds are added to every call
+- `error_rate` is the fraction of sendMessage calls answered with 429
+- `chat_rate` enforces Telegram's per-chat limit (messages/second, 0 = off)
+  and answers 429 with retry_after when a chat exceeds it
+
+Run standalone with `python -m bench.fake_telegram --port 8081`.
+"""
+import argparse
+import collections
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegram:
+    """In-memory Bot API state plus the HTTP server that serves it."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 chat_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chat_rate = chat_rate
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._last_sent = {}
+        self.sent = collections.deque(maxlen=1000000)  # (received_at, chat_id, text)
+        self.counters = collections.Counter()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self.host, self.port = self._httpd.server_address[:2]
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, name='fake-telegram', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def push_update(self, username, chat_id, text='/start'):
+        """Queue an incoming message update, as if a user wrote to the bot."""
+        with self._cond:
+            update = {
+                'update_id': self._next_update_id,
+                'message': {
+                    'message_id': self._next_update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'from': {'id': chat_id, 'is_bot': False, 'first_name': username, 'username': username},
+                    'text': text,
+                },
+            }
+            self._next_update_id += 1
+            self._updates.append(update)
+            self._cond.notify_all()
+        return update
+
+    def sent_by_chat(self):
+        """Map chat_id -> sorted receive times of the messages sent to it."""
+        by_chat = collections.defaultdict(list)
+        for received_at, chat_id, _ in list(self.sent):
+            by_chat[chat_id].append(received_at)
+        return {chat_id: sorted(times) for chat_id, times in by_chat.items()}
+
+    # -- Bot API methods ---------------------------------------------------------
+
+    def get_me(self, params):
+        return {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+
+    def get_updates(self, params):
+        offset = params.get('offset')
+        limit = params.get('limit', 100)
+        deadline = time.monotonic() + min(float(params.get('timeout', 0)), 50)
+        with self._cond:
+            while True:
+                if offset is not None and offset < 0:
+                    return self._updates[offset:][:limit]
+                if offset:
+                    # Confirmed updates are forgotten, like Telegram does
+                    self._updates = [u for u in self._updates if u['update_id'] >= offset]
+                if self._updates:
+                    return self._updates[:limit]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+
+    def send_message(self, params):
+        chat_id = params.get('chat_id')
+        now = time.monotonic()
+        with self._cond:
+            if self.error_rate and random.random() < self.error_rate:
+                return None
+            if self.chat_rate:
+                last = self._last_sent.get(chat_id)
+                if last is not None and now - last < 1.0 / self.chat_rate:
+                    return None
+                self._last_sent[chat_id] = now
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self.sent.append((time.time(), chat_id, params.get('text', '')))
+        return {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': chat_id}, 'text': params.get('text')}
+
+    def _dispatch(self, method, params):
+        """Return (status, body) for one API call."""
+        handlers = {
+            'getMe': self.get_me,
+            'getUpdates': self.get_updates,
+            'sendMessage': self.send_message,
+            'setWebhook': lambda params: True,
+            'deleteWebhook': lambda params: True,
+        }
+        handler = handlers.get(method)
+        if handler is None:
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}
+        if method != 'getUpdates' and (self.latency or self.jitter):
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        result = handler(params)
+        if method == 'sendMessage' and result is None:
+            self.counters['429'] += 1
+            return 429, {
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }
+        self.counters[method] += 1
+        return 200, {'ok': True, 'result': result}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; don't let Nagle delay the body
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    params = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    params = {}
+                method = self.path.rsplit('/', 1)[-1]
+                status, body = fake._dispatch(method, params)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for the Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every call")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random latency, up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of sendMessage calls answered 429")
+    parser.add_argument('--chat-rate', type=float, default=0.0, help="enforced messages/second per chat (0 = off)")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.host, args.port, args.latency, args.jitter, args.error_rate, args.chat_rate).start()
+    print(f"🧪 Fake Telegram Bot API on {fake.url} (set TELEGRAM_API_BASE to this)")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"📊 {dict(fake.counters)}")
+    except KeyboardInterrupt:
+        fake.stop()
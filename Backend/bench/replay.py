@@ -0,0 +1,254 @@
+"""Record and replay getUpdates streams through bot_server.handle_updates.
+
+    # Capture live traffic (stop bot_server first: this consumes the updates)
+    python -m bench.replay record capture.jsonl.gz --duration 600
+    # ...or run bot_server with BOT_RECORD_FILE=capture.jsonl.gz
+
+    # Synthesize a large stream
+    python -m bench.replay generate big.jsonl.gz --users 100000
+
+    # Replay at full speed with sends stubbed out
+    python -m bench.replay replay big.jsonl.gz --store sqlite --output after.json
+    python -m bench.replay replay big.jsonl.gz --diff after.json
+
+Replays run against a throwaway user store (optionally seeded with --base),
+report updates/s, per-batch latency and registry write cost as the registry
+grows, and can diff the resulting registry against a saved one.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+from bench.report import Recorder, print_report, write_json
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from update_log import UpdateRecorder, read_batches  # noqa: E402
+
+
+def record(args):
+    """Poll the real Bot API and save every batch."""
+    from dotenv import load_dotenv
+    from telegram_client import TelegramClient
+
+    load_dotenv(os.path.join(BACKEND_DIR, '.env'))
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        raise ValueError("TELEGRAM_BOT_TOKEN environment variable is required.")
+    telegram = TelegramClient(token)
+    recorder = UpdateRecorder(args.file)
+    print(f"🎙️ Recording getUpdates to {args.file} for {args.duration}s (bot_server must be stopped)...")
+    deadline = time.monotonic() + args.duration
+    offset = None
+    count = 0
+    try:
+        while time.monotonic() < deadline:
+            updates = telegram.get_updates(offset=offset, timeout=min(30, max(1, int(deadline - time.monotonic()))))
+            if updates:
+                recorder.write_batch(updates)
+                count += len(updates)
+                offset = max(update['update_id'] for update in updates) + 1
+                print(f"📨 {count} updates recorded")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+    print(f"✅ Recorded {count} updates in {recorder.batches} batches")
+
+
+def generate(args):
+    """Write a synthetic stream: /start from new users, plus repeats and chat_id changes."""
+    rng = random.Random(args.seed)
+    recorder = UpdateRecorder(args.file)
+    commands = ['/start', '/hello', '/info', 'hi']
+    update_id = 1
+    chat_ids = {}
+    at = time.time()
+    new_users = 0
+    while new_users < args.users:
+        batch = []
+        for _ in range(args.batch):
+            roll = rng.random()
+            if not chat_ids or roll >= args.repeat_ratio + args.change_ratio:
+                username = f'user{new_users}'
+                new_users += 1
+                chat_ids[username] = 10 ** 9 + new_users
+                text = '/start'
+            else:
+                username = f'user{rng.randrange(len(chat_ids))}'
+                if roll < args.change_ratio:
+                    chat_ids[username] += 10 ** 8  # user re-installed Telegram / new chat
+                text = rng.choice(commands)
+            chat_id = chat_ids[username]
+            batch.append({
+                'update_id': update_id,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(at),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'from': {'id': chat_id, 'is_bot': False, 'first_name': username, 'username': username},
+                    'text': text,
+                },
+            })
+            update_id += 1
+            if new_users >= args.users:
+                break
+        recorder.write_batch(batch, at=at)
+        at += 1
+    recorder.close()
+    print(f"✅ Wrote {update_id - 1} updates for {len(chat_ids)} users to {args.file}")
+
+
+def load_registry(path):
+    """Read a registry from a .json file or a SQLite .db file."""
+    from user_store import JsonUserStore, SqliteUserStore
+    if path.endswith('.json'):
+        return JsonUserStore(path).load_all() or {}
+    return SqliteUserStore(path).load_all()
+
+
+def diff_registries(expected, actual):
+    added = sorted(set(actual) - set(expected))
+    removed = sorted(set(expected) - set(actual))
+    changed = sorted(name for name in set(expected) & set(actual) if expected[name] != actual[name])
+    return added, removed, changed
+
+
+def replay(args):
+    """Feed a recording through handle_updates with Telegram sends stubbed out."""
+    workdir = tempfile.mkdtemp(prefix='breathr-replay-')
+    db_path = os.path.join(workdir, 'users.db')
+    json_path = os.path.join(workdir, 'users.json')
+    if args.base:
+        shutil.copy(args.base, json_path if args.base.endswith('.json') else db_path)
+    os.environ.update(
+        TELEGRAM_BOT_TOKEN='replay-token',
+        TELEGRAM_API_BASE='http://127.0.0.1:9',  # never contacted: sends are stubbed
+        USER_STORE=args.store,
+        USER_DB_FILE=db_path,
+        USERS_FILE=json_path,
+        USER_JOURNAL_DIR=os.path.join(workdir, 'users.journal'),
+        BOT_METRICS_PORT='0',
+        BOT_RECORD_FILE='',
+    )
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        os.environ['REGISTRY_NOTIFY_PORT'] = str(sock.getsockname()[1])
+
+    import bot_server
+
+    replies = []
+    bot_server.send_message = lambda chat_id, text: replies.append(chat_id)
+    save_recorder = Recorder('registry write')
+    real_save = bot_server.save_database
+
+    def timed_save(changes):
+        started = time.perf_counter()
+        real_save(changes)
+        save_recorder.record(time.perf_counter() - started)
+    bot_server.save_database = timed_save
+
+    batch_recorder = Recorder('handle_updates batch')
+    user_db = bot_server.load_database()
+    total = 0
+    checkpoints = []
+    window_started = time.perf_counter()
+    window_updates = 0
+    window_saves = len(save_recorder.latencies)
+    next_checkpoint = args.checkpoint
+
+    print(f"▶️ Replaying {args.file} ({args.store} store, {len(user_db)} users to start)...")
+    if not args.verbose:
+        # bot_server logs every registration; keep the output to the report
+        logging.getLogger().setLevel(logging.WARNING)
+    for _, updates in read_batches(args.file):
+        started = time.perf_counter()
+        bot_server.handle_updates(updates, user_db)
+        batch_recorder.record(time.perf_counter() - started)
+        total += len(updates)
+        window_updates += len(updates)
+        if total >= next_checkpoint:
+            elapsed = time.perf_counter() - window_started
+            saves = save_recorder.latencies[window_saves:]
+            checkpoints.append((total, len(user_db), window_updates / elapsed,
+                                sum(saves) / len(saves) * 1000 if saves else 0.0))
+            window_started, window_updates, window_saves = time.perf_counter(), 0, len(save_recorder.latencies)
+            next_checkpoint += args.checkpoint
+    batch_recorder.stop()
+    save_recorder.stop()
+
+    if checkpoints:
+        print(f"{'updates':>10}{'users':>10}{'updates/s':>12}{'avg write ms':>14}")
+        for updates_done, users, rate, write_ms in checkpoints:
+            print(f"{updates_done:>10}{users:>10}{rate:>12.0f}{write_ms:>14.2f}")
+
+    elapsed = batch_recorder.finished - batch_recorder.started
+    extra = {
+        'updates': total,
+        'updates_per_second': round(total / elapsed, 1) if elapsed else 0.0,
+        'registry_users': len(user_db),
+        'replies_stubbed': len(replies),
+    }
+
+    registry = bot_server.load_database()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(registry, f, indent=2)
+        extra['registry_written_to'] = args.output
+    if args.diff:
+        added, removed, changed = diff_registries(load_registry(args.diff), registry)
+        extra['diff'] = f"+{len(added)} added, -{len(removed)} removed, ~{len(changed)} changed vs {args.diff}"
+        for label, names in (('added', added), ('removed', removed), ('changed', changed)):
+            if names:
+                extra[f'{label}_sample'] = ', '.join(names[:5])
+
+    report = print_report(f"replay: {args.file}", [batch_recorder, save_recorder], extra)
+    report['checkpoints'] = checkpoints
+    if args.json:
+        write_json(args.json, report)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay Telegram update streams")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('record', help="capture live getUpdates batches")
+    p.add_argument('file')
+    p.add_argument('--duration', type=int, default=300, help="seconds to record")
+    p.set_defaults(func=record)
+
+    p = sub.add_parser('generate', help="write a synthetic update stream")
+    p.add_argument('file')
+    p.add_argument('--users', type=int, default=100000, help="distinct users to register")
+    p.add_argument('--batch', type=int, default=100, help="updates per batch (getUpdates returns up to 100)")
+    p.add_argument('--repeat-ratio', type=float, default=0.2, help="share of updates from known users")
+    p.add_argument('--change-ratio', type=float, default=0.01, help="share of updates with a new chat_id")
+    p.add_argument('--seed', type=int, default=1)
+    p.set_defaults(func=generate)
+
+    p = sub.add_parser('replay', help="replay a recording through handle_updates")
+    p.add_argument('file')
+    p.add_argument('--store', choices=['sqlite', 'journal', 'json'], default='sqlite')
+    p.add_argument('--base', help="registry (.json or .db) to start from instead of an empty one")
+    p.add_argument('--output', help="write the resulting registry to this JSON file")
+    p.add_argument('--diff', help="compare the resulting registry with this .json or .db registry")
+    p.add_argument('--checkpoint', type=int, default=10000, help="print throughput every N updates")
+    p.add_argument('--verbose', action='store_true', help="keep bot_server's per-update output")
+    p.add_argument('--json', help="also write the report to this file")
+    p.set_defaults(func=replay)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
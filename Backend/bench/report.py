@@ -0,0 +1,74 @@
+"""Latency/throughput recording and reporting for the benchmark scenarios."""
+import json
+import threading
+import time
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+class Recorder:
+    """Thread-safe collector of latencies (seconds) and errors for one measurement."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, seconds, ok=True):
+        with self._lock:
+            self.latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        values = sorted(self.latencies)
+        return {
+            'name': self.name,
+            'count': len(values),
+            'errors': self.errors,
+            'elapsed_s': round(elapsed, 3),
+            'per_second': round(len(values) / elapsed, 1) if elapsed > 0 else 0.0,
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2) if values else 0.0,
+        }
+
+
+def print_report(title, recorders, extra=None):
+    """Print a results table; returns the summaries for --json output."""
+    summaries = [recorder.summary() for recorder in recorders]
+    print("=" * 78)
+    print(f"📊 {title}")
+    print("=" * 78)
+    print(f"{'measurement':<28}{'count':>8}{'err':>6}{'/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for s in summaries:
+        print(f"{s['name']:<28}{s['count']:>8}{s['errors']:>6}{s['per_second']:>9}"
+              f"{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}")
+    for key, value in (extra or {}).items():
+        print(f"   {key}: {value}")
+    print("=" * 78)
+    return {'title': title, 'results': summaries, 'extra': extra or {}}
+
+
+def write_json(path, report):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Report written to {path}")
@@ -0,0 +1,318 @@
+"""Benchmark scenario drivers.
+
+Each scenario starts a fake Telegram Bot API in-process and (for the API
+scenarios) launches serve_api.py against it with a throwaway user store, so
+runs never touch users.db or the real Telegram API.
+
+    wards          N wards polling GET /users every --interval seconds
+    alerts         M concurrent alert storms at 1 msg/s per guardian
+    registrations  a burst of /start updates through bot_server.handle_updates
+
+Every scenario prints p50/p95/p99 latency and throughput; --json saves the
+numbers so runs can be compared.
+"""
+import argparse
+import contextlib
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from bench.fake_telegram import FakeTelegram
+from bench.report import Recorder, print_report, write_json
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def seed_users(db_path, users):
+    """Write username -> chat_id pairs into a fresh SQLite user store."""
+    sys.path.insert(0, BACKEND_DIR)
+    from user_store import SqliteUserStore
+    SqliteUserStore(db_path).upsert_many(users)
+
+
+class APIServer:
+    """serve_api.py running in a subprocess against the fake Telegram API."""
+
+    def __init__(self, fake, workdir, workers, threads):
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.env = dict(
+            os.environ,
+            TELEGRAM_BOT_TOKEN='bench-token',
+            TELEGRAM_API_BASE=fake.url,
+            USER_STORE='sqlite',
+            USER_DB_FILE=os.path.join(workdir, 'users.db'),
+            USERS_FILE=os.path.join(workdir, 'users.json'),
+            ALERTS_DB_FILE=os.path.join(workdir, 'alerts.db'),
+            # Never leave bench messages queued in the real outbox
+            OUTBOX_DB_FILE=os.path.join(workdir, 'outbox.db'),
+            METRICS_DIR=os.path.join(workdir, 'metrics'),
+            PROFILE_DIR=os.path.join(workdir, 'profiles'),
+            FLASK_HOST='127.0.0.1',
+            FLASK_PORT=str(self.port),
+            REGISTRY_NOTIFY_PORT=str(free_port(socket.SOCK_DGRAM)),
+            # Every simulated client shares 127.0.0.1, so per-IP budgets would throttle the load itself
+            ADMISSION_CONTROL='off',
+        )
+        self.command = [sys.executable, 'serve_api.py', '--workers', str(workers), '--threads', str(threads)]
+        self.process = None
+
+    def start(self, timeout=30):
+        self.process = subprocess.Popen(self.command, cwd=BACKEND_DIR, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"serve_api.py exited with code {self.process.returncode}")
+            try:
+                if requests.get(f'{self.url}/health', timeout=1).ok:
+                    return self
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("serve_api.py did not become healthy in time")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+@contextlib.contextmanager
+def api_environment(args, users):
+    """Fake Telegram + seeded store + running API server for one scenario."""
+    fake = FakeTelegram(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        chat_rate=args.chat_rate).start()
+    with tempfile.TemporaryDirectory(prefix='breathr-bench-') as workdir:
+        seed_users(os.path.join(workdir, 'users.db'), users)
+        server = APIServer(fake, workdir, args.workers, args.threads)
+        print(f"🚀 Starting API ({args.workers} worker(s) x {args.threads} threads) on {server.url}...")
+        server.start()
+        try:
+            yield fake, server
+        finally:
+            server.stop()
+            fake.stop()
+
+
+def run_threads(targets):
+    threads = [threading.Thread(target=target, daemon=True) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def scenario_wards(args):
+    """N wards each fetching GET /users every interval seconds."""
+    users = {f'ward{i}': 100000 + i for i in range(max(args.wards, args.registry_size))}
+    recorder = Recorder('GET /users')
+
+    with api_environment(args, users) as (fake, server):
+        deadline = time.monotonic() + args.duration
+
+        def ward():
+            session = requests.Session()
+            # Spread the wards over the interval like real clients would be
+            next_at = time.monotonic() + random.uniform(0, args.interval)
+            while True:
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if time.monotonic() >= deadline:
+                    return
+                started = time.perf_counter()
+                try:
+                    ok = session.get(f'{server.url}/users', timeout=10).ok
+                except requests.exceptions.RequestException:
+                    ok = False
+                recorder.record(time.perf_counter() - started, ok)
+                next_at += args.interval
+
+        print(f"👥 {args.wards} wards polling every {args.interval}s for {args.duration}s...")
+        run_threads([ward] * args.wards)
+        recorder.stop()
+
+    return print_report(f"wards: {args.wards} wards, {len(users)} registered users", [recorder], {
+        'target_rate': f"{args.wards / args.interval:.1f} req/s",
+    })
+
+
+def scenario_alerts(args):
+    """M concurrent alert storms, each messaging G guardians at 1 msg/s."""
+    guardians = {
+        s: {f'guardian{s}_{g}': 200000 + s * 1000 + g for g in range(args.guardians)}
+        for s in range(args.storms)
+    }
+    users = {name: chat_id for storm in guardians.values() for name, chat_id in storm.items()}
+    request_recorder = Recorder(f'POST /{args.via}')
+    delivery_recorder = Recorder('delivery lag')
+    starts = {}
+
+    with api_environment(args, users) as (fake, server):
+        def storm(s):
+            session = requests.Session()
+            names = list(guardians[s])
+            starts[s] = time.time()
+
+            def post(path, body):
+                started = time.perf_counter()
+                try:
+                    ok = session.post(f'{server.url}{path}', json=body, timeout=10).ok
+                except requests.exceptions.RequestException:
+                    ok = False
+                request_recorder.record(time.perf_counter() - started, ok)
+
+            if args.via == 'alerts':
+                post('/alerts', {'guardians': names, 'message': f'storm {s}', 'cadence': 1,
+                                 'duration': args.duration})
+                return
+            # Old client behaviour: one /send-message per guardian per second
+            for k in range(args.duration):
+                next_at = starts[s] + k
+                delay = next_at - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                for name in names:
+                    post('/send-message', {'target_username': name, 'message': f'storm {s} #{k}'})
+
+        print(f"🚨 {args.storms} storms x {args.guardians} guardians via /{args.via} for {args.duration}s...")
+        run_threads([lambda s=s: storm(s) for s in range(args.storms)])
+        # Let the tail of the storms drain
+        time.sleep(args.duration + 3 if args.via == 'alerts' else 3)
+        request_recorder.stop()
+
+        sent = fake.sent_by_chat()
+        expected = len(users) * math.ceil(args.duration)
+        delivered = 0
+        for s, storm_guardians in guardians.items():
+            for chat_id in storm_guardians.values():
+                times = sent.get(chat_id, [])
+                delivered += len(times)
+                # Message k was due k seconds after the storm started
+                for k, received_at in enumerate(times):
+                    delivery_recorder.record(max(0.0, received_at - (starts[s] + k)))
+        delivery_recorder.started = request_recorder.started
+        delivery_recorder.stop()
+
+    return print_report(f"alerts: {args.storms} storms x {args.guardians} guardians via /{args.via}",
+                        [request_recorder, delivery_recorder], {
+                            'delivered': f"{delivered}/{expected} messages",
+                            'telegram_429s': fake.counters.get('429', 0),
+                        })
+
+
+def scenario_registrations(args):
+    """A burst of /start updates fed straight into bot_server.handle_updates."""
+    fake = FakeTelegram(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        chat_rate=args.chat_rate).start()
+    batch_recorder = Recorder(f'handle_updates x{args.batch}')
+    update_recorder = Recorder('per update')
+
+    with tempfile.TemporaryDirectory(prefix='breathr-bench-') as workdir:
+        os.environ.update(
+            TELEGRAM_BOT_TOKEN='bench-token',
+            TELEGRAM_API_BASE=fake.url,
+            USER_STORE=args.store,
+            USER_DB_FILE=os.path.join(workdir, 'users.db'),
+            USERS_FILE=os.path.join(workdir, 'users.json'),
+            USER_JOURNAL_DIR=os.path.join(workdir, 'users.journal'),
+            BOT_METRICS_PORT='0',
+            REGISTRY_NOTIFY_PORT=str(free_port(socket.SOCK_DGRAM)),
+        )
+        sys.path.insert(0, BACKEND_DIR)
+        import bot_server
+
+        updates = [fake.push_update(f'user{i}', 300000 + i) for i in range(args.users)]
+        user_db = {}
+        print(f"📨 Feeding {args.users} /start updates in batches of {args.batch} ({args.store} store)...")
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for i in range(0, len(updates), args.batch):
+                batch = updates[i:i + args.batch]
+                started = time.perf_counter()
+                bot_server.handle_updates(batch, user_db)
+                elapsed = time.perf_counter() - started
+                batch_recorder.record(elapsed)
+                for _ in batch:
+                    update_recorder.record(elapsed / len(batch))
+        batch_recorder.stop()
+        update_recorder.stop()
+        registered = len(bot_server.load_database())
+    fake.stop()
+
+    return print_report(f"registrations: {args.users} users", [batch_recorder, update_recorder], {
+        'registered': registered,
+        'replies_sent': fake.counters.get('sendMessage', 0),
+    })
+
+
+SCENARIOS = {
+    'wards': scenario_wards,
+    'alerts': scenario_alerts,
+    'registrations': scenario_registrations,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark api_server / bot_server against a fake Telegram API")
+    sub = parser.add_subparsers(dest='scenario', required=True)
+
+    def add_common(p):
+        p.add_argument('--latency', type=float, default=0.03, help="fake Telegram latency per call (s)")
+        p.add_argument('--jitter', type=float, default=0.0, help="extra random fake latency (s)")
+        p.add_argument('--error-rate', type=float, default=0.0, help="fraction of sendMessage calls answered 429")
+        p.add_argument('--chat-rate', type=float, default=0.0, help="per-chat msg/s enforced by the fake (0 = off)")
+        p.add_argument('--json', help="also write the report to this file")
+
+    def add_api(p):
+        p.add_argument('--workers', type=int, default=2, help="serve_api.py worker processes")
+        p.add_argument('--threads', type=int, default=16, help="serve_api.py threads per worker")
+        p.add_argument('--duration', type=int, default=20, help="seconds to run")
+
+    p = sub.add_parser('wards', help="N wards polling GET /users")
+    add_common(p)
+    add_api(p)
+    p.add_argument('--wards', type=int, default=100)
+    p.add_argument('--interval', type=float, default=3.0, help="seconds between polls per ward")
+    p.add_argument('--registry-size', type=int, default=0, help="registered users (default: one per ward)")
+
+    p = sub.add_parser('alerts', help="M concurrent alert storms")
+    add_common(p)
+    add_api(p)
+    p.add_argument('--storms', type=int, default=10)
+    p.add_argument('--guardians', type=int, default=3, help="guardians per storm")
+    p.add_argument('--via', choices=['alerts', 'send-message'], default='alerts',
+                   help="server-side alert sessions, or the old per-second /send-message loop")
+
+    p = sub.add_parser('registrations', help="/start burst through handle_updates")
+    add_common(p)
+    p.add_argument('--users', type=int, default=5000)
+    p.add_argument('--batch', type=int, default=100, help="updates per getUpdates batch")
+    p.add_argument('--store', choices=['sqlite', 'journal', 'json'], default='sqlite')
+    p.set_defaults(latency=0.0)
+
+    args = parser.parse_args()
+    report = SCENARIOS[args.scenario](args)
+    if args.json:
+        write_json(args.json, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""asyncio update pipeline for bot_server.
+
+Polling, update handling and reply sending run as separate stages connected
+by bounded queues:
+
+    poller -> update queue -> handler -> reply queue -> N reply senders
+                                 \\-> pending registry changes -> batched write
+
+Replies go out concurrently, so a burst of /start messages no longer delays
+the next getUpdates by one round-trip per reply. Offset semantics match the
+sync loop: the offset only moves past a batch once every update in it has
+been handled and the registry changes it produced have been written.
+
+The Bot API client is synchronous, so blocking calls run in worker threads.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class UpdatePipeline:
+    """Wires the stages together around bot_server's update logic.
+
+    process_update(update, user_db, changes) -> (chat_id, text) | None
+    send_message(chat_id, text)
+    save_changes(changes)
+    on_batch(updates), if given, is called after every getUpdates (even empty ones)
+    on_offset(last_update_id), if given, is called once a batch is handled and saved
+    is_active(), if given, is checked before every getUpdates; run() returns once it is False
+    profiler, if given, watches each batch from queueing to saved, including the
+    registry write and replies it hands to worker threads (see profiling.py)
+    """
+
+    def __init__(self, telegram, process_update, send_message, save_changes, user_db,
+                 reply_workers=8, queue_size=1000, poll_timeout=30, on_batch=None, on_offset=None,
+                 is_active=None, profiler=None):
+        self.telegram = telegram
+        self.process_update = process_update
+        self.send_message = send_message
+        self.save_changes = save_changes
+        self.user_db = user_db
+        self.reply_workers = reply_workers
+        self.queue_size = queue_size
+        self.poll_timeout = poll_timeout
+        self.on_batch = on_batch
+        self.on_offset = on_offset
+        self.is_active = is_active
+        self.profiler = profiler
+        self.poll_count = 0
+        self._capture = None
+        self._pending_changes = {}
+        self._updates = None
+        self._replies = None
+
+    def pending(self):
+        """Updates and replies queued between stages."""
+        if self._updates is None:
+            return 0
+        return self._updates.qsize() + self._replies.qsize()
+
+    async def run(self, last_update_id=None):
+        """Run until cancelled (or is_active() turns False). last_update_id is the newest update already handled."""
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(max_workers=self.reply_workers + 2)
+        )
+        self._updates = asyncio.Queue(self.queue_size)
+        self._replies = asyncio.Queue(self.queue_size)
+
+        tasks = [asyncio.create_task(self._handler(), name='update-handler')]
+        tasks += [
+            asyncio.create_task(self._reply_sender(), name=f'reply-sender-{i}')
+            for i in range(self.reply_workers)
+        ]
+        try:
+            await self._poller(last_update_id)
+        finally:
+            # Give replies already queued a moment to go out before shutting down
+            try:
+                await asyncio.wait_for(self._replies.join(), timeout=5)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _poller(self, last_update_id):
+        while self.is_active is None or self.is_active():
+            try:
+                offset = last_update_id + 1 if last_update_id else None
+                updates = await self._get_updates(offset)
+            except Exception as e:
+                log.error("Telegram API error, retrying in 5 seconds", extra={'error': str(e)})
+                await asyncio.sleep(5)
+                continue
+
+            if self.on_batch is not None:
+                self.on_batch(updates)
+
+            if not updates:
+                # No new updates - heartbeat every 10 polls (5 minutes)
+                self.poll_count += 1
+                log.info("Bot is alive, waiting for messages", extra={'poll': self.poll_count, 'every': 10})
+                continue
+
+            capture = self.profiler.start('batch', 'pipeline', updates=len(updates)) if self.profiler else None
+            self._capture = capture
+            try:
+                for update in updates:
+                    await self._updates.put(update)
+                # Don't confirm the batch to Telegram until it is handled and saved
+                await self._updates.join()
+                await self._flush()
+            finally:
+                self._capture = None
+                if self.profiler is not None:
+                    self.profiler.finish(capture)
+            last_update_id = max(update['update_id'] for update in updates)
+            if self.on_offset is not None:
+                await asyncio.to_thread(self.on_offset, last_update_id)
+
+    async def _get_updates(self, offset):
+        """getUpdates on a daemon thread of its own rather than the executor.
+
+        The long poll can't be interrupted, and shutting down waits for every
+        executor thread; on shutdown this one is abandoned instead, so stopping
+        (and handing the lease to a standby) doesn't take up to poll_timeout.
+        Telegram re-delivers the unconfirmed updates to the next poller.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result, error):
+            if not future.done():
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+        def poll():
+            result, error = None, None
+            try:
+                result = self.telegram.get_updates(offset=offset, timeout=self.poll_timeout)
+            except Exception as e:
+                error = e
+            try:
+                loop.call_soon_threadsafe(resolve, result, error)
+            except RuntimeError:
+                pass  # the loop is gone: we are shutting down
+
+        threading.Thread(target=poll, name='get-updates', daemon=True).start()
+        return await future
+
+    async def _handler(self):
+        while True:
+            update = await self._updates.get()
+            try:
+                reply = self.process_update(update, self.user_db, self._pending_changes)
+                if reply:
+                    await self._replies.put(reply)
+            except Exception:
+                log.exception("Failed to handle update", extra={'update_id': update.get('update_id')})
+            finally:
+                self._updates.task_done()
+
+    async def _reply_sender(self):
+        while True:
+            chat_id, text = await self._replies.get()
+            try:
+                await self._to_thread(self.send_message, chat_id, text)
+            finally:
+                self._replies.task_done()
+
+    async def _flush(self):
+        """Write all pending registry changes in one batch."""
+        if not self._pending_changes:
+            return
+        changes, self._pending_changes = self._pending_changes, {}
+        await self._to_thread(self.save_changes, changes)
+
+    async def _to_thread(self, func, *args):
+        """asyncio.to_thread, sampled as part of the batch being profiled (if any)."""
+        if self._capture is None:
+            return await asyncio.to_thread(func, *args)
+        return await asyncio.to_thread(self.profiler.run_in, self._capture, func, *args)
@@ -1,209 +1,366 @@
-import requests
+import argparse
+import asyncio
+import logging
+import secrets
+import signal
 import time
-import json
 import os
+import sys
 from dotenv import load_dotenv
+from user_store import open_user_store
+from registry_notify import notify_change
+from telegram_client import TelegramClient, TelegramError
+from bot_pipeline import UpdatePipeline
+from bot_webhook import WebhookServer
+import metrics as prom
+from update_log import UpdateRecorder
+from leader import LeaderLease
+from profiling import Profiler
+import logs
 
 # Load environment variables from .env file
 load_dotenv()
 
+logs.setup('bot_server')
+log = logging.getLogger('bot_server')
+
 # --- CONFIGURATION ---
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 if not TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable is required. Please create a .env file in the Backend directory.")
 
-# Get the directory where this script is located
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(SCRIPT_DIR, 'users.json')  # Always use absolute path
+# How updates arrive: 'polling' (default) or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Public HTTPS URL to register with Telegram (optional)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+
+# Polling update pipeline: 'async' (default) or 'sync' fallback
+BOT_PIPELINE = os.getenv('BOT_PIPELINE', 'async').lower()
+REPLY_WORKERS = int(os.getenv('BOT_REPLY_WORKERS', 8))
+
+# Polling lease shared by every bot_server instance on this machine: one polls,
+# the others stand by and take over within BOT_LEADER_TTL seconds (0 disables)
+BOT_LEADER_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv('BOT_LEADER_DB', 'bot_leader.db'))
+BOT_LEADER_TTL = float(os.getenv('BOT_LEADER_TTL', 15))
+
+# Prometheus metrics on http://BOT_METRICS_HOST:BOT_METRICS_PORT/metrics (0 disables)
+BOT_METRICS_HOST = os.getenv('BOT_METRICS_HOST', '0.0.0.0')
+BOT_METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', 9101))
+metrics = prom.MetricsRegistry()
+UPDATES_BATCH = metrics.histogram('bot_getupdates_batch_size', 'Updates per getUpdates response or webhook batch',
+                                  buckets=prom.SIZE_BUCKETS)
+UPDATE_LAG = metrics.histogram('bot_update_lag_seconds', 'Delay between a message being sent and the bot receiving it')
+UPDATES_TOTAL = metrics.counter('bot_updates_total', 'Updates received')
+UPDATES_PENDING = metrics.gauge('bot_updates_in_flight', 'Updates and replies queued inside the bot')
+REPLIES_IN_FLIGHT = metrics.gauge('bot_replies_in_flight', 'sendMessage replies currently being sent')
+REGISTRY_LOAD = metrics.histogram('registry_load_duration_seconds', 'Time to load the user registry')
+REGISTRY_SAVE = metrics.histogram('registry_save_duration_seconds', 'Time to write a batch of registry changes')
+REGISTRY_SAVE_SIZE = metrics.histogram('registry_save_changes', 'Users written per registry save',
+                                       buckets=prom.SIZE_BUCKETS)
+REGISTRY_USERS = metrics.gauge('registry_users', 'Users in the registry')
+IS_LEADER = metrics.gauge('bot_is_leader', '1 while this instance holds the polling lease')
+
+# Sampled batch profiles and slow-batch captures; toggled at runtime through
+# api_server's /admin/profiling or `python profiling.py on` (see profiling.py)
+profiler = Profiler.from_env('bot_server')
+
+# Optional capture of every incoming update batch for offline replay (bench/replay.py)
+BOT_RECORD_FILE = os.getenv('BOT_RECORD_FILE')
+recorder = UpdateRecorder(BOT_RECORD_FILE) if BOT_RECORD_FILE else None
+
+# Keep-alive connection to the Bot API (see telegram_client.py)
+telegram = TelegramClient(TOKEN, pool_size=REPLY_WORKERS + 2, on_call=prom.telegram_call_metrics(metrics))
+
+# Shared with api_server.py and send_msg.py (see user_store.py for backends)
+store = open_user_store()
+DB_FILE = getattr(store, 'path', '')
 
 def load_database():
-    """Loads the saved users from the JSON file."""
+    """Loads the saved users from the user store."""
     try:
-        if os.path.exists(DB_FILE):
-            with open(DB_FILE, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if not content:
-                    return {}
-                return json.loads(content)
-        else:
-            print(f"⚠️ users.json not found at {DB_FILE}, creating new file...")
-            # Create empty file
-            with open(DB_FILE, 'w', encoding='utf-8') as f:
-                json.dump({}, f, indent=4)
-            return {}
-    except json.JSONDecodeError as e:
-        print(f"❌ Error parsing users.json: {e}")
-        print("Creating new file...")
-        with open(DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump({}, f, indent=4)
-        return {}
+        started = time.perf_counter()
+        users = store.load_all() or {}
+        REGISTRY_LOAD.observe(time.perf_counter() - started)
+        REGISTRY_USERS.set(len(users))
+        return users
     except Exception as e:
-        print(f"❌ Error loading database: {e}")
+        log.error("Error loading database", extra={'error': str(e)})
         return {}
 
-def save_database(db):
-    """Saves the users to the JSON file."""
+def save_database(changes):
+    """Upserts the changed users into the user store."""
     try:
-        with open(DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(db, f, indent=4, ensure_ascii=False)
-        print(f"✅ Database saved to {DB_FILE}")
+        started = time.perf_counter()
+        if store.upsert_many(changes):
+            notify_change()  # Let api_server pick up the change immediately
+        elapsed = time.perf_counter() - started
+        REGISTRY_SAVE.observe(elapsed)
+        REGISTRY_SAVE_SIZE.observe(len(changes))
+        log.info("Saved registry changes", extra={'changes': len(changes), 'duration_ms': round(elapsed * 1000, 1)})
     except Exception as e:
-        print(f"❌ Error saving database: {e}")
+        log.error("Error saving database", extra={'changes': len(changes), 'error': str(e)})
 
 def send_message(chat_id, text):
     """Sends a message to a specific Telegram chat."""
-    url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
-    payload = {"chat_id": chat_id, "text": text}
-    requests.post(url, json=payload)
+    REPLIES_IN_FLIGHT.inc()
+    try:
+        telegram.send_message(chat_id, text)
+    except TelegramError as e:
+        log.warning("Failed to reply", extra={'chat_id': chat_id, 'error': str(e)})
+    finally:
+        REPLIES_IN_FLIGHT.dec()
 
 
-def handle_updates(updates, user_db):
-    """Processes new messages."""
-    highest_update_id = 0
-    db_updated = False
-    
+def record_batch(updates):
+    """Record batch size and delivery lag (and the batch itself, if recording)."""
+    if recorder is not None:
+        recorder.write_batch(updates)
+    UPDATES_BATCH.observe(len(updates))
+    UPDATES_TOTAL.inc(len(updates))
+    now = time.time()
     for update in updates:
-        # Handle both text messages and /start button clicks
-        if 'message' in update:
-            message = update['message']
-            chat_id = message['chat']['id']
-            
-            # Get username (if they have one), otherwise use their first name
-            username = message['from'].get('username')
-            if not username:
-                # Fallback to first_name if no username
-                username = message['from'].get('first_name', 'Unknown')
-                print(f"⚠️ User has no username, using first_name: {username}")
-            # Save user immediately when they interact with bot
-            if username not in user_db or user_db[username] != chat_id:
-                user_db[username] = chat_id
-                db_updated = True
-                print(f"💾 Saving User: {username} -> {chat_id}")
-            else:
-                print(f"ℹ️ User {username} already in database")
-            
+        sent_at = update.get('message', {}).get('date')
+        if sent_at:
+            UPDATE_LAG.observe(max(0.0, now - sent_at))
 
 
-            text = message.get('text', '')
-            print(f"📨 Received: '{text}' from {username} (chat_id: {chat_id})")
-            
-            # Handle /start command (with or without parameters)
-            if text.startswith('/start'):
-                send_message(chat_id, f"Welcome {username}! Your ID has been obtained and saved automatically. You are now connected!")
-                print(f"✅ User {username} connected via /start")
-                db_updated = True  # Ensure we save on /start
-            elif text.lower() == '/hello':
-                send_message(chat_id, f"Hello, {username}! I have saved your ID.")
-            elif text.lower() == '/info':
-                send_message(chat_id, f"Your Chat ID is {chat_id}. Your username is: {username}. I am running on a server.")
+def process_update(update, user_db, changes):
+    """Applies one update to user_db and records registry changes in `changes`.
+
+    Returns (chat_id, reply_text) if the update needs a reply, otherwise None.
+    """
+    # Handle both text messages and /start button clicks
+    if 'message' not in update:
+        return None
+
+    message = update['message']
+    chat_id = message['chat']['id']
+    
+    # Get username (if they have one), otherwise use their first name
+    username = message['from'].get('username')
+    if not username:
+        # Fallback to first_name if no username
+        username = message['from'].get('first_name', 'Unknown')
+        log.debug("User has no username, using first_name", extra={'username': username})
+    # Save user immediately when they interact with bot
+    if username not in user_db or user_db[username] != chat_id:
+        user_db[username] = chat_id
+        changes[username] = chat_id
+        log.info("Registered user", extra={'username': username, 'chat_id': chat_id})
+
+    text = message.get('text', '')
+    # Only the command, never the message text itself
+    log.debug("Received message", extra={
+        'username': username, 'chat_id': chat_id,
+        'command': text.split()[0] if text.startswith('/') else None,
+    })
+    
+    # Handle /start command (with or without parameters)
+    if text.startswith('/start'):
+        changes[username] = chat_id  # Ensure we save on /start
+        return chat_id, f"Welcome {username}! Your ID has been obtained and saved automatically. You are now connected!"
+    elif text.lower() == '/hello':
+        return chat_id, f"Hello, {username}! I have saved your ID."
+    elif text.lower() == '/info':
+        return chat_id, f"Your Chat ID is {chat_id}. Your username is: {username}. I am running on a server."
+    return None
+
+
+def handle_updates(updates, user_db):
+    """Processes new messages."""
+    highest_update_id = 0
+    changes = {}
+    capture = profiler.start('batch', 'handle_updates', updates=len(updates))
+    try:
+        for update in updates:
+            reply = process_update(update, user_db, changes)
+            if reply:
+                send_message(*reply)
 
             # update the ID so we don't process this message again
             update_id = update['update_id']
             if update_id > highest_update_id:
                 highest_update_id = update_id
-    
-    # Save database once after processing all updates
-    if db_updated:
-        save_database(user_db)
-        print(f"📊 Current database: {user_db}")
 
-    return highest_update_id
+        # Save database once after processing all updates
+        if changes:
+            save_database(changes)
+    finally:
+        profiler.finish(capture)
 
-# ... (keep main loop the same) ...
+    return highest_update_id
 
 # --- MAIN LOOP ---
 
-def main():
-    print("=" * 60)
-    print("🤖 BOT SERVER STARTING...")
-    print("=" * 60)
-    print(f"📁 Database file: {DB_FILE}")
-    print(f"🔑 Bot Token: {TOKEN[:10]}...{TOKEN[-5:]}")
-    print("=" * 60)
-    
-    # Load existing users
-    user_db = load_database()
-    print(f"📊 Loaded {len(user_db)} users from database: {user_db}")
-    print("🔄 Starting to poll Telegram API for updates...")
-    print("⏳ Waiting for messages (this may take up to 30 seconds per poll)...")
-    print("=" * 60)
-
+def skip_old_updates():
+    """Returns the latest update_id so polling starts after it (skips old messages)."""
     # Skip old messages - start from current time
     # Get the latest update_id first to skip all old messages
-    print("🔄 Fetching latest update ID to skip old messages...")
     try:
-        test_response = requests.get(f"https://api.telegram.org/bot{TOKEN}/getUpdates?offset=-1&limit=1", timeout=10)
-        if test_response.status_code == 200:
-            test_data = test_response.json()
-            if test_data.get('ok') and test_data.get('result'):
-                latest_updates = test_data['result']
-                if latest_updates:
-                    last_update_id = latest_updates[-1]['update_id']
-                    print(f"⏭️ Skipping all updates before ID: {last_update_id}")
-                else:
-                    last_update_id = None
-                    print("📭 No previous updates found, starting fresh")
-            else:
-                last_update_id = None
-        else:
-            last_update_id = None
+        latest_updates = telegram.get_updates(offset=-1, limit=1)
+        if latest_updates:
+            last_update_id = latest_updates[-1]['update_id']
+            log.info("Skipping old updates", extra={'last_update_id': last_update_id})
+            return last_update_id
+        log.info("No previous updates found, starting fresh")
     except Exception as e:
-        print(f"⚠️ Could not fetch latest update ID: {e}")
-        print("📝 Will process all updates (this may include old messages)")
-        last_update_id = None
-    
-    main.poll_count = 0
+        log.warning("Could not fetch latest update ID; old messages may be processed", extra={'error': str(e)})
+    return None
+
+
+def run_sync(user_db, last_update_id, lease=None):
+    """Sync fallback: poll, handle and reply one batch at a time."""
+    poll_count = 0
 
-    while True:
+    while lease is None or lease.is_leader():
         try:
             # Ask Telegram for updates. 
             # 'timeout=30' keeps the connection open for 30s waiting for a msg (Long Polling)
-            url = f"https://api.telegram.org/bot{TOKEN}/getUpdates?timeout=30"
-            if last_update_id:
-                url += f"&offset={last_update_id + 1}"
-
-            response = requests.get(url, timeout=35)
-            
-            if response.status_code != 200:
-                print(f"❌ HTTP Error: {response.status_code}")
-                print(f"Response: {response.text}")
-                time.sleep(5)
-                continue
-            
-            data = response.json()
-            
-            if not data.get('ok'):
-                print(f"❌ Telegram API Error: {data.get('description', 'Unknown error')}")
-                time.sleep(5)
-                continue
+            offset = last_update_id + 1 if last_update_id else None
+            updates = telegram.get_updates(offset=offset, timeout=30)
+            record_batch(updates)
 
-            if data.get('result'):
+            if updates:
                 # Process the messages
-                last_update_id = handle_updates(data['result'], user_db)
+                last_update_id = handle_updates(updates, user_db)
+                if lease is not None:
+                    lease.save_offset(last_update_id)
             else:
-                # No new updates - show heartbeat every 10 polls (5 minutes)
-                if not hasattr(main, 'poll_count'):
-                    main.poll_count = 0
-                main.poll_count += 1
-                if main.poll_count % 10 == 0:
-                    print(f"💓 Bot is alive... waiting for messages (poll #{main.poll_count})")
+                # No new updates - heartbeat every 10 polls (5 minutes)
+                poll_count += 1
+                log.info("Bot is alive, waiting for messages", extra={'poll': poll_count, 'every': 10})
             
-        except requests.exceptions.Timeout:
-            print("⏱️ Request timeout (this is normal for long polling)")
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Network Error: {e}")
-            print("🔄 Retrying in 5 seconds...")
+        except TelegramError as e:
+            log.error("Telegram API error, retrying in 5 seconds", extra={'error': str(e)})
             time.sleep(5)
-        except Exception as e:
-            print(f"❌ Unexpected Error: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            log.exception("Unexpected error, retrying in 5 seconds")
             time.sleep(5) # Wait a bit before retrying if network fails
 
+
+def run_async(user_db, last_update_id, lease=None):
+    """asyncio pipeline: polling, handling and replies run as separate stages."""
+    pipeline = UpdatePipeline(
+        telegram, process_update, send_message, save_database, user_db,
+        reply_workers=REPLY_WORKERS, on_batch=record_batch,
+        on_offset=lease.save_offset if lease else None,
+        is_active=lease.is_leader if lease else None,
+        profiler=profiler,
+    )
+    UPDATES_PENDING.set_function(pipeline.pending)
+    asyncio.run(pipeline.run(last_update_id))
+
+
+def run_webhook(user_db):
+    """Webhook mode: Telegram pushes updates to us instead of us polling."""
+    secret = WEBHOOK_SECRET
+    if not secret:
+        secret = secrets.token_urlsafe(32)
+        log.warning("WEBHOOK_SECRET not set, generated a random one for this run")
+
+    def handle_batch(updates):
+        record_batch(updates)
+        handle_updates(updates, user_db)
+
+    server = WebhookServer(handle_batch, secret, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH)
+    server.start()
+    UPDATES_PENDING.set_function(server.pending)
+
+    if WEBHOOK_URL:
+        telegram.set_webhook(WEBHOOK_URL, secret_token=secret, allowed_updates=['message'])
+        log.info("Webhook registered with Telegram", extra={'url': WEBHOOK_URL})
+    else:
+        log.info("WEBHOOK_URL not set - not registering with Telegram (local testing only)")
+
+    try:
+        server.serve_forever()
+    finally:
+        server.shutdown()
+
+
+def main(pipeline_mode=None, bot_mode=None):
+    pipeline_mode = pipeline_mode or BOT_PIPELINE
+    bot_mode = bot_mode or BOT_MODE
+    # The bot id is the public part of the token; the rest never reaches the log
+    log.info("Bot server starting", extra={
+        'database': DB_FILE, 'bot_id': TOKEN.split(':')[0], 'mode': bot_mode,
+        'pipeline': None if bot_mode == 'webhook' else pipeline_mode, 'recording': BOT_RECORD_FILE,
+    })
+    
+    if BOT_METRICS_PORT and prom.serve(metrics, BOT_METRICS_HOST, BOT_METRICS_PORT):
+        log.info("Metrics endpoint listening", extra={'url': f"http://{BOT_METRICS_HOST}:{BOT_METRICS_PORT}/metrics"})
+
+    # Load existing users
+    user_db = load_database()
+    log.info("Loaded users", extra={'users': len(user_db)})
+
+    if bot_mode == 'webhook':
+        run_webhook(user_db)
+        return
+
+    run = run_sync if pipeline_mode == 'sync' else run_async
+    if BOT_LEADER_TTL <= 0:
+        start_polling()
+        run(user_db, skip_old_updates())
+        return
+
+    lease = LeaderLease(BOT_LEADER_DB, f"bot:{TOKEN.split(':')[0]}", ttl=BOT_LEADER_TTL)
+    IS_LEADER.set_function(lambda: int(lease.is_leader()))
+    standby_for = []
+
+    def on_wait(holder):
+        if standby_for[-1:] != [holder]:
+            standby_for.append(holder)
+            log.info("Standing by while another instance polls", extra={'holder': holder, 'lease_db': BOT_LEADER_DB})
+
+    try:
+        while True:
+            last_update_id = lease.acquire(on_wait=on_wait)
+            lease.start_heartbeat()
+            log.info("Acquired the polling lease", extra={'term': lease.term})
+            if standby_for:
+                # The previous leader may have registered users since we loaded
+                user_db = load_database()
+            start_polling()
+            if last_update_id:
+                # Continue exactly where the previous leader stopped
+                log.info("Resuming after the previous leader", extra={'last_update_id': last_update_id})
+            else:
+                last_update_id = skip_old_updates()
+            run(user_db, last_update_id, lease)
+            standby_for.clear()
+            log.warning("Polling stopped; back to standby")
+    finally:
+        lease.release()
+
+
+def start_polling():
+    log.info("Starting to poll Telegram for updates")
+
+    # getUpdates is refused while a webhook is registered (e.g. after webhook mode)
+    try:
+        telegram.delete_webhook()
+    except TelegramError as e:
+        log.warning("Could not remove webhook", extra={'error': str(e)})
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telegram bot server")
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default=None,
+                        help="how updates arrive (default: BOT_MODE env var, or polling)")
+    parser.add_argument('--pipeline', choices=['async', 'sync'], default=None,
+                        help="polling update pipeline (default: BOT_PIPELINE env var, or async)")
+    args = parser.parse_args()
+
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    # Shut down the same way on SIGTERM (e.g. from start_servers.py), releasing the polling lease
+    signal.signal(signal.SIGTERM, handle_sigterm)
     try:
-        main()
+        main(args.pipeline, args.mode)
     except KeyboardInterrupt:
-        print("\n\n🛑 Bot server stopped by user (Ctrl+C)")
-        print("✅ Shutting down gracefully...")
-        sys.exit(0)
\ No newline at end of file
+        log.info("Bot server stopped")
+        sys.exit(0)
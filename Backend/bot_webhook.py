@@ -0,0 +1,138 @@
+"""Webhook ingestion for bot_server, as an alternative to long polling.
+
+Telegram POSTs each Update as JSON to our endpoint. The request is checked
+against the X-Telegram-Bot-Api-Secret-Token header, queued, and acknowledged
+with 200 right away; a background thread feeds queued updates in batches to
+the same handle_updates logic the polling loop uses.
+
+Test it offline by POSTing a recorded update:
+
+    curl -X POST http://localhost:8443/telegram/webhook \\
+         -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+         -H "Content-Type: application/json" -d @update.json
+"""
+import collections
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """Receives Telegram updates over HTTP and processes them in the background.
+
+    handle_batch(updates) is called from a single worker thread, so it never
+    runs concurrently with itself.
+    """
+
+    MAX_BATCH = 100
+    # Telegram may redeliver an update if our 200 got lost; remember recent ids
+    SEEN_UPDATES = 10000
+
+    def __init__(self, handle_batch, secret, host='0.0.0.0', port=8443, path='/telegram/webhook'):
+        self.handle_batch = handle_batch
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.path = path
+        self._queue = queue.Queue()
+        self._seen = collections.OrderedDict()
+        # _accept runs on every request thread
+        self._lock = threading.Lock()
+        self._httpd = None
+        self.received = 0
+        self.rejected = 0
+
+    def start(self):
+        threading.Thread(target=self._worker, name='webhook-worker', daemon=True).start()
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    def serve_forever(self):
+        log.info("Webhook listening", extra={'url': f"http://{self.host}:{self.port}{self.path}"})
+        self._httpd.serve_forever()
+
+    def shutdown(self):
+        if self._httpd:
+            self._httpd.shutdown()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _accept(self, update):
+        """Queue an update unless it was already seen. Returns True if queued."""
+        update_id = update.get('update_id')
+        with self._lock:
+            if update_id is not None:
+                if update_id in self._seen:
+                    return False
+                self._seen[update_id] = True
+                while len(self._seen) > self.SEEN_UPDATES:
+                    self._seen.popitem(last=False)
+            self._queue.put(update)
+            self.received += 1
+        return True
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            # Drain whatever else is already waiting into the same batch
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.handle_batch(batch)
+            except Exception:
+                log.exception("Failed to process webhook batch", extra={'updates': len(batch)})
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body=b''):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/health':
+                    self._reply(200, json.dumps({'status': 'ok', 'pending': server.pending()}).encode())
+                else:
+                    self._reply(404)
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                token = self.headers.get(SECRET_HEADER, '')
+                if not hmac.compare_digest(token.encode(), server.secret.encode()):
+                    with server._lock:
+                        server.rejected += 1
+                    self._reply(401)
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    update = json.loads(self.rfile.read(length))
+                except (ValueError, json.JSONDecodeError):
+                    self._reply(400)
+                    return
+                if not isinstance(update, dict):
+                    self._reply(400)
+                    return
+                server._accept(update)
+                # Acknowledge immediately; processing happens on the worker thread
+                self._reply(200)
+
+        return Handler
@@ -0,0 +1,344 @@
+"""Asynchronous outbound queue for Telegram messages.
+
+Requests enqueue a message and return immediately; a small pool of worker
+threads delivers them while respecting Telegram's rate limits:
+
+- per chat: about 1 message per second
+- global: about 30 messages per second per bot
+
+A 429 response puts the chat on hold for ``retry_after`` seconds and the
+message is re-queued instead of being reported as a failure.
+
+With an Outbox (outbox.py) every message is persisted before it is queued
+and its final state is written back, so unsent messages survive restarts.
+
+With a coalescing window, normal-priority messages wait up to that long and
+everything queued for the same chat by the time one is sent goes out as a
+single combined message (within count and length caps). High-priority
+messages skip the window and take any waiting messages for their chat along.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+from telegram_client import RetryAfter, TelegramError
+
+log = logging.getLogger(__name__)
+
+NORMAL = 'normal'
+HIGH = 'high'
+PRIORITIES = (NORMAL, HIGH)
+
+# Between the texts of a combined message
+COALESCE_SEPARATOR = '\n\n'
+
+
+class TokenBucket:
+    """Classic token bucket. Not thread-safe; callers hold the dispatcher lock."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        # `now` may predate a bucket created just after it was read
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('id', 'chat_id', 'text', 'attempts', 'on_done', 'priority', 'seq', 'members', 'merged')
+
+    def __init__(self, chat_id, text, on_done=None, job_id=None, attempts=0, priority=NORMAL):
+        self.id = job_id or uuid.uuid4().hex
+        self.chat_id = chat_id
+        self.text = text
+        self.attempts = attempts
+        self.on_done = on_done
+        self.priority = priority
+        self.seq = None
+        self.members = None   # for a combined message: the jobs it carries
+        self.merged = False   # sent as part of another job's combined message
+
+
+class TelegramDispatcher:
+    """Queue drained by a worker pool, with per-chat and global token buckets."""
+
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, send_func, workers=4, global_rate=30.0, per_chat_rate=1.0, max_attempts=3, outbox=None,
+                 coalesce_window=0.0, coalesce_max_messages=10, coalesce_max_length=4096):
+        self.send_func = send_func
+        self.outbox = outbox
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_messages = coalesce_max_messages
+        self.coalesce_max_length = coalesce_max_length
+        self.workers = workers
+        self.per_chat_rate = per_chat_rate
+        self.max_attempts = max_attempts
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets = {}
+        self._hold_until = {}
+        self._heap = []
+        self._merged = 0      # heap entries already sent inside a combined message
+        self._waiting = {}    # chat_id -> normal-priority jobs not yet sent, in order
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self.counters = {'queued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'rate_limited': 0, 'recovered': 0,
+                         'coalesced': 0}
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"telegram-dispatch-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.outbox is not None:
+            self.outbox.start(on_recovered=self._recover)
+
+    def stop(self, timeout=10.0):
+        """Stop accepting work and wait for queued messages to drain."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        if self.outbox is not None:
+            # Whatever didn't drain stays queued in the outbox for the next start
+            self.outbox.stop()
+
+    def enqueue(self, chat_id, text, on_done=None, message_id=None, priority=NORMAL):
+        """Queue a message for delivery. Returns its message id.
+
+        on_done, if given, is called from a worker thread as on_done(message_id, ok)
+        once the message is delivered or given up on. message_id lets the caller
+        pick the id up front (it must be unique). HIGH priority skips the
+        coalescing window.
+        """
+        job = _Job(chat_id, text, on_done, job_id=message_id, priority=priority)
+        self._submit([job])
+        return job.id
+
+    def enqueue_many(self, messages, on_done=None, priority=NORMAL):
+        """Queue several (chat_id, text) messages at once. Returns their ids.
+
+        With an outbox they are persisted in one batch before being queued.
+        """
+        jobs = [_Job(chat_id, text, on_done, priority=priority) for chat_id, text in messages]
+        self._submit(jobs)
+        return [job.id for job in jobs]
+
+    def _submit(self, jobs):
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("Dispatcher is shutting down")
+        if self.outbox is not None:
+            self.outbox.add_many(jobs)
+        self._push(jobs)
+
+    def _push(self, jobs, hold=True):
+        now = time.monotonic()
+        with self._cond:
+            for job in jobs:
+                job.seq = next(self._seq)
+                ready_at = now
+                if self.coalesce_window > 0 and job.priority == NORMAL:
+                    self._waiting.setdefault(job.chat_id, []).append(job)
+                    if hold:
+                        ready_at += self.coalesce_window
+                heapq.heappush(self._heap, (ready_at, job.seq, job))
+            self.counters['queued'] += len(jobs)
+            self._cond.notify(len(jobs))
+
+    def _recover(self, rows):
+        """Queue unsent messages taken over from the outbox (after a restart or crash)."""
+        jobs = [
+            _Job(chat_id, text, job_id=job_id, attempts=attempts, priority=priority)
+            for job_id, chat_id, text, attempts, priority in rows
+        ]
+        # They already waited long enough; still combine what's queued per chat
+        self._push(jobs, hold=False)
+        with self._cond:
+            self.counters['recovered'] += len(jobs)
+
+    def clear(self):
+        """Drop every message not yet handed to a worker; their on_done is not called.
+
+        Returns how many were dropped. Outbox rows of dropped messages stay queued.
+        """
+        with self._cond:
+            dropped = len(self._heap) - self._merged
+            self._heap = []
+            self._merged = 0
+            self._waiting = {}
+            return dropped
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap) - self._merged
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, pending=len(self._heap) - self._merged)
+
+    def _reserve(self, chat_id, now):
+        """Take a global and a per-chat token. Returns 0, or seconds to wait."""
+        hold = self._hold_until.get(chat_id)
+        if hold is not None:
+            if hold > now:
+                return hold - now
+            del self._hold_until[chat_id]
+
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                self._chat_buckets = {
+                    cid: b for cid, b in self._chat_buckets.items() if not b.is_idle(now)
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+
+        wait = max(bucket.wait_time(now), self._global_bucket.wait_time(now))
+        if wait:
+            return wait
+        bucket.consume()
+        self._global_bucket.consume()
+        return 0.0
+
+    def _next_job(self):
+        """Block until a job is ready to send and its tokens are reserved."""
+        with self._cond:
+            while True:
+                if not self._heap:
+                    if self._stopping:
+                        return None
+                    self._cond.wait()
+                    continue
+                ready_at, seq, job = self._heap[0]
+                if job.merged:
+                    # Already delivered inside a combined message
+                    heapq.heappop(self._heap)
+                    self._merged -= 1
+                    continue
+                now = time.monotonic()
+                if ready_at > now:
+                    self._cond.wait(ready_at - now)
+                    continue
+                heapq.heappop(self._heap)
+                wait = self._reserve(job.chat_id, now)
+                if wait:
+                    # Keep the original sequence number so per-chat order is preserved
+                    heapq.heappush(self._heap, (now + wait, seq, job))
+                    continue
+                return seq, self._coalesce(job)
+
+    def _coalesce(self, head):
+        """Combine head with the messages waiting for its chat. Caller holds the lock."""
+        waiting = self._waiting.pop(head.chat_id, None)
+        if not waiting:
+            return head
+        if head in waiting:
+            waiting.remove(head)
+        # A combined message re-queued after a 429 can pick up newer messages too
+        batch = list(head.members or [head])
+        length = len(head.text)
+        for i, job in enumerate(waiting):
+            length += len(COALESCE_SEPARATOR) + len(job.text)
+            if len(batch) >= self.coalesce_max_messages or length > self.coalesce_max_length:
+                # Keep the rest in order for the next send to this chat
+                self._waiting[head.chat_id] = waiting[i:]
+                break
+            job.merged = True
+            self._merged += 1
+            batch.append(job)
+        if len(batch) == len(head.members or [head]):
+            return head
+        batch.sort(key=lambda job: job.seq)
+        combined = _Job(head.chat_id, COALESCE_SEPARATOR.join(job.text for job in batch), job_id=head.id,
+                        attempts=max(job.attempts for job in batch))
+        combined.seq = head.seq
+        combined.members = batch
+        self.counters['coalesced'] += len(batch) - len(head.members or [head])
+        return combined
+
+    def _requeue(self, seq, job, delay):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, seq, job))
+            self._cond.notify()
+
+    def _worker(self):
+        while True:
+            item = self._next_job()
+            if item is None:
+                return
+            seq, job = item
+            job.attempts += 1
+            try:
+                result = self.send_func(job.chat_id, job.text)
+            except RetryAfter as e:
+                job.attempts -= 1  # Telegram asked us to wait; not a failed attempt
+                with self._cond:
+                    # Ready exactly when the hold ends, so it stays ahead of newer messages for the chat
+                    hold = self._hold_until[job.chat_id] = time.monotonic() + e.retry_after
+                    heapq.heappush(self._heap, (hold, seq, job))
+                    self.counters['rate_limited'] += 1
+                    self._cond.notify()
+            except Exception as e:
+                members = job.members or [job]
+                # 4xx (chat not found, bot blocked, ...) won't succeed on retry
+                permanent = isinstance(e, TelegramError) and e.error_code and 400 <= e.error_code < 500
+                if job.attempts < self.max_attempts and not permanent:
+                    with self._cond:
+                        self.counters['retried'] += len(members)
+                    if self.outbox is not None:
+                        for member in members:
+                            self.outbox.mark_retry(member.id, job.attempts, e)
+                    self._requeue(seq, job, 2 ** job.attempts)
+                else:
+                    with self._cond:
+                        self.counters['failed'] += len(members)
+                    log.warning("Giving up on message", extra={
+                        'message_id': job.id, 'chat_id': job.chat_id, 'attempts': job.attempts, 'error': str(e),
+                    })
+                    for member in members:
+                        if self.outbox is not None:
+                            self.outbox.mark_failed(member.id, job.attempts, e)
+                        self._finish(member, False)
+            else:
+                members = job.members or [job]
+                with self._cond:
+                    self.counters['sent'] += len(members)
+                telegram_message_id = result.get('message_id') if isinstance(result, dict) else None
+                for member in members:
+                    if self.outbox is not None:
+                        self.outbox.mark_sent(member.id, job.attempts, telegram_message_id)
+                    self._finish(member, True)
+
+    def _finish(self, job, ok):
+        if job.on_done is None:
+            return
+        try:
+            job.on_done(job.id, ok)
+        except Exception:
+            log.exception("Message callback failed", extra={'message_id': job.id})
@@ -0,0 +1,135 @@
+"""Idempotency keys and duplicate suppression for the send endpoints.
+
+The app retries /send-message on timeouts and can fire the same alert from a
+background notification and from its 1-second loop, so the same text often
+reaches the same guardian twice within a second. Two guards stop that:
+
+- Idempotency-Key: a request carrying a key that was already used gets the
+  original message's result back instead of a second send.
+- Duplicate window: an identical (chat_id, text) pair queued within
+  `window` seconds is answered with the earlier message instead.
+
+Both keep recent entries in a bounded in-process TTL/LRU cache and fall back
+to the shared outbox on a miss, so a retry that lands on another API worker
+is still recognised.
+"""
+import collections
+import hashlib
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=10000, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def setdefault(self, key, value):
+        """Store value unless a live entry exists. Returns the live entry, or None if stored."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] > now:
+                self._items.move_to_end(key)
+                return item[1]
+            self._items[key] = (now + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+            return None
+
+    def discard(self, key, value):
+        """Remove key if it still maps to value (e.g. the reserved send failed)."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] == value:
+                del self._items[key]
+
+    def __len__(self):
+        return len(self._items)
+
+
+def fingerprint(chat_id, text):
+    return hashlib.sha256(f'{chat_id}\0{text}'.encode('utf-8')).hexdigest()[:32]
+
+
+class SendGuard:
+    """Decides whether a send request is a replay or a duplicate.
+
+    claim(message_id, chat_id, text, key) reserves message_id for the request
+    and returns None when it should be sent, or an earlier result otherwise.
+    Reserving is atomic within a worker, so two identical requests arriving
+    together never both go out; across workers the outbox lookup narrows the
+    window to the few milliseconds before a commit.
+    """
+
+    def __init__(self, outbox, window=2.0, key_ttl=86400.0, maxsize=10000):
+        self.outbox = outbox
+        self.window = window
+        self.keys = TTLCache(maxsize, key_ttl)
+        self.recent = TTLCache(maxsize, window)
+        self.counters = {'idempotent_hits': 0, 'duplicates_suppressed': 0, 'key_conflicts': 0}
+        self._lock = threading.Lock()
+
+    def claim(self, message_id, chat_id, text, key=None):
+        """Returns None (send it as message_id) or (kind, earlier_message_id).
+
+        kind is 'replay' for a repeated Idempotency-Key, 'conflict' when the key
+        was used for a different chat_id/text, and 'duplicate' for a pair
+        already queued within the window.
+        """
+        digest = fingerprint(chat_id, text)
+        if key is not None:
+            earlier = self.keys.setdefault(key, (message_id, digest))
+            if earlier is None:
+                # Not seen in this worker; another worker may have handled it
+                found = self.outbox.find_key(key)
+                if found is not None:
+                    self.keys.discard(key, (message_id, digest))
+                    self.keys.setdefault(key, found)
+                    earlier = found
+            if earlier is not None:
+                if earlier[1] != digest:
+                    return self._count('key_conflicts', 'conflict', earlier[0])
+                return self._count('idempotent_hits', 'replay', earlier[0])
+
+        if self.window > 0:
+            earlier = self.recent.setdefault(digest, message_id)
+            if earlier is None:
+                earlier = self.outbox.find_recent(chat_id, text, time.time() - self.window)
+                if earlier is not None:
+                    self.recent.discard(digest, message_id)
+                    self.recent.setdefault(digest, earlier)
+            if earlier is not None:
+                if key is not None:
+                    # Later replays of this key resolve to the message that was actually sent
+                    self.keys.discard(key, (message_id, digest))
+                    self.keys.setdefault(key, (earlier, digest))
+                    self.outbox.remember_key(key, digest, earlier)
+                return self._count('duplicates_suppressed', 'duplicate', earlier)
+        return None
+
+    def sent(self, message_id, chat_id, text, key=None):
+        """Record that message_id was queued, so other workers see its key."""
+        if key is not None:
+            self.outbox.remember_key(key, fingerprint(chat_id, text), message_id)
+
+    def release(self, message_id, chat_id, text, key=None):
+        """Undo a claim whose send could not be queued."""
+        digest = fingerprint(chat_id, text)
+        self.recent.discard(digest, message_id)
+        if key is not None:
+            self.keys.discard(key, (message_id, digest))
+
+    def _count(self, counter, kind, message_id):
+        with self._lock:
+            self.counters[counter] += 1
+        return kind, message_id
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, cached_keys=len(self.keys))
@@ -0,0 +1,203 @@
+"""Leader election so only one bot_server instance polls getUpdates.
+
+Telegram allows a single getUpdates consumer per bot token; a second poller
+gets 409 Conflict and both end up handling the same updates. With a lease
+several bot_server instances can run: one is the leader and polls, the others
+wait as hot standbys and take over within a few seconds once the leader stops
+renewing.
+
+The lease is a row in a small local SQLite database (bot_leader.db), which
+also stores the last handled update_id. A new leader resumes from that offset,
+so nothing is handled twice or skipped across a hand-off. Offset writes are
+fenced on the holder, so a leader that lost its lease can't move it.
+"""
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+log = logging.getLogger(__name__)
+
+
+class LeaderLease:
+    """Lease `name` in the SQLite database at `path` for `ttl` seconds at a time.
+
+    Call acquire() (blocks until leader), then start_heartbeat(); check
+    is_leader() between polls and save_offset() after every handled batch.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS leader_lease (
+            name TEXT PRIMARY KEY,
+            holder TEXT,
+            expires_at REAL NOT NULL DEFAULT 0,
+            term INTEGER NOT NULL DEFAULT 0,
+            last_update_id INTEGER
+        );
+    """
+
+    def __init__(self, path, name, ttl=15.0):
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.host = socket.gethostname()
+        self.holder = f'{self.host}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.term = None
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+        self._lost = threading.Event()
+        self._lost.set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _holder_is_dead(self, holder):
+        """True if holder is a process on this host that no longer exists."""
+        try:
+            holder_host, pid, _ = holder.rsplit(':', 2)
+            pid = int(pid)
+        except (AttributeError, ValueError):
+            return False
+        # os.kill(pid, 0) would terminate the process on Windows
+        if holder_host != self.host or sys.platform == 'win32':
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            return False
+        return False
+
+    def try_acquire(self):
+        """Take the lease if it is free, expired or held by a dead local process.
+
+        Returns (True, last_update_id) on success, else (False, current_holder).
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT holder, expires_at, term, last_update_id FROM leader_lease WHERE name = ?', (self.name,)
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    'INSERT INTO leader_lease (name, holder, expires_at, term) VALUES (?, ?, ?, 1)',
+                    (self.name, self.holder, now + self.ttl)
+                )
+                term, last_update_id = 1, None
+            else:
+                holder, expires_at, term, last_update_id = row
+                if holder != self.holder and expires_at > now and not self._holder_is_dead(holder):
+                    conn.execute('COMMIT')
+                    return False, holder
+                term += 1
+                conn.execute(
+                    'UPDATE leader_lease SET holder = ?, expires_at = ?, term = ? WHERE name = ?',
+                    (self.holder, now + self.ttl, term, self.name)
+                )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self.term = term
+        self._lost.clear()
+        return True, last_update_id
+
+    def acquire(self, on_wait=None):
+        """Block until this instance is the leader. Returns the stored last_update_id.
+
+        on_wait(holder), if given, is called each time the lease is found taken.
+        """
+        while True:
+            try:
+                ok, value = self.try_acquire()
+            except sqlite3.Error as e:
+                log.error("Leader lease error", extra={'error': str(e)})
+                ok, value = False, None
+            if ok:
+                return value
+            if on_wait is not None:
+                on_wait(value)
+            if self._stop.wait(self.ttl / 3):
+                raise RuntimeError("Leader lease stopped")
+
+    def _renew(self, last_update_id=None):
+        """Extend our lease (and move the offset forward). False if we no longer hold it."""
+        cur = self._connect().execute(
+            'UPDATE leader_lease SET expires_at = ?, '
+            'last_update_id = COALESCE(MAX(last_update_id, ?), last_update_id, ?) '
+            'WHERE name = ? AND holder = ? AND term = ?',
+            (time.time() + self.ttl, last_update_id, last_update_id, self.name, self.holder, self.term)
+        )
+        return cur.rowcount == 1
+
+    def save_offset(self, last_update_id):
+        """Record the newest handled update_id. Returns False (and marks the lease lost) if not leader."""
+        if self._lost.is_set():
+            return False
+        try:
+            if self._renew(last_update_id):
+                return True
+        except sqlite3.Error as e:
+            log.error("Could not save update offset", extra={'error': str(e)})
+            return True  # the heartbeat decides when the lease is really gone
+        self._mark_lost()
+        return False
+
+    def start_heartbeat(self):
+        """Renew the lease every ttl/3 seconds until stopped or lost."""
+        self._thread = threading.Thread(target=self._heartbeat, name='leader-heartbeat', daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self):
+        deadline = time.time() + self.ttl
+        while not self._lost.is_set() and not self._stop.wait(self.ttl / 3):
+            try:
+                if not self._renew():
+                    self._mark_lost()
+                    return
+                deadline = time.time() + self.ttl
+            except sqlite3.Error as e:
+                log.error("Leader heartbeat failed", extra={'error': str(e)})
+                if time.time() >= deadline:
+                    self._mark_lost()
+                    return
+
+    def _mark_lost(self):
+        if not self._lost.is_set():
+            self._lost.set()
+            log.warning("Lost the polling lease to another bot_server instance", extra={'term': self.term})
+
+    def is_leader(self):
+        return not self._lost.is_set()
+
+    def release(self):
+        """Stop heartbeating and expire our lease so a standby takes over at once."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+        if self._lost.is_set():
+            return
+        self._lost.set()
+        try:
+            self._connect().execute(
+                'UPDATE leader_lease SET expires_at = 0 WHERE name = ? AND holder = ? AND term = ?',
+                (self.name, self.holder, self.term)
+            )
+        except sqlite3.Error as e:
+            log.error("Could not release the polling lease", extra={'error': str(e)})
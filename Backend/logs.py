@@ -0,0 +1,240 @@
+"""Structured, non-blocking logging for the Backend services.
+
+setup(service) sends every logger to stdout, one JSON object per line:
+
+    {"ts": "2026-10-17T09:12:03.120Z", "level": "info", "service": "bot_server",
+     "logger": "bot_server", "msg": "Registered user", "username": "alice", "chat_id": "c_3f9a0b12de"}
+
+Modules log with logging.getLogger(__name__) and pass details as fields
+(extra={...}) rather than formatting them into the message.
+
+- Records go through a bounded queue to a background thread, so a request
+  thread never waits on stdout. When the queue is full the record is dropped
+  and counted instead.
+- Each message is limited to LOG_RATE_LIMIT records per LOG_RATE_INTERVAL
+  seconds; the next record that gets through carries `suppressed`.
+  extra={'every': n} additionally keeps only every n-th record (heartbeats).
+- Bot tokens, and the values of *_TOKEN / *_SECRET / *_KEY / *_PASSWORD
+  environment variables, are masked wherever they appear. A chat_id field
+  is replaced with a stable pseudonym, so one chat's lines can still be
+  followed without logging the id.
+
+LOG_FORMAT=text prints the same records as plain lines for local use.
+"""
+import atexit
+import copy
+import hashlib
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', '').lower()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', 20))
+LOG_RATE_INTERVAL = float(os.getenv('LOG_RATE_INTERVAL', 10))
+LOG_REDACT_CHAT_IDS = os.getenv('LOG_REDACT_CHAT_IDS', 'on').lower() not in ('0', 'off', 'false', 'no')
+
+# Telegram bot tokens look like 123456789:AA... (also inside Bot API URLs in exception text)
+TOKEN_PATTERN = re.compile(r'\d{5,}:[A-Za-z0-9_-]{30,}')
+SECRET_ENV_SUFFIXES = ('TOKEN', 'SECRET', 'KEY', 'PASSWORD')
+CHAT_ID_FIELDS = {'chat_id', 'chat_ids'}
+REDACTED = '[redacted]'
+
+# LogRecord attributes that are not fields passed through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'taskName', 'every'}
+
+_listener = None
+_handler = None
+_pid = None
+
+
+class Redactor:
+    """Masks secrets in text and pseudonymizes chat ids."""
+
+    def __init__(self, secrets=(), key=None, chat_ids=True):
+        # Longest first, so a secret that contains another is masked whole
+        self.secrets = sorted({s for s in secrets if s and len(s) >= 8}, key=len, reverse=True)
+        self.key = key or os.urandom(16)
+        self.chat_ids = chat_ids
+
+    @classmethod
+    def from_env(cls):
+        secrets = [value for name, value in os.environ.items() if name.endswith(SECRET_ENV_SUFFIXES)]
+        token = os.getenv('TELEGRAM_BOT_TOKEN')
+        # Keyed on the bot token so every process (and restart) maps a chat to the same pseudonym
+        key = hashlib.sha256(token.encode('utf-8')).digest() if token else None
+        return cls(secrets, key, LOG_REDACT_CHAT_IDS)
+
+    def text(self, value):
+        for secret in self.secrets:
+            value = value.replace(secret, REDACTED)
+        return TOKEN_PATTERN.sub(REDACTED, value)
+
+    def chat_id(self, value):
+        if not self.chat_ids or value is None:
+            return value
+        if isinstance(value, (list, tuple, set)):
+            return [self.chat_id(v) for v in value]
+        return 'c_' + hmac.new(self.key, str(value).encode('utf-8'), hashlib.sha256).hexdigest()[:10]
+
+    def field(self, name, value):
+        if name in CHAT_ID_FIELDS:
+            return self.chat_id(value)
+        if isinstance(value, str):
+            return self.text(value)
+        if isinstance(value, (int, float, bool)) or value is None:
+            return value
+        return self.text(str(value))
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per record (or a plain line with as_json=False), redacted."""
+
+    def __init__(self, service, redactor, as_json=True):
+        super().__init__()
+        self.service = service
+        self.redactor = redactor
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = {
+            name: self.redactor.field(name, value)
+            for name, value in vars(record).items()
+            if name not in _RECORD_ATTRS and not name.startswith('_')
+        }
+        message = self.redactor.text(record.getMessage())
+        error = self.redactor.text(record.exc_text) if record.exc_text else None
+        if not self.as_json:
+            line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} " \
+                   f"{record.name}: {message}"
+            if fields:
+                line += ' ' + ' '.join(f'{name}={value}' for name, value in fields.items())
+            return line + (f'\n{error}' if error else '')
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')[:-6] + 'Z',
+            'level': record.levelname.lower(),
+            'service': self.service,
+            'logger': record.name,
+            'msg': message,
+        }
+        entry.update(fields)
+        if error:
+            entry['exc'] = error
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `limit` records per message per `interval` seconds.
+
+    Honours extra={'every': n} (keep the 1st, n+1-th, ... record of that
+    message). The first record after a window that dropped some carries
+    `suppressed` with the number dropped.
+    """
+
+    def __init__(self, limit=20, interval=10.0, max_keys=1000):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.max_keys = max_keys
+        self._windows = {}
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg).__name__)
+        every = getattr(record, 'every', 0)
+        with self._lock:
+            if every > 1:
+                seen = self._seen.get(key, 0)
+                self._seen[key] = seen + 1
+                if seen % every:
+                    return False
+            if self.limit <= 0:
+                return True
+            now = time.monotonic()
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is None and len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                window = self._windows[key] = [now, 0, 0]
+            if window[1] >= self.limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+            return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread; drops (and counts) them when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only capture what can change later (args, the live traceback); formatting
+        # and redaction happen on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup(service, level=None, stream=None, default_format='json'):
+    """Route all logging through the background writer. Safe to call more than once.
+
+    Command-line tools pass default_format='text'; LOG_FORMAT overrides either.
+    """
+    global _listener, _handler, _pid
+    # A forked child (gunicorn worker) inherits the handler but not the listener thread
+    if _listener is not None and _pid == os.getpid():
+        return
+    output = logging.StreamHandler(stream or sys.stdout)
+    as_json = (LOG_FORMAT or default_format) != 'text'
+    output.setFormatter(StructuredFormatter(service, Redactor.from_env(), as_json=as_json))
+    _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_INTERVAL))
+
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level or LOG_LEVEL)
+    # Per-connection chatter from the HTTP client
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+    _pid = os.getpid()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """Write out queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped():
+    """Records dropped because the queue was full."""
+    return _handler.dropped if _handler is not None else 0
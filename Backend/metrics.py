@@ -0,0 +1,307 @@
+"""Minimal Prometheus-style metrics for api_server and bot_server.
+
+Counters, gauges and histograms with labels, rendered in the Prometheus
+text exposition format. Recording a value is a dict lookup and an add under
+a lock, so metrics stay on in production.
+
+With several API worker processes (serve_api.py) each process writes a
+snapshot of its metrics to METRICS_DIR every few seconds, and /metrics merges
+the snapshots of all workers: counters and histograms are summed, gauges are
+summed or maxed per gauge (`mode`). Gauges of dead processes are dropped.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000, 10000, 100000)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._function = None
+        if not self.labelnames:
+            self._values[()] = self._initial()
+
+    def _initial(self):
+        return 0
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set_function(self, fn):
+        """Compute the value at collection time instead of recording it.
+
+        fn() returns a number, or for labelled metrics a dict mapping
+        label-value tuples to numbers.
+        """
+        self._function = fn
+
+    def samples(self):
+        """Return {label_values: value} for this process."""
+        if self._function is not None:
+            value = self._function()
+            return dict(value) if isinstance(value, dict) else {(): value}
+        with self._lock:
+            return dict(self._values)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), mode='sum'):
+        super().__init__(name, help, labelnames)
+        self.mode = mode  # how to merge worker processes: 'sum' or 'max'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames)
+
+    def _initial(self):
+        # Per-bucket (not cumulative) counts; the last slot is +Inf
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = self._initial()
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            return {key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+
+
+class MetricsRegistry:
+    """Holds the metrics of one process and renders them."""
+
+    def __init__(self, directory=None, flush_interval=2.0):
+        self._metrics = []
+        self.directory = directory
+        self.flush_interval = flush_interval
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), mode='sum'):
+        return self._add(Gauge(name, help, labelnames, mode))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def snapshot(self):
+        """Current values of every metric, as a JSON-serialisable dict."""
+        return {
+            metric.name: [[list(key), value] for key, value in _samples(metric).items()]
+            for metric in self._metrics
+        }
+
+    # -- multi-process support -------------------------------------------------
+
+    def start_flushing(self):
+        """Write this process's snapshot to `directory` periodically."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            self.flush()
+            time.sleep(self.flush_interval)
+
+    def flush(self):
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _snapshots(self):
+        """Yield (pid_alive, snapshot) for every process that wrote one."""
+        self.flush()
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            pid = int(filename[:-5])
+            try:
+                with open(os.path.join(self.directory, filename), encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield _pid_alive(pid), snapshot
+
+    def _merged(self):
+        if not self.directory:
+            yield from ((metric, _samples(metric)) for metric in self._metrics)
+            return
+        snapshots = list(self._snapshots())
+        for metric in self._metrics:
+            merged = {}
+            for alive, snapshot in snapshots:
+                if isinstance(metric, Gauge) and not alive:
+                    continue
+                for key, value in snapshot.get(metric.name, []):
+                    key = tuple(key)
+                    if key not in merged:
+                        merged[key] = value
+                    elif isinstance(metric, Histogram):
+                        counts, total, count = merged[key]
+                        merged[key] = [[a + b for a, b in zip(counts, value[0])], total + value[1], count + value[2]]
+                    elif isinstance(metric, Gauge) and metric.mode == 'max':
+                        merged[key] = max(merged[key], value)
+                    else:
+                        merged[key] = merged[key] + value
+            yield metric, merged
+
+    def render(self):
+        """Render all metrics in the Prometheus text format."""
+        lines = []
+        for metric, samples in self._merged():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for key, value in sorted(samples.items()):
+                if isinstance(metric, Histogram):
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(metric.buckets + (float('inf'),), counts):
+                        cumulative += bucket_count
+                        labels = _format_labels(metric.labelnames, key, ('le', _format_value(bound)))
+                        lines.append(f'{metric.name}_bucket{labels} {cumulative}')
+                    labels = _format_labels(metric.labelnames, key)
+                    lines.append(f'{metric.name}_sum{labels} {_format_value(total)}')
+                    lines.append(f'{metric.name}_count{labels} {count}')
+                else:
+                    labels = _format_labels(metric.labelnames, key)
+                    lines.append(f'{metric.name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _samples(metric):
+    try:
+        return metric.samples()
+    except Exception:
+        return {}  # a collection callback failed; skip the metric this time
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def telegram_call_metrics(registry):
+    """Return an on_call hook for TelegramClient that records call metrics."""
+    calls = registry.counter('telegram_api_calls_total', 'Bot API HTTP attempts by method and status',
+                             ['method', 'status'])
+    latency = registry.histogram('telegram_api_call_duration_seconds', 'Bot API HTTP attempt latency',
+                                 ['method'])
+
+    def on_call(method, status, seconds):
+        calls.inc(method=method, status=status)
+        latency.observe(seconds, method=method)
+    return on_call
+
+
+def serve(registry, host='0.0.0.0', port=9101):
+    """Serve GET /metrics from a background thread. Returns the server, or None."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    try:
+        httpd = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        log.warning("Metrics endpoint disabled", extra={'address': f'{host}:{port}', 'error': str(e)})
+        return None
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name='metrics-http', daemon=True).start()
+    return httpd
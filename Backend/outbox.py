@@ -0,0 +1,308 @@
+"""Durable outbox for outbound Telegram messages.
+
+Every message queued with the dispatcher is first written to an SQLite
+table, so a restart (or crash) in the middle of an alert doesn't lose
+messages that were accepted but not yet sent, and GET /messages/<id> can
+report queued / sent / failed along with Telegram's message_id.
+
+- Writes go through one flusher thread that commits everything pending in a
+  single transaction (group commit). Callers adding messages block until
+  their rows are durable; under load many requests share one commit, which
+  keeps the outbox fast enough for alert storms.
+- Each API process owns the queued rows it inserted through a lease that it
+  renews while running. Rows whose lease ran out (their process died) are
+  claimed by a live process and resumed. A clean shutdown releases its
+  leases so the next start picks them up at once.
+"""
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+log = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+class Outbox:
+    """SQLite outbox shared by all API worker processes."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id TEXT PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            telegram_message_id INTEGER,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            sent_at REAL,
+            owner TEXT,
+            lease_until REAL NOT NULL DEFAULT 0,
+            priority TEXT NOT NULL DEFAULT 'normal'
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_status_lease ON outbox(status, lease_until);
+        CREATE INDEX IF NOT EXISTS idx_outbox_updated ON outbox(updated_at);
+        CREATE INDEX IF NOT EXISTS idx_outbox_chat_created ON outbox(chat_id, created_at);
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path, lease=30.0, retention=86400.0):
+        self.path = path
+        self.lease = lease
+        self.retention = retention
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(outbox)')}
+        if 'priority' not in columns:
+            # Outbox files from before priorities were stored
+            conn.execute("ALTER TABLE outbox ADD COLUMN priority TEXT NOT NULL DEFAULT 'normal'")
+        self._cond = threading.Condition()
+        self._inserts = []
+        self._updates = []
+        self._batch = 0      # number of the batch currently being collected
+        self._flushed = 0    # last batch committed (or failed)
+        self._errors = {}    # batch number -> exception, for the callers waiting on it
+        self._stopping = False
+        self._threads = []
+        self.counters = {'batches': 0, 'rows_inserted': 0, 'recovered': 0}
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def start(self, on_recovered):
+        """Start the flusher and the lease keeper.
+
+        on_recovered(rows) is called with (id, chat_id, text, attempts, priority)
+        tuples for orphaned rows this process has taken over.
+        """
+        self._on_recovered = on_recovered
+        for target, name in ((self._flush_loop, 'outbox-flush'), (self._lease_loop, 'outbox-lease')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Flush pending writes and hand our unsent rows back for the next start."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(5)
+        self._connect().execute(
+            'UPDATE outbox SET owner = NULL, lease_until = 0 WHERE owner = ? AND status = ?',
+            (self.owner, QUEUED)
+        )
+
+    # -- writes ---------------------------------------------------------------
+
+    def add_many(self, jobs):
+        """Durably record new messages. Blocks until they are committed."""
+        now = time.time()
+        rows = [
+            (job.id, job.chat_id, job.text, QUEUED, now, now, self.owner, now + self.lease, job.priority)
+            for job in jobs
+        ]
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("Outbox is shutting down")
+            self._inserts.extend(rows)
+            batch = self._batch + 1
+            self._cond.notify_all()
+            while self._flushed < batch:
+                self._cond.wait()
+            error = self._errors.pop(batch, None)
+        if error is not None:
+            raise error
+
+    def sync(self, timeout=None):
+        """Wait until every write queued so far is committed. False on timeout."""
+        with self._cond:
+            batch = self._batch + 1 if self._inserts or self._updates else self._batch
+            return self._cond.wait_for(lambda: self._flushed >= batch, timeout)
+
+    def _update(self, sql, params):
+        """Queue a status update for the next commit (doesn't wait for it)."""
+        with self._cond:
+            self._updates.append((sql, params))
+            self._cond.notify_all()
+
+    def mark_sent(self, message_id, attempts, telegram_message_id):
+        now = time.time()
+        self._update(
+            'UPDATE outbox SET status = ?, attempts = ?, telegram_message_id = ?, error = NULL, '
+            'sent_at = ?, updated_at = ?, owner = NULL WHERE id = ?',
+            (SENT, attempts, telegram_message_id, now, now, message_id)
+        )
+
+    def mark_failed(self, message_id, attempts, error):
+        self._update(
+            'UPDATE outbox SET status = ?, attempts = ?, error = ?, updated_at = ?, owner = NULL WHERE id = ?',
+            (FAILED, attempts, str(error)[:500], time.time(), message_id)
+        )
+
+    def mark_retry(self, message_id, attempts, error):
+        self._update(
+            'UPDATE outbox SET attempts = ?, error = ?, updated_at = ? WHERE id = ?',
+            (attempts, str(error)[:500], time.time(), message_id)
+        )
+
+    def remember_key(self, key, fingerprint, message_id):
+        """Map an Idempotency-Key to its message (the first mapping wins)."""
+        self._update(
+            'INSERT OR IGNORE INTO idempotency_keys (key, fingerprint, message_id, created_at) VALUES (?, ?, ?, ?)',
+            (key, fingerprint, message_id, time.time())
+        )
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._inserts and not self._updates and not self._stopping:
+                    self._cond.wait()
+                if self._stopping and not self._inserts and not self._updates:
+                    return
+                inserts, self._inserts = self._inserts, []
+                updates, self._updates = self._updates, []
+                self._batch += 1
+                batch = self._batch
+            error = None
+            try:
+                self._commit(inserts, updates)
+            except Exception as e:
+                log.error("Outbox write failed", extra={
+                    'inserts': len(inserts), 'updates': len(updates), 'error': str(e),
+                })
+                error = e
+            with self._cond:
+                self._flushed = batch
+                if error is not None and inserts:
+                    self._errors[batch] = error
+                self.counters['batches'] += 1
+                self.counters['rows_inserted'] += len(inserts) if error is None else 0
+                self._cond.notify_all()
+
+    def _commit(self, inserts, updates):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if inserts:
+                conn.executemany(
+                    'INSERT INTO outbox (id, chat_id, text, status, created_at, updated_at, owner, lease_until, '
+                    'priority) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    inserts
+                )
+            for sql, params in updates:
+                conn.execute(sql, params)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    # -- leases and recovery -----------------------------------------------------
+
+    def claim_orphans(self):
+        """Take over queued rows whose owner's lease ran out. Returns the rows."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                'SELECT id, chat_id, text, attempts, priority FROM outbox WHERE status = ? AND lease_until < ? '
+                'ORDER BY created_at',
+                (QUEUED, now)
+            ).fetchall()
+            conn.executemany(
+                'UPDATE outbox SET owner = ?, lease_until = ? WHERE id = ?',
+                [(self.owner, now + self.lease, row[0]) for row in rows]
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self.counters['recovered'] += len(rows)
+        return rows
+
+    def _lease_loop(self):
+        last_purge = 0.0
+        while True:
+            try:
+                now = time.time()
+                self._connect().execute(
+                    'UPDATE outbox SET lease_until = ? WHERE owner = ? AND status = ?',
+                    (now + self.lease, self.owner, QUEUED)
+                )
+                rows = self.claim_orphans()
+                if rows:
+                    log.info("Resuming unsent messages from the outbox", extra={'messages': len(rows)})
+                    self._on_recovered(rows)
+                if now - last_purge > 3600:
+                    conn = self._connect()
+                    conn.execute(
+                        'DELETE FROM outbox WHERE status != ? AND updated_at < ?', (QUEUED, now - self.retention)
+                    )
+                    conn.execute('DELETE FROM idempotency_keys WHERE created_at < ?', (now - self.retention,))
+                    last_purge = now
+            except sqlite3.Error as e:
+                log.error("Outbox lease renewal failed", extra={'error': str(e)})
+            with self._cond:
+                if self._stopping:
+                    return
+                self._cond.wait(self.lease / 3)
+                if self._stopping:
+                    return
+
+    # -- reads ----------------------------------------------------------------------
+
+    def get(self, message_id):
+        """Delivery record for one message, or None."""
+        row = self._connect().execute(
+            'SELECT id, chat_id, status, attempts, telegram_message_id, error, created_at, sent_at '
+            'FROM outbox WHERE id = ?',
+            (message_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        keys = ('message_id', 'chat_id', 'status', 'attempts', 'telegram_message_id', 'error',
+                'created_at', 'sent_at')
+        return dict(zip(keys, row))
+
+    def find_key(self, key):
+        """(message_id, fingerprint) recorded for an Idempotency-Key, or None."""
+        return self._connect().execute(
+            'SELECT message_id, fingerprint FROM idempotency_keys WHERE key = ?', (key,)
+        ).fetchone()
+
+    def find_recent(self, chat_id, text, since):
+        """Id of the latest identical message created at or after `since`, or None."""
+        row = self._connect().execute(
+            'SELECT id FROM outbox WHERE chat_id = ? AND created_at >= ? AND text = ? '
+            'ORDER BY created_at DESC LIMIT 1',
+            (chat_id, since, text)
+        ).fetchone()
+        return row[0] if row else None
+
+    def stats(self):
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall()
+        with self._cond:
+            return dict(self.counters, **{status: count for status, count in rows})
@@ -0,0 +1,304 @@
+"""On-demand profiling for api_server (requests) and bot_server (update batches).
+
+Off by default. While on:
+
+- a stack sampler thread records the stack of every in-flight request or
+  batch every PROFILE_SAMPLE_INTERVAL seconds (cheap: one
+  sys._current_frames() per tick), so any request slower than
+  PROFILE_SLOW_THRESHOLD is kept with its full sampled profile;
+- a PROFILE_SAMPLE_RATE fraction of them additionally run under cProfile
+  and are kept whatever their latency.
+
+Captures are written to PROFILE_DIR as <id>.json (metadata), <id>.collapsed
+(flamegraph-compatible collapsed stacks: `frame;frame;frame count`) and, when
+cProfiled, <id>.pstats. The newest PROFILE_KEEP slow captures and the
+newest PROFILE_KEEP sampled ones are kept per service, so routine samples
+never push out the slow requests.
+
+Settings live in a small control file in PROFILE_DIR, which every worker
+process and bot_server re-read about once a second, so one toggle (the
+/admin/profiling endpoint or `python profiling.py on`) reaches all of them
+without a restart.
+
+    python profiling.py on --sample-rate 0.05 --slow-threshold 0.5
+    python profiling.py off
+    python profiling.py status
+"""
+import cProfile
+import collections
+import glob
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTROL_FILE = 'control.json'
+CAPTURE_ID = re.compile(r'^[\w.-]+$')
+SETTINGS = ('enabled', 'sample_rate', 'slow_threshold')
+
+
+def collapse(frame):
+    """Stack from the outermost frame down to `frame`, in collapsed-stack notation."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class _Capture:
+    def __init__(self, kind, name, details):
+        self.kind = kind
+        self.name = name
+        self.details = details
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.at = time.time()
+        self.stacks = collections.Counter()
+        self.profile = None
+        self.done = False
+
+
+class Profiler:
+    """Watches requests/batches between start() and finish() while profiling is on."""
+
+    def __init__(self, service, directory, enabled=False, sample_rate=0.01, slow_threshold=1.0, keep=50,
+                 interval=0.005):
+        self.service = service
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.keep = keep
+        self.interval = interval
+        self.control_file = os.path.join(directory, CONTROL_FILE)
+        self.counters = {'watched': 0, 'captured_slow': 0, 'captured_sampled': 0}
+        self._control_mtime = None
+        self._checked_at = 0.0
+        self._active = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._next_id = 0
+        self._refresh_settings(force=True)
+
+    @classmethod
+    def from_env(cls, service):
+        return cls(
+            service,
+            os.path.join(BACKEND_DIR, os.getenv('PROFILE_DIR', 'profiles')),
+            enabled=os.getenv('PROFILING', 'off').lower() in ('1', 'on', 'true', 'yes'),
+            sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', 0.01)),
+            slow_threshold=float(os.getenv('PROFILE_SLOW_THRESHOLD', 1)),
+            keep=int(os.getenv('PROFILE_KEEP', 50)),
+            interval=float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005)),
+        )
+
+    # --- settings shared through the control file ---
+
+    def settings(self):
+        self._refresh_settings()
+        return {name: getattr(self, name) for name in SETTINGS}
+
+    def configure(self, **changes):
+        """Change settings for every process sharing PROFILE_DIR. Returns the new settings."""
+        settings = dict(self.settings(), **{k: v for k, v in changes.items() if k in SETTINGS and v is not None})
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f'{self.control_file}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(dict(settings, updated_at=time.time()), f)
+        os.replace(tmp, self.control_file)
+        self._refresh_settings(force=True)
+        return self.settings()
+
+    def _refresh_settings(self, force=False):
+        """Re-read the control file if it changed; checked at most once a second."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < 1.0:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.control_file).st_mtime_ns
+        except OSError:
+            return  # no control file yet: keep the PROFILING* env settings
+        if mtime == self._control_mtime:
+            return
+        try:
+            with open(self.control_file, 'r', encoding='utf-8') as f:
+                settings = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._control_mtime = mtime
+        self.enabled = bool(settings.get('enabled', self.enabled))
+        self.sample_rate = float(settings.get('sample_rate', self.sample_rate))
+        self.slow_threshold = float(settings.get('slow_threshold', self.slow_threshold))
+
+    # --- watching requests ---
+
+    def start(self, kind, name, **details):
+        """Begin watching one request or batch on this thread. Returns a handle for finish(), or None."""
+        self._refresh_settings()
+        if not self.enabled:
+            return None
+        capture = _Capture(kind, name, details)
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                capture.profile = profile
+            except ValueError:
+                pass  # another profiler is active (Python 3.12+ allows one at a time)
+        with self._lock:
+            self._active[capture.thread_id] = capture
+            self.counters['watched'] += 1
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+                self._sampler.start()
+        return capture
+
+    def finish(self, capture):
+        """Stop watching; keep the capture if it was slow or cProfiled."""
+        if capture is None:
+            return
+        if capture.profile is not None:
+            capture.profile.disable()
+        duration = time.perf_counter() - capture.started
+        with self._lock:
+            capture.done = True
+            for thread_id in [t for t, c in self._active.items() if c is capture]:
+                del self._active[thread_id]
+        slow = duration >= self.slow_threshold
+        if not slow and capture.profile is None:
+            return
+        try:
+            self._save(capture, duration, slow)
+        except OSError as e:
+            log.warning("Could not save profile", extra={'error': str(e)})
+
+    def run_in(self, capture, func, *args):
+        """Call func(*args), sampling this thread into a capture started on another thread.
+
+        For work a batch hands to worker threads (asyncio.to_thread), which would
+        otherwise show up only as the event loop waiting. cProfile still covers
+        just the thread that started the capture.
+        """
+        thread_id = threading.get_ident()
+        with self._lock:
+            attached = capture is not None and not capture.done and thread_id not in self._active
+            if attached:
+                self._active[thread_id] = capture
+        try:
+            return func(*args)
+        finally:
+            if attached:
+                with self._lock:
+                    if self._active.get(thread_id) is capture:
+                        del self._active[thread_id]
+
+    def _sample(self):
+        """Record the stack of every watched thread until profiling is switched off."""
+        while self.enabled:
+            time.sleep(self.interval)
+            self._refresh_settings()
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, capture in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        capture.stacks[collapse(frame)] += 1
+
+    # --- captures on disk ---
+
+    def _save(self, capture, duration, slow):
+        os.makedirs(self.directory, exist_ok=True)
+        reason = 'slow' if slow else 'sampled'
+        with self._lock:
+            self._next_id += 1
+            capture_id = f'{int(capture.at * 1000)}-{self.service}-{reason}-{os.getpid()}-{self._next_id}'
+            self.counters[f'captured_{reason}'] += 1
+        base = os.path.join(self.directory, capture_id)
+        if capture.profile is not None:
+            capture.profile.dump_stats(base + '.pstats')
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in capture.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        meta = {
+            'id': capture_id, 'service': self.service, 'pid': os.getpid(), 'kind': capture.kind,
+            'name': capture.name, 'at': capture.at, 'duration_ms': round(duration * 1000, 1),
+            'slow': slow, 'formats': ['collapsed'] + (['pstats'] if capture.profile is not None else []),
+            'samples': sum(capture.stacks.values()),
+        }
+        meta.update(capture.details)
+        # Metadata last: a capture is listed only once its files are complete
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        log.info("Saved profile", extra={
+            'capture_id': capture_id, 'name': capture.name, 'duration_ms': meta['duration_ms'], 'slow': slow,
+        })
+        self._prune(reason)
+
+    def _prune(self, reason):
+        """Keep the newest `keep` slow or sampled captures of this service (across its processes)."""
+        ours = sorted(glob.glob(os.path.join(self.directory, f'*-{self.service}-{reason}-*.json')),
+                      key=lambda path: int(os.path.basename(path).split('-', 1)[0]))
+        for path in ours[:-self.keep] if self.keep > 0 else ours:
+            base = path[:-len('.json')]
+            for ext in ('.json', '.collapsed', '.pstats'):
+                try:
+                    os.remove(base + ext)
+                except OSError:
+                    pass
+
+    def captures(self):
+        """Metadata of every kept capture (all services sharing PROFILE_DIR), newest first."""
+        found = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            if os.path.basename(path) == CONTROL_FILE:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    found.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # pruned or still being written
+        return sorted(found, key=lambda meta: meta['at'], reverse=True)
+
+    def capture_path(self, capture_id, fmt):
+        """Path of a capture's pstats or collapsed file, or None if there is none."""
+        if fmt not in ('pstats', 'collapsed') or not CAPTURE_ID.match(capture_id):
+            return None
+        path = os.path.join(self.directory, f'{capture_id}.{fmt}')
+        return path if os.path.exists(path) else None
+
+    def stats(self):
+        with self._lock:
+            active = len({id(capture) for capture in self._active.values()})
+        return dict(self.counters, active=active, **self.settings())
+
+
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Switch profiling on or off for every api_server/bot_server process")
+    parser.add_argument('action', choices=['on', 'off', 'status'])
+    parser.add_argument('--sample-rate', type=float, help="fraction of requests/batches to run under cProfile")
+    parser.add_argument('--slow-threshold', type=float, help="keep every request/batch slower than this (seconds)")
+    args = parser.parse_args()
+
+    profiler = Profiler.from_env('cli')
+    if args.action != 'status':
+        profiler.configure(enabled=args.action == 'on', sample_rate=args.sample_rate,
+                           slow_threshold=args.slow_threshold)
+    print(json.dumps(profiler.settings()))
+    for meta in profiler.captures()[:20]:
+        print(f"{meta['id']}  {meta['name']}  {meta['duration_ms']} ms  {'/'.join(meta['formats'])}")
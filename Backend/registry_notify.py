@@ -0,0 +1,82 @@
+"""Loopback notifications from bot_server to api_server when the registry changes.
+
+bot_server sends a tiny UDP datagram after every write; api_server listens
+for it and refreshes its registry cache right away, which wakes presence
+long-polls and /users/events streams without waiting for their next poll.
+Datagrams are fire-and-forget: if the API isn't running nothing happens.
+
+With several API worker processes (API_WORKERS > 1) each worker listens on
+its own port starting at REGISTRY_NOTIFY_PORT, and the bot notifies all of
+them.
+"""
+import logging
+import os
+import socket
+import threading
+
+log = logging.getLogger(__name__)
+
+NOTIFY_HOST = os.getenv('REGISTRY_NOTIFY_HOST', '127.0.0.1')
+NOTIFY_PORT = int(os.getenv('REGISTRY_NOTIFY_PORT', 5099))
+# One port per API worker process: NOTIFY_PORT .. NOTIFY_PORT + NOTIFY_PORTS - 1
+NOTIFY_PORTS = max(1, int(os.getenv('API_WORKERS', 1)))
+
+
+def notify_change(host=NOTIFY_HOST, port=NOTIFY_PORT, ports=NOTIFY_PORTS):
+    """Tell every listening api_server worker that the registry changed."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for offset in range(ports):
+                sock.sendto(b'changed', (host, port + offset))
+    except OSError:
+        pass
+
+
+class ChangeListener:
+    """Background thread that calls on_change() for every notification received."""
+
+    def __init__(self, on_change, host=NOTIFY_HOST, port=NOTIFY_PORT, ports=NOTIFY_PORTS):
+        self.on_change = on_change
+        self.host = host
+        self.port = port
+        self.ports = ports
+        self._sock = None
+
+    def start(self):
+        """Bind the first free port in the range and start listening.
+
+        Returns False if every port is taken.
+        """
+        for port in range(self.port, self.port + self.ports):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.bind((self.host, port))
+            except OSError as e:
+                sock.close()
+                error = e
+                continue
+            self._sock = sock
+            break
+        else:
+            last = self.port + self.ports - 1
+            log.warning("Registry change listener disabled", extra={
+                'address': f'{self.host}:{self.port}-{last}', 'error': str(error),
+            })
+            return False
+        threading.Thread(target=self._run, name='registry-notify', daemon=True).start()
+        return True
+
+    def stop(self):
+        if self._sock is not None:
+            self._sock.close()
+
+    def _run(self):
+        while True:
+            try:
+                self._sock.recvfrom(64)
+            except OSError:
+                return
+            try:
+                self.on_change()
+            except Exception as e:
+                log.error("Registry refresh after change notification failed", extra={'error': str(e)})
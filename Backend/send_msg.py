@@ -1,75 +1,275 @@
-import requests
-import os
+"""Send a Telegram message to one registered user, or broadcast it to many.
+
+    python send_msg.py "Test message"                        # first registered user
+    python send_msg.py "Hi {username}" --user alice
+    python send_msg.py "Maintenance tonight, {username}" --all
+    python send_msg.py -f notice.txt --list guardians.txt
+    python send_msg.py "..." --pattern 'team_*' --dry-run
+
+Broadcasts go through the same TelegramDispatcher as the API, so sends run
+concurrently but stay under the global rate (--rate). Every delivered user is
+appended to a checkpoint file; running the same broadcast again skips them,
+so an interrupted broadcast resumes without re-sending.
+"""
+import argparse
+import fnmatch
+import hashlib
 import json
+import os
+import sys
+import threading
+import time
 from dotenv import load_dotenv
+from user_store import normalize_username, open_user_store
+from telegram_client import TelegramClient, TelegramError
+from dispatch import TelegramDispatcher
+import logs
 
 # Load environment variables
 load_dotenv()
 
-# Get the directory where this script is located
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-USERS_FILE = os.path.join(SCRIPT_DIR, 'users.json')
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
 
 def load_users():
-    """Load users from users.json file."""
-    if not os.path.exists(USERS_FILE):
-        return {}
-    
-    try:
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {}
+    """Load users from the shared user store (same as api_server.py and bot_server.py)."""
+    return open_user_store().load_all() or {}
+
+
+def render(message, username):
+    """Fill in per-user placeholders ({username})."""
+    return message.replace('{username}', username)
+
+
+def get_client():
+    bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not bot_token:
+        raise ValueError("TELEGRAM_BOT_TOKEN environment variable is required. Please create a .env file in the Backend directory.")
+    return TelegramClient(bot_token, pool_size=32)
+
 
 def send_telegram_message(username=None, message="Test message"):
     """
     Send a message to Telegram.
-    
+
     Args:
-        username: Telegram username (optional). If provided, looks up chat_id from users.json.
-                  If not provided, uses the first user in users.json.
+        username: Telegram username (optional). If provided, looks up chat_id from the user store.
+                  If not provided, uses the first registered user.
         message: Message text to send
     """
-    bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
-    
-    if not bot_token:
-        raise ValueError("TELEGRAM_BOT_TOKEN environment variable is required. Please create a .env file in the Backend directory.")
-
-    # Load users from users.json (same as api_server.py and bot_server.py)
+    telegram = get_client()
     users = load_users()
-    
+
     if not users:
-        raise ValueError("No users found in users.json. Start the bot_server.py first to populate users.json")
-    
-    # Get chat_id from users.json
+        raise ValueError("No users found in the user store. Start the bot_server.py first to register users")
+
+    # Get chat_id from the user store
     if username:
         if username not in users:
-            raise ValueError(f"User '{username}' not found in users.json. Available users: {list(users.keys())}")
+            raise ValueError(f"User '{username}' not found in the user store. Available users: {list(users.keys())}")
         chat_id = users[username]
     else:
         # Use first user if no username specified
-        first_username = list(users.keys())[0]
-        chat_id = users[first_username]
-        print(f"⚠️ No username specified, using first user: {first_username} (chat_id: {chat_id})")
-
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": message
-    }
-    
+        username = list(users.keys())[0]
+        chat_id = users[username]
+        print(f"⚠️ No username specified, using first user: {username} (chat_id: {chat_id})")
+
+    try:
+        telegram.send_message(chat_id, render(message, username))
+        latency = telegram.stats()['sendMessage']['last_latency']
+        print(f"✅ Message sent successfully to {username} (chat_id: {chat_id}) in {latency * 1000:.0f} ms!")
+    except TelegramError as e:
+        print(f"❌ Failed to send. Error: {e}")
+
+
+def select_targets(users, names=None, pattern=None):
+    """Pick [(username, chat_id)] from the store: everyone, a list of names, or a glob pattern.
+
+    Names and patterns match case-insensitively and without '@', like the app.
+    Returns (targets, unknown_names).
+    """
+    by_norm = {normalize_username(name): (name, chat_id) for name, chat_id in users.items()}
+    if names is not None:
+        targets, unknown, seen = [], [], set()
+        for name in names:
+            match = by_norm.get(normalize_username(name))
+            if match is None:
+                unknown.append(name)
+            elif match[0] not in seen:
+                seen.add(match[0])
+                targets.append(match)
+        return targets, unknown
+    if pattern is not None:
+        pattern = normalize_username(pattern)
+        return [match for norm, match in sorted(by_norm.items()) if fnmatch.fnmatchcase(norm, pattern)], []
+    return sorted(users.items()), []
+
+
+def read_name_list(path):
+    """One username per line; blank lines and # comments are ignored."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.split('#', 1)[0].strip() for line in f if line.split('#', 1)[0].strip()]
+
+
+def default_checkpoint(message, selector):
+    """Checkpoint path derived from the message and the selector (--all, list file or pattern).
+
+    Not from the resolved usernames: a registration between runs must not start the broadcast over.
+    """
+    digest = hashlib.sha256(message.encode('utf-8'))
+    digest.update(b'\0' + json.dumps(selector).encode('utf-8'))
+    return os.path.join(BACKEND_DIR, f'.broadcast-{digest.hexdigest()[:12]}.jsonl')
+
+
+def read_checkpoint(path):
+    """Usernames already delivered according to the checkpoint file."""
+    delivered = set()
+    if not os.path.exists(path):
+        return delivered
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn last line from an interrupted run
+            if entry.get('ok'):
+                delivered.add(entry['username'])
+    return delivered
+
+
+def broadcast(message, targets, checkpoint, rate=25.0, workers=8):
+    """Send message to every (username, chat_id) not yet in the checkpoint.
+
+    Returns (sent, failed, not_attempted). Progress is printed on one line while sending.
+    """
+    done_before = read_checkpoint(checkpoint)
+    todo = [(username, chat_id) for username, chat_id in targets if username not in done_before]
+    print(f"📣 Broadcasting to {len(todo)} users ({len(targets) - len(todo)} already done, checkpoint {checkpoint})")
+    if not todo:
+        return 0, 0, 0
+
+    telegram = get_client()
+    dispatcher = TelegramDispatcher(
+        lambda chat_id, text: telegram.send_message(chat_id, text, retries=0),
+        workers=workers, global_rate=rate,
+    )
+    lock = threading.Lock()
+    finished = threading.Event()
+    counts = {'sent': 0, 'failed': 0}
+    log = open(checkpoint, 'a', encoding='utf-8')
+
+    def on_done(username, ok):
+        with lock:
+            if log.closed:
+                return
+            counts['sent' if ok else 'failed'] += 1
+            log.write(json.dumps({'username': username, 'ok': ok, 'at': time.time()}) + '\n')
+            log.flush()
+            if counts['sent'] + counts['failed'] == len(todo):
+                finished.set()
+
+    dispatcher.start()
+    started = time.monotonic()
     try:
-        response = requests.post(url, json=payload)
-        if response.status_code == 200:
-            print(f"✅ Message sent successfully to {username or first_username} (chat_id: {chat_id})!")
-        else:
-            print(f"❌ Failed to send. Error: {response.text}")
-    except Exception as e:
-        print(f"❌ Error: {e}")
+        for username, chat_id in todo:
+            dispatcher.enqueue(chat_id, render(message, username),
+                               on_done=lambda _id, ok, username=username: on_done(username, ok))
+        while not finished.wait(0.5):
+            print_progress(counts, len(todo), started)
+        print_progress(counts, len(todo), started)
+        print()
+    except KeyboardInterrupt:
+        # Drop what hasn't started; sends already in flight finish and reach the checkpoint
+        dispatcher.clear()
+        print(f"\n⏹️ Interrupted; run the same command again to resume from {checkpoint}")
+    finally:
+        dispatcher.stop()
+        with lock:
+            log.close()
+    return counts['sent'], counts['failed'], len(todo) - counts['sent'] - counts['failed']
+
+
+def print_progress(counts, total, started):
+    done = counts['sent'] + counts['failed']
+    elapsed = time.monotonic() - started
+    rate = done / elapsed if elapsed else 0.0
+    eta = f"{(total - done) / rate:.0f}s" if rate else '?'
+    sys.stdout.write(f"\r📤 {done}/{total} ({counts['sent']} sent, {counts['failed']} failed) "
+                     f"{rate:.1f} msg/s, ETA {eta}   ")
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a Telegram message to one user or broadcast it to many")
+    parser.add_argument('message', nargs='?', help="message text; {username} is replaced per user")
+    parser.add_argument('-f', '--message-file', help="read the message text from this file")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--user', help="send to this user only")
+    target.add_argument('--all', action='store_true', help="broadcast to every registered user")
+    target.add_argument('--list', help="broadcast to the usernames in this file (one per line)")
+    target.add_argument('--pattern', help="broadcast to usernames matching this glob, e.g. 'team_*'")
+    parser.add_argument('--rate', type=float, default=float(os.getenv('BROADCAST_RATE', 25)),
+                        help="messages per second (Telegram allows ~30/s per bot; leave room for live alerts)")
+    parser.add_argument('--workers', type=int, default=8, help="concurrent sends")
+    parser.add_argument('--checkpoint', help="checkpoint file (default: derived from the message and --all/--list/--pattern)")
+    parser.add_argument('--restart', action='store_true', help="ignore an existing checkpoint and send to everyone again")
+    parser.add_argument('--dry-run', action='store_true', help="show who would receive the message and exit")
+    args = parser.parse_args()
+    # Dispatcher warnings (e.g. a user who blocked the bot) as plain lines next to the progress output
+    logs.setup('send_msg', default_format='text', level='WARNING')
+
+    if args.message_file:
+        with open(args.message_file, 'r', encoding='utf-8') as f:
+            message = f.read().strip()
+    else:
+        message = args.message or "Test message from send_msg.py"
+
+    if not (args.all or args.list or args.pattern):
+        send_telegram_message(username=args.user, message=message)
+        return
+
+    users = load_users()
+    if not users:
+        raise ValueError("No users found in the user store. Start the bot_server.py first to register users")
+    targets, unknown = select_targets(
+        users,
+        names=read_name_list(args.list) if args.list else None,
+        pattern=args.pattern,
+    )
+    if unknown:
+        print(f"⚠️ {len(unknown)} usernames not registered, skipping: {', '.join(unknown[:10])}"
+              f"{' ...' if len(unknown) > 10 else ''}")
+    if not targets:
+        print("❌ No matching users")
+        return
+
+    if args.all:
+        selector = ['all']
+    elif args.list:
+        selector = ['list', os.path.abspath(args.list)]
+    else:
+        selector = ['pattern', normalize_username(args.pattern)]
+    checkpoint = args.checkpoint or default_checkpoint(message, selector)
+    if args.dry_run:
+        already = read_checkpoint(checkpoint)
+        print(f"🔎 {len(targets)} recipients ({len(already & {name for name, _ in targets})} already done):")
+        for username, chat_id in targets[:20]:
+            print(f"   {username} ({chat_id})")
+        if len(targets) > 20:
+            print(f"   ... and {len(targets) - 20} more")
+        print(f"💬 {render(message, targets[0][0])}")
+        return
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    sent, failed, remaining = broadcast(message, targets, checkpoint, rate=args.rate, workers=args.workers)
+    if remaining:
+        print(f"⏸️ Broadcast stopped: {sent} sent, {failed} failed, {remaining} not attempted")
+    else:
+        print(f"✅ Broadcast finished: {sent} sent, {failed} failed")
+    if failed or remaining:
+        print("↩️ Run the same command again to send to the rest")
+
 
 if __name__ == "__main__":
-    # Example: send to a specific user
-    # send_telegram_message(username="aryanagr", message="Your mother is FAT.")
-    
-    # Or send to first user in users.json
-    send_telegram_message(message="Test message from send_msg.py")
\ No newline at end of file
+    main()
@@ -0,0 +1,127 @@
+"""Production server for api_server.py.
+
+`python api_server.py` runs Flask's debug server: one process with the
+reloader. This runs the same app on a real WSGI server instead:
+
+- gunicorn (Linux/macOS): API_WORKERS processes x API_THREADS threads each
+- waitress (any OS, including Windows): one process with API_THREADS threads
+
+Shared state is safe across worker processes: users and alert sessions live
+in SQLite, every worker gets its own registry change port, and the global
+Telegram rate limit is split between workers. SIGTERM/Ctrl+C stop accepting
+connections, let in-flight requests finish and drain queued messages.
+
+    python serve_api.py --workers 4 --threads 16
+"""
+import argparse
+import logging
+import os
+import shutil
+import signal
+import sys
+import tempfile
+
+from dotenv import load_dotenv
+
+import logs
+
+load_dotenv()
+
+log = logging.getLogger('serve_api')
+
+
+def run_gunicorn(host, port, workers, threads, graceful_timeout):
+    from gunicorn.app.base import BaseApplication
+
+    def worker_exit(server, worker):
+        import api_server
+        api_server.stop_background_services()
+
+    class APIApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('graceful_timeout', graceful_timeout)
+            self.cfg.set('worker_exit', worker_exit)
+
+        def load(self):
+            # Imported in each worker, so every worker starts its own background services
+            from api_server import app
+            return app
+
+    APIApplication().run()
+
+
+def run_waitress(host, port, threads):
+    from waitress import create_server
+    import api_server
+
+    server = create_server(api_server.app, host=host, port=port, threads=threads)
+
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.info("Stopping API server")
+        server.close()
+        api_server.stop_background_services()
+        log.info("API server stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Flask API on a production WSGI server")
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'waitress'],
+                        default=os.getenv('API_SERVER', 'auto'),
+                        help="auto picks gunicorn where available, waitress otherwise")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('API_WORKERS', 2)),
+                        help="worker processes (gunicorn only)")
+    parser.add_argument('--threads', type=int, default=int(os.getenv('API_THREADS', 16)),
+                        help="request threads per worker; long-polls and SSE streams each hold one")
+    parser.add_argument('--graceful-timeout', type=int, default=int(os.getenv('API_GRACEFUL_TIMEOUT', 30)),
+                        help="seconds to let in-flight requests finish on shutdown")
+    args = parser.parse_args()
+    logs.setup('serve_api')
+
+    host = os.getenv('FLASK_HOST', '0.0.0.0')
+    port = int(os.getenv('FLASK_PORT', 5000))
+
+    server = args.server
+    if server == 'auto':
+        try:
+            import gunicorn  # noqa: F401
+            server = 'gunicorn' if sys.platform != 'win32' else 'waitress'
+        except ImportError:
+            server = 'waitress'
+
+    workers = args.workers if server == 'gunicorn' else 1
+    if args.workers > 1 and server == 'waitress':
+        log.warning("waitress runs a single process; ignoring --workers", extra={'workers': args.workers})
+    # api_server and registry_notify read these to split rate limits, notify ports
+    # and size the concurrent-send limit
+    os.environ['API_WORKERS'] = str(workers)
+    os.environ['API_THREADS'] = str(args.threads)
+    if workers > 1:
+        # Workers publish metric snapshots here so /metrics can merge them
+        metrics_dir = os.getenv('METRICS_DIR') or os.path.join(tempfile.gettempdir(), f'breathr-metrics-{port}')
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.environ['METRICS_DIR'] = metrics_dir
+
+    log.info("Flask API server starting (production)", extra={
+        'url': f"http://{host}:{port}", 'server': server, 'workers': workers, 'threads': args.threads,
+    })
+
+    if server == 'gunicorn':
+        run_gunicorn(host, port, workers, args.threads, args.graceful_timeout)
+    else:
+        run_waitress(host, port, args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,84 +1,120 @@
-"""Start Flask API server, Telegram bot server, and Supabase server"""
-import subprocess
-import sys
+"""Start Flask API server, Telegram bot server, and Supabase server under a supervisor.
+
+All three start in parallel; each is ready once its health probe answers,
+is restarted with backoff if it crashes or stops answering, and gets SIGTERM
+(and time to drain) on Ctrl+C. See supervisor.py.
+
+    python start_servers.py
+    python start_servers.py --status     # state, restarts and startup time per service
+"""
+import argparse
+import json
+import logging
 import os
+import signal
+import sys
+
+from dotenv import load_dotenv
+
+import logs
+from supervisor import Service, Supervisor
 
 # Change to Backend directory
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-print("=" * 60)
-print("🚀 Starting PanicBot Servers...")
-print("=" * 60)
-print("📡 Flask API Server: http://0.0.0.0:5000")
-print("🤖 Telegram Bot Server: Polling for updates...")
-print("🔐 Supabase Server: http://localhost:3000")
-print("=" * 60)
-print("Press Ctrl+C to stop all servers")
-print("=" * 60)
-
-# Start all servers
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+os.chdir(BACKEND_DIR)
+load_dotenv()
+
+log = logging.getLogger('start_servers')
+
+STATUS_FILE = os.path.join(BACKEND_DIR, os.getenv('SUPERVISOR_STATUS_FILE', '.supervisor-status.json'))
+STATUS_PORT = int(os.getenv('SUPERVISOR_PORT', 9100))
+
+parser = argparse.ArgumentParser(description="Start all PanicBot servers")
+parser.add_argument('--bot-mode', choices=['polling', 'webhook'], default=os.getenv('BOT_MODE', 'polling'),
+                    help="how the Telegram bot receives updates (default: polling)")
+parser.add_argument('--dev', action='store_true',
+                    help="run the API on Flask's debug server instead of the production server")
+parser.add_argument('--workers', type=int, default=None,
+                    help="API worker processes (default: API_WORKERS env var, or 2)")
+parser.add_argument('--threads', type=int, default=None,
+                    help="API threads per worker (default: API_THREADS env var, or 16)")
+parser.add_argument('--status', action='store_true',
+                    help="print the status of a running start_servers.py and exit")
+args = parser.parse_args()
+
+if args.status:
+    try:
+        with open(STATUS_FILE, 'r', encoding='utf-8') as f:
+            print(json.dumps(json.load(f), indent=2))
+    except FileNotFoundError:
+        print(f"No status file at {STATUS_FILE}; is start_servers.py running?")
+        sys.exit(1)
+    sys.exit(0)
+
+logs.setup('supervisor')
+
+# bot_server notifies one registry change port per API worker, so it must see the same count
+api_workers = 1 if args.dev else args.workers or int(os.getenv('API_WORKERS', 2))
+os.environ['API_WORKERS'] = str(api_workers)
+if args.dev:
+    api_command = [sys.executable, "api_server.py"]
+else:
+    api_command = [sys.executable, "serve_api.py", "--workers", str(api_workers)]
+    if args.threads:
+        api_command += ["--threads", str(args.threads)]
+
+api_port = int(os.getenv('FLASK_PORT', 5000))
+bot_metrics_port = int(os.getenv('BOT_METRICS_PORT', 9101))
+services = [
+    Service('api', api_command, probe_url=f'http://127.0.0.1:{api_port}/health'),
+    # The bot has no HTTP API of its own; its metrics endpoint shows it is up
+    Service('bot', [sys.executable, "bot_server.py", "--mode", args.bot_mode],
+            probe_url=f'http://127.0.0.1:{bot_metrics_port}/metrics' if bot_metrics_port else None),
+]
+
+# Supabase server (Node.js)
+supabase_dir = os.path.join(BACKEND_DIR, "supabase-server")
+if not os.path.exists(supabase_dir):
+    log.warning("supabase-server directory not found. Skipping Supabase server.")
+elif not os.path.exists(os.path.join(supabase_dir, "node_modules")):
+    log.warning("Supabase server dependencies not installed. Run: cd supabase-server && npm install")
+else:
+    # Use shell=True for Windows compatibility
+    services.append(Service('supabase', "npm.cmd start" if sys.platform == "win32" else "npm start",
+                            cwd=supabase_dir, shell=True, probe_url='http://127.0.0.1:3000/health'))
+
+supervisor = Supervisor(
+    services,
+    status_file=STATUS_FILE,
+    ready_timeout=float(os.getenv('SUPERVISOR_READY_TIMEOUT', 60)),
+    probe_interval=float(os.getenv('SUPERVISOR_PROBE_INTERVAL', 10)),
+    probe_failures=int(os.getenv('SUPERVISOR_PROBE_FAILURES', 3)),
+    max_backoff=float(os.getenv('SUPERVISOR_MAX_BACKOFF', 60)),
+    # Room for the API's graceful drain
+    grace=float(os.getenv('API_GRACEFUL_TIMEOUT', 30)) + 5,
+)
+
+
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+
+signal.signal(signal.SIGTERM, handle_sigterm)
+
+log.info("Starting PanicBot servers", extra={
+    'api': f"http://0.0.0.0:{api_port} ({'debug' if args.dev else 'production'})",
+    'bot': f"webhook on port {os.getenv('WEBHOOK_PORT', 8443)}" if args.bot_mode == 'webhook' else 'polling',
+    'services': [service.name for service in services],
+})
+if STATUS_PORT and supervisor.serve_status(port=STATUS_PORT):
+    log.info("Supervisor status endpoint listening", extra={'url': f"http://127.0.0.1:{STATUS_PORT}/status"})
 try:
-    # Start Flask API server (with output visible)
-    flask_process = subprocess.Popen(
-        [sys.executable, "api_server.py"],
-        stdout=sys.stdout,
-        stderr=sys.stderr,
-        bufsize=1
-    )
-    
-    # Start Telegram bot server (with output visible)
-    bot_process = subprocess.Popen(
-        [sys.executable, "bot_server.py"],
-        stdout=sys.stdout,
-        stderr=sys.stderr,
-        bufsize=1
-    )
-    
-    # Start Supabase server (Node.js)
-    supabase_dir = os.path.join(os.path.dirname(__file__), "supabase-server")
-    supabase_process = None
-    if os.path.exists(supabase_dir):
-        # Check if node_modules exists, if not, warn user
-        node_modules = os.path.join(supabase_dir, "node_modules")
-        if not os.path.exists(node_modules):
-            print("⚠️  Warning: Supabase server dependencies not installed.")
-            print("   Run: cd supabase-server && npm install")
-        else:
-            # Use shell=True for Windows compatibility
-            if sys.platform == "win32":
-                supabase_process = subprocess.Popen(
-                    ["npm.cmd", "start"],
-                    cwd=supabase_dir,
-                    shell=True,
-                    stdout=sys.stdout,
-                    stderr=sys.stderr,
-                    bufsize=1
-                )
-            else:
-                supabase_process = subprocess.Popen(
-                    ["npm", "start"],
-                    cwd=supabase_dir,
-                    shell=True,
-                    stdout=sys.stdout,
-                    stderr=sys.stderr,
-                    bufsize=1
-                )
-    else:
-        print("⚠️  Warning: supabase-server directory not found. Skipping Supabase server.")
-    
-    # Wait for all processes
-    flask_process.wait()
-    bot_process.wait()
-    if supabase_process:
-        supabase_process.wait()
+    supervisor.start()
+    supervisor.wait()
 except KeyboardInterrupt:
-    print("\n\n🛑 Stopping servers...")
-    flask_process.terminate()
-    bot_process.terminate()
-    if supabase_process:
-        supabase_process.terminate()
-    flask_process.wait()
-    bot_process.wait()
-    if supabase_process:
-        supabase_process.wait()
-    print("✅ All servers stopped")
+    pass
+finally:
+    supervisor.stop()
+    log.info("All servers stopped", extra={
+        'restarts': {service.name: service.restarts for service in services},
+    })
@@ -0,0 +1,300 @@
+"""Process supervisor for start_servers.py.
+
+Every service is started at once and watched by its own thread:
+
+- readiness: a service counts as ready once its probe URL answers (any
+  status below 500, so a rate-limited 429 still proves it is up) or, without
+  a probe, once it has stayed up for a couple of seconds. One that is not
+  ready within `ready_timeout` is restarted.
+- liveness: a ready service is probed every `probe_interval` seconds and
+  restarted after `probe_failures` failed probes in a row.
+- restarts: a service that exits on its own is started again after an
+  exponential backoff (1s, 2s, 4s, ... up to `max_backoff`). The backoff
+  resets once the service has stayed up for `stable_after` seconds.
+
+stop() sends SIGTERM to every child's process group (so npm's node process
+gets it too) and lets them drain for `grace` seconds before killing them.
+The state of every service is written to a JSON status file, and can also be
+served on GET /status.
+"""
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+STARTING = 'starting'
+READY = 'ready'
+UNHEALTHY = 'unhealthy'
+BACKOFF = 'backoff'
+STOPPED = 'stopped'
+
+
+def probe(url, timeout=2.0):
+    """True if something answers on url without a server error."""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status < 500
+    except urllib.error.HTTPError as e:
+        return e.code < 500
+    except (OSError, ValueError):
+        return False
+
+
+class Service:
+    """One supervised child process."""
+
+    def __init__(self, name, command, cwd=None, probe_url=None, shell=False):
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.probe_url = probe_url
+        self.shell = shell
+        self.process = None
+        self.state = STOPPED
+        self.restarts = 0
+        self.started_at = None
+        self.ready_at = None
+        self.startup_seconds = None
+        self.last_exit_code = None
+        self.thread = None
+
+    def status(self):
+        now = time.time()
+        return {
+            'state': self.state,
+            'pid': self.process.pid if self.process is not None and self.process.poll() is None else None,
+            'restarts': self.restarts,
+            'started_at': self.started_at,
+            'uptime_seconds': round(now - self.started_at, 1) if self.started_at and self.state != STOPPED else None,
+            'startup_seconds': self.startup_seconds,
+            'last_exit_code': self.last_exit_code,
+            'probe': self.probe_url,
+        }
+
+
+class Supervisor:
+    """Starts, watches and restarts a set of Services."""
+
+    def __init__(self, services, status_file=None, ready_timeout=60.0, probe_interval=10.0, probe_failures=3,
+                 max_backoff=60.0, stable_after=60.0, grace=35.0):
+        self.services = services
+        self.status_file = status_file
+        self.ready_timeout = ready_timeout
+        self.probe_interval = probe_interval
+        self.probe_failures = probe_failures
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.grace = grace
+        self.started = time.time()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._httpd = None
+
+    def start(self):
+        for service in self.services:
+            service.thread = threading.Thread(target=self._watch, args=(service,), name=f'watch-{service.name}',
+                                              daemon=True)
+            service.thread.start()
+        threading.Thread(target=self._report_ready, name='supervisor-ready', daemon=True).start()
+
+    def _spawn(self, service):
+        """Start the service's process unless we are shutting down. Returns False if not started."""
+        with self._lock:
+            if self._stopping.is_set():
+                return False
+            kwargs = {}
+            if sys.platform == 'win32':
+                kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+            else:
+                # Own process group: Ctrl+C reaches only us, and we forward SIGTERM to the whole group
+                kwargs['start_new_session'] = True
+            service.process = subprocess.Popen(service.command, cwd=service.cwd, shell=service.shell, **kwargs)
+            service.state = STARTING
+            service.started_at = time.time()
+            service.ready_at = None
+        self.write_status()
+        return True
+
+    def _watch(self, service):
+        failures = 0  # consecutive crashes, for the backoff
+        while self._spawn(service):
+            ready = self._wait_ready(service)
+            if ready:
+                self._monitor(service)
+            exit_code = service.process.poll()
+            if exit_code is None:
+                # Not ready in time, or stopped answering probes
+                self._terminate(service.process)
+                exit_code = service.process.wait()
+            service.last_exit_code = exit_code
+            if self._stopping.is_set():
+                break
+            failures = 1 if ready and time.time() - service.ready_at >= self.stable_after else failures + 1
+            backoff = min(self.max_backoff, 2 ** (failures - 1))
+            service.restarts += 1
+            service.state = BACKOFF
+            self.write_status()
+            log.warning("Service exited, restarting", extra={
+                'service': service.name, 'exit_code': exit_code, 'restarts': service.restarts, 'backoff': backoff,
+            })
+            if self._stopping.wait(backoff):
+                break
+        service.state = STOPPED
+        self.write_status()
+
+    def _wait_ready(self, service):
+        """Wait until the service is ready. False if it exited or timed out first."""
+        started = time.monotonic()
+        while True:
+            if self._wait_exit(service, 0.25 if service.probe_url else 2.0):
+                return False
+            if service.probe_url is None or probe(service.probe_url):
+                break
+            if time.monotonic() - started > self.ready_timeout:
+                log.error("Service not ready in time", extra={'service': service.name, 'timeout': self.ready_timeout})
+                return False
+        service.ready_at = time.time()
+        service.startup_seconds = round(time.monotonic() - started, 2)
+        service.state = READY
+        self.write_status()
+        log.info("Service ready", extra={
+            'service': service.name, 'pid': service.process.pid, 'startup_seconds': service.startup_seconds,
+            'restarts': service.restarts,
+        })
+        return True
+
+    def _monitor(self, service):
+        """Probe a ready service until it exits or fails too many probes in a row."""
+        failed = 0
+        while not self._wait_exit(service, self.probe_interval):
+            if service.probe_url is None or probe(service.probe_url):
+                if failed:
+                    service.state = READY
+                    self.write_status()
+                failed = 0
+                continue
+            failed += 1
+            service.state = UNHEALTHY
+            self.write_status()
+            log.warning("Health probe failed", extra={'service': service.name, 'failures': failed})
+            if failed >= self.probe_failures:
+                return
+
+    def _wait_exit(self, service, timeout):
+        """Wait up to timeout for the process to exit. True if it has (or we are stopping)."""
+        try:
+            service.process.wait(timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return self._stopping.is_set()
+
+    def _terminate(self, process):
+        if process.poll() is not None:
+            return
+        try:
+            if sys.platform == 'win32':
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                os.killpg(process.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    def _report_ready(self):
+        while not self._stopping.wait(0.25):
+            if all(service.state == READY for service in self.services):
+                log.info("All services ready", extra={'seconds': round(time.time() - self.started, 2)})
+                return
+
+    def stop(self):
+        """Forward SIGTERM to every service, wait for them to drain, then kill what is left."""
+        with self._lock:
+            self._stopping.set()
+        running = [s for s in self.services if s.process is not None and s.process.poll() is None]
+        log.info("Stopping services", extra={'services': [s.name for s in running], 'grace': self.grace})
+        for service in running:
+            self._terminate(service.process)
+        deadline = time.monotonic() + self.grace
+        for service in running:
+            try:
+                service.process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                log.warning("Service did not stop in time, killing it", extra={'service': service.name})
+                try:
+                    if sys.platform == 'win32':
+                        service.process.kill()
+                    else:
+                        os.killpg(service.process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                service.process.wait()
+        for service in self.services:
+            if service.thread is not None:
+                service.thread.join(2)
+            service.state = STOPPED
+        if self._httpd is not None:
+            self._httpd.shutdown()
+        self.write_status()
+
+    def wait(self):
+        """Block until stop() is called (e.g. from a signal handler)."""
+        while not self._stopping.wait(1):
+            pass
+
+    def status(self):
+        return {
+            'supervisor_pid': os.getpid(),
+            'started_at': self.started,
+            'stopping': self._stopping.is_set(),
+            'services': {service.name: service.status() for service in self.services},
+        }
+
+    def write_status(self):
+        if not self.status_file:
+            return
+        tmp = f'{self.status_file}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.status(), f, indent=2)
+            os.replace(tmp, self.status_file)
+        except OSError as e:
+            log.warning("Could not write status file", extra={'path': self.status_file, 'error': str(e)})
+
+    def serve_status(self, host='127.0.0.1', port=9100):
+        """Serve GET /status from a background thread. Returns False if the port is taken."""
+        supervisor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != '/status':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                status = supervisor.status()
+                ready = all(s['state'] == READY for s in status['services'].values())
+                body = json.dumps(status, indent=2).encode('utf-8')
+                self.send_response(200 if ready else 503)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        try:
+            self._httpd = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            log.warning("Status endpoint disabled", extra={'address': f'{host}:{port}', 'error': str(e)})
+            return False
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, name='supervisor-status', daemon=True).start()
+        return True
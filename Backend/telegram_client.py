@@ -0,0 +1,179 @@
+"""Shared Telegram Bot API client used by the bot, the API server and the scripts.
+
+One keep-alive ``requests.Session`` with a sized connection pool means sends
+reuse TLS connections to api.telegram.org instead of paying a new handshake
+each time. Every call gets a timeout, transient failures are retried with
+exponential backoff, and 429 responses wait for Telegram's ``retry_after``.
+"""
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+DEFAULT_API_BASE = 'https://api.telegram.org'
+# Retrying these after the request may have reached Telegram could deliver them twice
+NON_IDEMPOTENT = {'sendMessage'}
+
+
+class TelegramError(Exception):
+    """A Bot API call failed (network error, HTTP error or ok=false)."""
+
+    def __init__(self, description, error_code=None):
+        super().__init__(description)
+        self.description = description
+        self.error_code = error_code
+
+
+class RetryAfter(TelegramError):
+    """Telegram answered 429 Too Many Requests."""
+
+    def __init__(self, retry_after, description=''):
+        super().__init__(description or f"Rate limited, retry after {retry_after}s", 429)
+        self.retry_after = retry_after
+
+
+def never_sent(error):
+    """True if a request failed before reaching Telegram (no connection was made).
+
+    A read timeout or a dropped connection may come after Telegram acted on it.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+class TelegramClient:
+    """Bot API client with connection pooling, timeouts, retries and latency stats.
+
+    on_call, if given, is called as on_call(method, status, latency_seconds)
+    after every HTTP attempt; status is the HTTP status code, or 'error' when
+    the request never got a response.
+    """
+
+    def __init__(self, token, api_base=None, timeout=10, connect_timeout=5,
+                 max_retries=3, backoff=0.5, max_retry_after=30, pool_size=10, on_call=None):
+        self.token = token
+        self.api_base = (api_base or os.getenv('TELEGRAM_API_BASE', DEFAULT_API_BASE)).rstrip('/')
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.on_call = on_call
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def _url(self, method):
+        return f"{self.api_base}/bot{self.token}/{method}"
+
+    def _record(self, method, status, latency):
+        with self._stats_lock:
+            stats = self._stats.setdefault(method, {'calls': 0, 'errors': 0, 'total_latency': 0.0, 'last_latency': 0.0})
+            stats['calls'] += 1
+            stats['total_latency'] += latency
+            stats['last_latency'] = latency
+            if status != 200:
+                stats['errors'] += 1
+        if self.on_call is not None:
+            self.on_call(method, status, latency)
+
+    def stats(self):
+        """Per-method call counts, error counts and latencies (seconds)."""
+        with self._stats_lock:
+            return {
+                method: dict(s, avg_latency=s['total_latency'] / s['calls'] if s['calls'] else 0.0)
+                for method, s in self._stats.items()
+            }
+
+    def call(self, method, params=None, timeout=None, retries=None):
+        """Call a Bot API method and return its `result`.
+
+        Network errors and 5xx responses are retried with exponential backoff;
+        429 responses are retried after `retry_after` (if it's not too long).
+        sendMessage is only retried after a network error if it never left us
+        (connection refused or timed out), not after a read timeout.
+        Raises RetryAfter or TelegramError once retries are exhausted.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.max_retries if retries is None else retries
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self.session.post(
+                    self._url(method), json=params or {}, timeout=(self.connect_timeout, timeout)
+                )
+            except requests.exceptions.RequestException as e:
+                self._record(method, 'error', time.perf_counter() - started)
+                if attempt < retries and (method not in NON_IDEMPOTENT or never_sent(e)):
+                    time.sleep(self.backoff * 2 ** attempt)
+                    attempt += 1
+                    continue
+                raise TelegramError(f"Telegram API error: {e}") from e
+            self._record(method, response.status_code, time.perf_counter() - started)
+
+            try:
+                data = response.json()
+            except ValueError:
+                data = {'ok': False, 'description': response.text[:200]}
+
+            if response.status_code == 429:
+                retry_after = data.get('parameters', {}).get('retry_after', 1)
+                if attempt < retries and retry_after <= self.max_retry_after:
+                    time.sleep(retry_after)
+                    attempt += 1
+                    continue
+                raise RetryAfter(retry_after, data.get('description', ''))
+
+            if response.status_code >= 500 and attempt < retries:
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+                continue
+
+            if response.status_code != 200 or not data.get('ok'):
+                description = data.get('description') or f"HTTP {response.status_code}"
+                raise TelegramError(f"Telegram API error: {description}", response.status_code)
+            return data['result']
+
+    def get_me(self):
+        """Return the bot's User object."""
+        return self.call('getMe')
+
+    def send_message(self, chat_id, text, retries=None, **extra):
+        """Send a text message. Returns the sent Message object."""
+        params = dict(extra, chat_id=chat_id, text=text)
+        return self.call('sendMessage', params, retries=retries)
+
+    def get_updates(self, offset=None, limit=None, timeout=0, retries=0):
+        """Fetch updates. `timeout` is the long-poll time Telegram holds the request open."""
+        params = {'timeout': timeout}
+        if offset is not None:
+            params['offset'] = offset
+        if limit is not None:
+            params['limit'] = limit
+        # Give the HTTP request a few seconds more than the long poll itself
+        return self.call('getUpdates', params, timeout=timeout + 5, retries=retries)
+
+    def set_webhook(self, url, secret_token=None, allowed_updates=None):
+        """Register a webhook URL; Telegram then stops serving getUpdates."""
+        params = {'url': url}
+        if secret_token:
+            params['secret_token'] = secret_token
+        if allowed_updates is not None:
+            params['allowed_updates'] = allowed_updates
+        return self.call('setWebhook', params)
+
+    def delete_webhook(self):
+        """Remove any registered webhook so getUpdates works again."""
+        return self.call('deleteWebhook')
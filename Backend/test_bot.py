@@ -1,53 +1,54 @@
 """Quick test to verify bot can connect to Telegram API"""
-import requests
+import logging
 import os
 from dotenv import load_dotenv
+from telegram_client import TelegramClient
+import logs
 
 # Load environment variables
 load_dotenv()
+# Plain lines for a human; the token is masked even inside error text
+logs.setup('test_bot', default_format='text')
+log = logging.getLogger('test_bot')
 
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 if not TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable is required. Please create a .env file in the Backend directory.")
 
-print("Testing Telegram Bot API connection...")
-print(f"Token: {TOKEN[:10]}...{TOKEN[-5:]}")
+telegram = TelegramClient(TOKEN, max_retries=0)
+
+
+def latency_ms(method):
+    return round(telegram.stats()[method]['last_latency'] * 1000)
+
+
+log.info("Testing Telegram Bot API connection...", extra={'token': f'set (...{TOKEN[-4:]})'})
 
 # Test 1: Get bot info
-print("\n1. Testing getMe endpoint...")
+log.info("1. Testing getMe endpoint...")
 try:
-    response = requests.get(f"https://api.telegram.org/bot{TOKEN}/getMe", timeout=10)
-    data = response.json()
-    if data.get('ok'):
-        bot_info = data.get('result', {})
-        print(f"✅ Bot is connected!")
-        print(f"   Bot Name: {bot_info.get('first_name')}")
-        print(f"   Bot Username: @{bot_info.get('username')}")
-        print(f"   Bot ID: {bot_info.get('id')}")
-    else:
-        print(f"❌ Error: {data.get('description')}")
+    bot_info = telegram.get_me()
+    log.info("✅ Bot is connected!", extra={
+        'latency_ms': latency_ms('getMe'),
+        'bot_name': bot_info.get('first_name'),
+        'bot_username': f"@{bot_info.get('username')}",
+        'bot_id': bot_info.get('id'),
+    })
 except Exception as e:
-    print(f"❌ Connection failed: {e}")
+    log.error("❌ Connection failed", extra={'error': str(e)})
 
 # Test 2: Get updates
-print("\n2. Testing getUpdates endpoint...")
+log.info("2. Testing getUpdates endpoint...")
 try:
-    response = requests.get(f"https://api.telegram.org/bot{TOKEN}/getUpdates?timeout=5", timeout=10)
-    data = response.json()
-    if data.get('ok'):
-        updates = data.get('result', [])
-        print(f"✅ API is responding!")
-        print(f"   Pending updates: {len(updates)}")
-        if updates:
-            print(f"   Latest update ID: {updates[-1].get('update_id')}")
-        else:
-            print("   No pending updates (this is normal)")
-    else:
-        print(f"❌ Error: {data.get('description')}")
+    updates = telegram.get_updates(timeout=5)
+    log.info("✅ API is responding!", extra={
+        'latency_ms': latency_ms('getUpdates'),
+        'pending_updates': len(updates),
+        # No pending updates is normal
+        'latest_update_id': updates[-1].get('update_id') if updates else None,
+    })
 except Exception as e:
-    print(f"❌ Connection failed: {e}")
+    log.error("❌ Connection failed", extra={'error': str(e)})
 
-print("\n" + "="*50)
-print("If both tests passed, your bot is working!")
-print("If tests failed, check your bot token.")
-print("="*50)
+log.info("If both tests passed, your bot is working! If tests failed, check your bot token.")
+logs.shutdown()
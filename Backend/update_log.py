@@ -0,0 +1,58 @@
+"""Compact recordings of incoming Telegram update batches.
+
+A recording is a gzipped JSON-lines file with one line per getUpdates
+response (or webhook batch), so batch boundaries survive a replay:
+
+    {"at": 1718000000.123, "updates": [{...}, {...}]}
+
+bot_server appends to BOT_RECORD_FILE when it is set; bench/replay.py
+replays recordings through handle_updates.
+"""
+import gzip
+import json
+import threading
+import time
+import zlib
+
+
+class UpdateRecorder:
+    """Appends update batches to a .jsonl.gz file. Safe to call from any thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Appending starts a new gzip member; readers handle multi-member files
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self.batches = 0
+
+    def write_batch(self, updates, at=None):
+        if not updates:
+            return
+        line = json.dumps({'at': at or time.time(), 'updates': updates}, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+            # Flush per batch so a crash loses at most the batch being written
+            self._file.flush()
+            self.batches += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_batches(path):
+    """Yield (at, updates) for every batch in a recording.
+
+    A recording cut off mid-write (e.g. the bot was killed) ends at the last
+    complete batch instead of raising.
+    """
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    batch = json.loads(line)
+                except ValueError:
+                    return
+                yield batch.get('at'), batch['updates']
+    except (EOFError, zlib.error, gzip.BadGzipFile):
+        return
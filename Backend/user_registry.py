@@ -0,0 +1,187 @@
+"""In-process cache of the users registry shared by the API request threads."""
+import bisect
+import collections
+import itertools
+import threading
+import time
+
+from user_store import CHAT_ID_CHANGED, USER_REGISTERED, normalize_username
+
+
+class UserRegistry:
+    """Loads the user store once and reloads it only when the store changes.
+
+    Change detection uses the store's version token (file inode/mtime/size for
+    users.json, a write counter for SQLite), so a lookup costs a stat() or a
+    single-row query instead of a full load. If the store can't be read (e.g.
+    users.json caught mid-write), the previous contents are kept and the
+    reload is retried on the next access.
+
+    Change events come from the store's own change log when it has one
+    (SQLite), so cursors survive restarts. Otherwise they are derived by
+    diffing successive loads and only live as long as this process.
+
+    on_reload, if given, is called as on_reload(seconds, user_count) after
+    every reload.
+    """
+
+    # Derived events kept in memory for stores without a change log
+    MAX_DERIVED_EVENTS = 1000
+
+    def __init__(self, store, on_reload=None):
+        self.store = store
+        self.on_reload = on_reload
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._users = {}
+        self._by_norm = {}
+        self._version = object()
+        self.reload_count = 0
+        self.last_reload = None
+        self._has_change_log = hasattr(store, 'events_since')
+        self._derived_events = collections.deque(maxlen=self.MAX_DERIVED_EVENTS)
+        self._next_event_id = 1
+        self._sorted = ([], [])
+        self._sorted_reload = 0
+
+    def refresh(self):
+        """Reload the store if it changed since the last load. Returns True on reload."""
+        version = self.store.version()
+        if version == self._version:
+            return False
+
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock
+            if version == self._version:
+                return False
+
+            started = time.perf_counter()
+            users = self.store.load_all()
+            if users is None:
+                return False
+
+            if not self._has_change_log and self.reload_count:
+                self._derive_events(self._users, users)
+            self._users = users
+            self._by_norm = {normalize_username(name): chat_id for name, chat_id in users.items()}
+            self._version = version
+            self.reload_count += 1
+            self.last_reload = time.time()
+
+        if self.on_reload is not None:
+            self.on_reload(time.perf_counter() - started, len(users))
+        with self._changed:
+            self._changed.notify_all()
+        return True
+
+    def users(self):
+        """Return the current username -> chat_id mapping (treat as read-only)."""
+        self.refresh()
+        return self._users
+
+    def get(self, username):
+        """Return the chat_id for username (exact, then normalized match), or None."""
+        users = self.users()
+        if username in users:
+            return users[username]
+        return self._by_norm.get(normalize_username(username))
+
+    def sorted_usernames(self):
+        """(sort keys, usernames) in stable (normalized name, name) order.
+
+        Built on first use after a reload, so paging through a large registry
+        doesn't sort it again for every page.
+        """
+        self.refresh()
+        with self._lock:
+            if self._sorted_reload != self.reload_count:
+                keys = sorted((normalize_username(name), name) for name in self._users)
+                self._sorted = (keys, [name for _, name in keys])
+                self._sorted_reload = self.reload_count
+            return self._sorted
+
+    def iter_usernames(self, after=None, prefix=''):
+        """Yield usernames in sorted order, starting after the username `after`.
+
+        prefix limits the result to normalized usernames starting with it.
+        Walks one snapshot, so a reload part-way through doesn't affect it.
+        """
+        keys, names = self.sorted_usernames()
+        prefix = normalize_username(prefix) if prefix else ''
+        start = bisect.bisect_left(keys, (prefix,))
+        if after is not None:
+            # `after` need not still exist; the order alone says where to resume
+            start = max(start, bisect.bisect_right(keys, (normalize_username(after), after)))
+        for i in range(start, len(keys)):
+            if not keys[i][0].startswith(prefix):
+                return
+            yield names[i]
+
+    def page(self, after=None, prefix='', limit=100):
+        """One page of iter_usernames. Returns (usernames, next_cursor); next_cursor is None on the last page."""
+        usernames = list(itertools.islice(self.iter_usernames(after, prefix), limit + 1))
+        if len(usernames) > limit:
+            return usernames[:limit], usernames[limit - 1]
+        return usernames, None
+
+    def presence(self, usernames):
+        """Map each requested username to whether it is registered (normalized match)."""
+        return {username: self.get(username) is not None for username in usernames}
+
+    def wait_for_change(self, since_reload_count, timeout, poll_interval=0.5):
+        """Block until the registry reloads past since_reload_count or timeout expires.
+
+        Waiters re-check the store every poll_interval seconds and are woken
+        immediately when any thread's refresh() picks up a change.
+        Returns True if the registry changed.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            self.refresh()
+            if self.reload_count != since_reload_count:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            with self._changed:
+                if self.reload_count != since_reload_count:
+                    return True
+                self._changed.wait(min(poll_interval, remaining))
+
+    def _derive_events(self, old, new):
+        """Record change events by diffing two loads. Caller holds the lock."""
+        now = time.time()
+        for username, chat_id in new.items():
+            if username not in old:
+                event_type = USER_REGISTERED
+            elif old[username] != chat_id:
+                event_type = CHAT_ID_CHANGED
+            else:
+                continue
+            self._derived_events.append(
+                {'id': self._next_event_id, 'type': event_type, 'username': username, 'at': now}
+            )
+            self._next_event_id += 1
+
+    def latest_event_id(self):
+        """Cursor pointing at the newest change event."""
+        self.refresh()
+        if self._has_change_log:
+            return self.store.latest_event_id()
+        return self._next_event_id - 1
+
+    def events_since(self, cursor, limit=100):
+        """Return change events after cursor, oldest first."""
+        self.refresh()
+        if self._has_change_log:
+            return self.store.events_since(cursor, limit)
+        with self._lock:
+            return [event for event in self._derived_events if event['id'] > cursor][:limit]
+
+    def stats(self):
+        """Cache statistics, used to confirm the registry stays cached."""
+        return {
+            'users': len(self._users),
+            'reload_count': self.reload_count,
+            'last_reload': self.last_reload,
+        }
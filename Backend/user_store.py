@@ -0,0 +1,508 @@
+"""Storage backends for the username -> chat_id registry.
+
+Three backends are available, selected with the USER_STORE environment variable:
+
+- ``sqlite`` (default): an indexed SQLite database in WAL mode, so the bot can
+  upsert single rows while the API and send_msg read concurrently. Every
+  change is also recorded in a ``user_events`` table that the API streams
+  to clients.
+- ``journal``: an append-only journal of changes with periodic compaction
+  into a snapshot; writes cost O(changed users) and readers tail the journal.
+- ``json``: the original users.json file, written atomically.
+
+Run ``python user_store.py import [users.json]`` to copy an existing
+users.json into the SQLite database (or the journal, with USER_STORE=journal),
+and ``python user_store.py compact`` to compact the journal by hand.
+"""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_JSON_FILE = os.path.join(SCRIPT_DIR, 'users.json')
+DEFAULT_DB_FILE = os.path.join(SCRIPT_DIR, 'users.db')
+DEFAULT_JOURNAL_DIR = os.path.join(SCRIPT_DIR, 'users.journal')
+
+# Change event types
+USER_REGISTERED = 'user_registered'
+CHAT_ID_CHANGED = 'chat_id_changed'
+
+
+def normalize_username(username):
+    """Normalize a username the same way the app does (lowercase, no '@')."""
+    return username.lower().replace('@', '', 1)
+
+
+class JsonUserStore:
+    """users.json backend. Every save rewrites the whole file."""
+
+    def __init__(self, path=DEFAULT_JSON_FILE):
+        self.path = path
+        self._write_lock = threading.Lock()
+
+    def version(self):
+        """Opaque token that changes whenever the file changes."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def load_all(self):
+        """Return the full registry, or None if the file is unreadable."""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+            return json.loads(content) if content else {}
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def get(self, username):
+        users = self.load_all() or {}
+        if username in users:
+            return users[username]
+        normalized = normalize_username(username)
+        for name, chat_id in users.items():
+            if normalize_username(name) == normalized:
+                return chat_id
+        return None
+
+    def upsert_many(self, users):
+        """Insert or update the given users. Returns the number of rows changed."""
+        with self._write_lock:
+            current = self.load_all() or {}
+            changed = {name: chat_id for name, chat_id in users.items() if current.get(name) != chat_id}
+            if not changed:
+                return 0
+            current.update(changed)
+            # Write to a temp file and rename so readers never see a half-written file
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(current, f, indent=4, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            return len(changed)
+
+
+class SqliteUserStore:
+    """SQLite backend in WAL mode: concurrent readers, a single writer, row-level upserts."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            username_norm TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_username_norm ON users(username_norm);
+        CREATE TABLE IF NOT EXISTS user_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            username TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+    """
+
+    # Number of change events kept for resuming /users/events streams
+    EVENT_RETENTION = 100000
+
+    def __init__(self, path=DEFAULT_DB_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def version(self):
+        """Counter bumped by every write that changes a row."""
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def load_all(self):
+        rows = self._connect().execute('SELECT username, chat_id FROM users')
+        return {username: chat_id for username, chat_id in rows}
+
+    def get(self, username):
+        conn = self._connect()
+        row = conn.execute('SELECT chat_id FROM users WHERE username = ?', (username,)).fetchone()
+        if row is None:
+            row = conn.execute(
+                'SELECT chat_id FROM users WHERE username_norm = ? ORDER BY updated_at DESC LIMIT 1',
+                (normalize_username(username),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def upsert_many(self, users):
+        """Insert or update the given users. Returns the number of rows changed."""
+        if not users:
+            return 0
+        now = time.time()
+        conn = self._connect()
+        with self._write_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = []
+                events = []
+                for name, chat_id in users.items():
+                    row = conn.execute('SELECT chat_id FROM users WHERE username = ?', (name,)).fetchone()
+                    if row is not None and row[0] == chat_id:
+                        continue
+                    rows.append((name, normalize_username(name), chat_id, now))
+                    events.append((USER_REGISTERED if row is None else CHAT_ID_CHANGED, name, now))
+                conn.executemany(
+                    """
+                    INSERT INTO users (username, username_norm, chat_id, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(username) DO UPDATE SET
+                        chat_id = excluded.chat_id,
+                        updated_at = excluded.updated_at
+                    """,
+                    rows
+                )
+                conn.executemany(
+                    'INSERT INTO user_events (type, username, created_at) VALUES (?, ?, ?)',
+                    events
+                )
+                changed = len(rows)
+                if changed:
+                    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+                    conn.execute(
+                        'DELETE FROM user_events WHERE id <= (SELECT MAX(id) FROM user_events) - ?',
+                        (self.EVENT_RETENTION,)
+                    )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return changed
+
+    def latest_event_id(self):
+        row = self._connect().execute('SELECT MAX(id) FROM user_events').fetchone()
+        return row[0] or 0
+
+    def events_since(self, cursor, limit=100):
+        """Return up to `limit` change events with id > cursor, oldest first."""
+        rows = self._connect().execute(
+            'SELECT id, type, username, created_at FROM user_events WHERE id > ? ORDER BY id LIMIT ?',
+            (cursor, limit)
+        )
+        return [
+            {'id': event_id, 'type': event_type, 'username': username, 'at': created_at}
+            for event_id, event_type, username, created_at in rows
+        ]
+
+    def import_json(self, json_path=DEFAULT_JSON_FILE):
+        """One-shot import of an existing users.json. Returns the number of rows changed."""
+        users = JsonUserStore(json_path).load_all()
+        if users is None:
+            raise ValueError(f"Could not parse {json_path}")
+        return self.upsert_many(users)
+
+
+class JournalUserStore:
+    """Append-only journal of username -> chat_id changes plus a compacted snapshot.
+
+    Everything lives in one directory:
+
+    - ``snapshot.json``: ``{"seq": N, "users": {...}}``, the registry as of
+      journal entry N, replaced atomically (temp file + rename)
+    - ``segment-<first seq>.jsonl``: journal entries ``{"s": seq, "u": name,
+      "c": chat_id}``, one per line, appended and fsynced once per batch
+
+    A write costs O(changed users) instead of rewriting the whole registry.
+    Once COMPACT_EVERY entries have piled up, the writer starts a new segment
+    and a background thread writes a fresh snapshot and deletes the segments
+    it covers. Loading replays snapshot + journal; after the first load,
+    load_all() only reads journal lines appended since the previous call.
+    """
+
+    SNAPSHOT = 'snapshot.json'
+    SEGMENT_PREFIX = 'segment-'
+    COMPACT_EVERY = 10000
+
+    def __init__(self, path=DEFAULT_JOURNAL_DIR, compact_every=None):
+        self.path = path
+        self.compact_every = compact_every or int(os.getenv('JOURNAL_COMPACT_EVERY', self.COMPACT_EVERY))
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._users = {}
+        self._seq = 0
+        self._segment = None  # segment we have read up to, and how far
+        self._offset = 0
+        self._file = None  # writer's append handle
+        self._compacting = False
+        self._entries_since_snapshot = 0
+
+    def _segments(self):
+        return sorted(
+            name for name in os.listdir(self.path)
+            if name.startswith(self.SEGMENT_PREFIX) and name.endswith('.jsonl')
+        )
+
+    @classmethod
+    def _segment_start(cls, name):
+        return int(name[len(cls.SEGMENT_PREFIX):-len('.jsonl')])
+
+    def version(self):
+        """Changes whenever an entry is appended or a segment is started."""
+        segments = self._segments()
+        if not segments:
+            return None
+        try:
+            size = os.path.getsize(os.path.join(self.path, segments[-1]))
+        except FileNotFoundError:
+            return None
+        return (segments[-1], size)
+
+    def _read_snapshot(self):
+        try:
+            with open(os.path.join(self.path, self.SNAPSHOT), 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            return snapshot['seq'], snapshot['users']
+        except FileNotFoundError:
+            return 0, {}
+
+    def _apply_lines(self, data):
+        """Apply complete journal lines from data. Returns the bytes consumed."""
+        end = data.rfind(b'\n') + 1  # a half-written last line waits for the next read
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry['s'] <= self._seq:
+                continue  # already in the snapshot
+            self._users[entry['u']] = entry['c']
+            self._seq = entry['s']
+            self._entries_since_snapshot += 1
+        return end
+
+    def _read_from(self, segments, first_offset):
+        """Read segments in order, starting at first_offset in the first one."""
+        offset = first_offset
+        for name in segments:
+            with open(os.path.join(self.path, name), 'rb') as f:
+                f.seek(offset)
+                consumed = self._apply_lines(f.read())
+            self._segment, self._offset = name, offset + consumed
+            offset = 0
+
+    def _full_reload(self):
+        for _ in range(5):
+            seq, users = self._read_snapshot()
+            segments = self._segments()
+            # Compaction may delete segments between the two reads; make sure
+            # the journal still continues right after the snapshot
+            if segments and self._segment_start(segments[0]) > seq + 1:
+                continue
+            self._seq, self._users = seq, dict(users)
+            self._entries_since_snapshot = 0
+            self._segment, self._offset = None, 0
+            try:
+                self._read_from(segments, 0)
+            except FileNotFoundError:
+                continue
+            return
+        raise RuntimeError(f"Could not load a consistent journal from {self.path}")
+
+    def _catch_up(self):
+        """Bring the in-memory registry up to date with the files. Caller holds the lock."""
+        if self._segment is None:
+            self._full_reload()
+            return
+        segments = self._segments()
+        if self._segment not in segments:
+            self._full_reload()  # compacted away under us
+            return
+        try:
+            self._read_from(segments[segments.index(self._segment):], self._offset)
+        except FileNotFoundError:
+            self._full_reload()
+
+    def load_all(self):
+        """Return the full registry, reading only what was appended since the last call."""
+        with self._lock:
+            self._catch_up()
+            return dict(self._users)
+
+    def get(self, username):
+        users = self.load_all()
+        if username in users:
+            return users[username]
+        normalized = normalize_username(username)
+        for name, chat_id in users.items():
+            if normalize_username(name) == normalized:
+                return chat_id
+        return None
+
+    def _open_segment(self, start_seq):
+        name = f'{self.SEGMENT_PREFIX}{start_seq:012d}.jsonl'
+        if self._file is not None:
+            self._file.close()
+        self._file = open(os.path.join(self.path, name), 'ab')
+        self._segment, self._offset = name, self._file.tell()
+
+    def _writing_to(self, name):
+        """True if our append handle is open on segment `name` (the same file, not a deleted one)."""
+        if self._file is None:
+            return False
+        try:
+            return os.path.samestat(os.fstat(self._file.fileno()), os.stat(os.path.join(self.path, name)))
+        except FileNotFoundError:
+            return False
+
+    def upsert_many(self, users):
+        """Append the changed users to the journal. Returns the number changed."""
+        with self._lock:
+            # Another bot_server may have written, rolled or compacted the journal since our
+            # last write (leader hand-off): catch up, and append to the newest segment, not
+            # one that was deleted under our open handle
+            self._catch_up()
+            segments = self._segments()
+            if not segments:
+                self._open_segment(self._seq + 1)
+            elif not self._writing_to(segments[-1]):
+                self._repair_tail(segments[-1])
+                self._open_segment(self._segment_start(segments[-1]))
+
+            changed = {name: chat_id for name, chat_id in users.items() if self._users.get(name) != chat_id}
+            if not changed:
+                return 0
+            lines = []
+            for name, chat_id in changed.items():
+                self._seq += 1
+                lines.append(json.dumps({'s': self._seq, 'u': name, 'c': chat_id}, ensure_ascii=False))
+            data = ('\n'.join(lines) + '\n').encode('utf-8')
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())  # one fsync for the whole batch
+            self._offset += len(data)
+            self._users.update(changed)
+            self._entries_since_snapshot += len(changed)
+
+            if self._entries_since_snapshot >= self.compact_every and not self._compacting:
+                self._start_compaction()
+            return len(changed)
+
+    def _repair_tail(self, name):
+        """Drop a half-written last line left by a crash, so appends start on a fresh line."""
+        path = os.path.join(self.path, name)
+        with open(path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                f.truncate(end)
+
+    def _start_compaction(self):
+        """Roll to a new segment and snapshot everything before it. Caller holds the lock."""
+        self._compacting = True
+        seq, users = self._seq, dict(self._users)
+        self._open_segment(seq + 1)
+        self._entries_since_snapshot = 0
+        threading.Thread(target=self._compact, args=(seq, users), name='journal-compaction', daemon=True).start()
+
+    def _compact(self, seq, users):
+        try:
+            tmp_path = os.path.join(self.path, f'{self.SNAPSHOT}.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'seq': seq, 'users': users}, f, ensure_ascii=False, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, os.path.join(self.path, self.SNAPSHOT))
+            # A segment is covered once the segment after it starts within the snapshot
+            segments = self._segments()
+            for name, next_name in zip(segments, segments[1:]):
+                if self._segment_start(next_name) <= seq + 1:
+                    try:
+                        os.remove(os.path.join(self.path, name))
+                    except OSError:
+                        pass  # a reader has it open (Windows); removed at the next compaction
+        except Exception as e:
+            log.error("Journal compaction failed", extra={'error': str(e)})
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """Snapshot the registry now and wait for it (used by the CLI)."""
+        with self._lock:
+            self._catch_up()
+            seq, users = self._seq, dict(self._users)
+            self._compacting = True
+        self._compact(seq, users)
+        return seq
+
+    def import_json(self, json_path=DEFAULT_JSON_FILE):
+        """One-shot import of an existing users.json. Returns the number of users changed."""
+        users = JsonUserStore(json_path).load_all()
+        if users is None:
+            raise ValueError(f"Could not parse {json_path}")
+        return self.upsert_many(users)
+
+
+def _env_path(name, default):
+    """Read a path from the environment, resolving relative paths against Backend/."""
+    return os.path.join(SCRIPT_DIR, os.getenv(name, default))
+
+
+def open_user_store():
+    """Open the backend configured by USER_STORE (sqlite, journal or json)."""
+    backend = os.getenv('USER_STORE', 'sqlite').lower()
+    json_path = _env_path('USERS_FILE', DEFAULT_JSON_FILE)
+    if backend == 'json':
+        return JsonUserStore(json_path)
+    if backend == 'journal':
+        journal_dir = _env_path('USER_JOURNAL_DIR', DEFAULT_JOURNAL_DIR)
+        is_new = not os.path.exists(journal_dir)
+        store = JournalUserStore(journal_dir)
+        if is_new and os.path.exists(json_path):
+            store.import_json(json_path)
+        return store
+    if backend == 'sqlite':
+        db_path = _env_path('USER_DB_FILE', DEFAULT_DB_FILE)
+        is_new = not os.path.exists(db_path)
+        store = SqliteUserStore(db_path)
+        # First run after switching backends: carry existing users over
+        if is_new and os.path.exists(json_path):
+            store.import_json(json_path)
+        return store
+    raise ValueError(f"Unknown USER_STORE backend: {backend!r} (expected 'sqlite', 'journal' or 'json')")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('import', 'compact'):
+        print("Usage: python user_store.py import [users.json] | compact")
+        sys.exit(1)
+    if os.getenv('USER_STORE', 'sqlite').lower() == 'journal':
+        target = JournalUserStore(_env_path('USER_JOURNAL_DIR', DEFAULT_JOURNAL_DIR))
+    else:
+        target = SqliteUserStore(_env_path('USER_DB_FILE', DEFAULT_DB_FILE))
+    if sys.argv[1] == 'compact':
+        if not isinstance(target, JournalUserStore):
+            print("compact only applies to USER_STORE=journal")
+            sys.exit(1)
+        print(f"✅ Journal compacted up to entry {target.compact()} in {target.path}")
+        sys.exit(0)
+    source = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_JSON_FILE
+    changed = target.import_json(source)
+    print(f"✅ Imported {changed} users from {source} into {target.path}")
@@ -25,7 +25,7 @@ import { RestScreen } from '@/screens/RestScreen';
 import { AnimatedBackground } from '@/components/layout/AnimatedBackground';
 
 // Import utilities
-import { BREATHE_TIMER, ALERT_TIMER, NOTIFICATION_INTERVAL, ALERT_MESSAGES, AppStatus } from '@/utils/constants';
+import { BREATHE_TIMER, ALERT_TIMER, NOTIFICATION_INTERVAL, ALERT_MESSAGES, FINAL_ALERT_MESSAGE, ALERT_PROGRESS_POLL_INTERVAL, AppStatus } from '@/utils/constants';
 import { useResponsive } from '@/utils/responsive';
 
 // Configure notification behavior
@@ -87,7 +87,9 @@ export default function HomeScreen() {
   const appStateRef = useRef<AppStateStatus>(AppState.currentState);
   const backgroundTimeRef = useRef<number | null>(null);
   const shouldStopSpamRef = useRef(false); // Flag to stop spam immediately
+  const alertSessionIdRef = useRef<string | null>(null); // Server-side alert session (null = client-driven fallback)
   const connectedGuardiansRef = useRef<string[]>([]); // Ref for guardians to avoid stale closures
+  const presenceRef = useRef<{ etag: string | null; connected: string[] }>({ etag: null, connected: [] }); // Last /users/presence answer
   const breatheTimerEndRef = useRef<number | null>(null); // Timestamp when breathe timer should expire
   const alertTimerEndRef = useRef<number | null>(null); // Timestamp when alert timer should expire
   const deathCountIncrementedRef = useRef(false); // Flag to ensure death count is only incremented once per death
@@ -477,6 +479,7 @@ export default function HomeScreen() {
     
     // Stop all timers and intervals first
     shouldStopSpamRef.current = true;
+    cancelServerAlert();
     [timerIntervalRef, alertTimerIntervalRef, notificationIntervalRef, spamMessageIntervalRef].forEach(ref => {
       if (ref.current) {
         clearInterval(ref.current);
@@ -634,7 +637,8 @@ export default function HomeScreen() {
       const data = notification.request.content.data;
       if (data?.action === 'sendAlertMessage' && statusRef.current === AppStatus.ALERTING) {
         // Trigger message sending when background notification is received
-        if (!shouldStopSpamRef.current) {
+        // (only in fallback mode - a server-side alert session sends on its own)
+        if (!shouldStopSpamRef.current && !alertSessionIdRef.current) {
           sendMessageToAll().then(sent => {
             if (sent > 0 && !shouldStopSpamRef.current) {
               setMessagesSent((prev) => prev + sent);
@@ -660,6 +664,7 @@ export default function HomeScreen() {
   useEffect(() => {
     if (isAuthenticated) return;
     shouldStopSpamRef.current = true;
+    cancelServerAlert();
     [timerIntervalRef, alertTimerIntervalRef, notificationIntervalRef, spamMessageIntervalRef].forEach(ref => {
       if (ref.current) {
         clearInterval(ref.current);
@@ -1011,28 +1016,36 @@ export default function HomeScreen() {
 
   const checkGuardianStatus = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/users`);
-      if (!response.ok) {
+      // Ask only about our guardians; the server matches usernames normalized
+      // (no @, lowercase) and answers 304 if nothing changed since last time
+      const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+      if (presenceRef.current.etag) {
+        headers['If-None-Match'] = presenceRef.current.etag;
+      }
+      const response = await fetch(`${API_BASE_URL}/users/presence`, {
+        method: 'POST',
+        headers,
+        body: JSON.stringify({ usernames: guardians }),
+      });
+      if (response.status !== 304 && !response.ok) {
         console.log(`⚠️ Server responded with status: ${response.status}`);
         return;
       }
-      const data = await response.json();
-      if (data.success && data.users) {
-        // Normalize usernames (remove @, lowercase) for comparison
-        const normalizedDbUsers = data.users.map((u: string) => u.toLowerCase().replace('@', ''));
-        const normalizedGuardians = guardians.map(g => g.toLowerCase().replace('@', ''));
-        
-        const connected = guardians.filter(g => {
-          const normalized = g.toLowerCase().replace('@', '');
-          return normalizedDbUsers.includes(normalized);
-        });
+      let data = { success: true, connected: presenceRef.current.connected };
+      if (response.status !== 304) {
+        data = await response.json();
+        presenceRef.current = { etag: response.headers.get('ETag'), connected: data.connected || [] };
+      }
+      if (data.success && data.connected) {
+        const connected = guardians.filter(g => data.connected.includes(g));
         
-        console.log('🔍 Guardian Check:', {
-          guardians: guardians,
-          dbUsers: data.users,
-          connected: connected,
-          currentStatus: status
-        });
+        if (response.status !== 304) {
+          console.log('🔍 Guardian Check:', {
+            guardians: guardians,
+            connected: connected,
+            currentStatus: status
+          });
+        }
         
         const prevConnected = connectedGuardians.length;
         setConnectedGuardians(connected);
@@ -1145,23 +1158,61 @@ export default function HomeScreen() {
     resetNotificationTimer();
   };
 
-  // When breathe timer (10s) reaches 0 → go to ALERTING
-  // Works like friends/leaderboard - just changes status, no navigation
-  const handleBreatheTimeout = () => {
-    const currentStatus = statusRef.current;
-    
-    // Only allow transition from MONITORING
-    if (currentStatus !== AppStatus.MONITORING) {
-      return;
+  // Start a server-side alert session; the server sends the repeated messages
+  // and the final message itself. Returns the session id, or null on failure.
+  const startServerAlert = async (): Promise<string | null> => {
+    if (!isAuthenticated) {
+      return null;
     }
-    
-    // Clear notification interval (but keep timer interval for alert timer)
-    if (notificationIntervalRef.current) clearInterval(notificationIntervalRef.current);
+    try {
+      const response = await fetch(`${API_BASE_URL}/alerts`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          guardians: connectedGuardiansRef.current,
+          messages: ALERT_MESSAGES,
+          cadence: 1,
+          duration: ALERT_TIMER,
+          final_message: FINAL_ALERT_MESSAGE,
+        }),
+      });
+      const data = await response.json();
+      if (response.ok && data.success) {
+        console.log(`🚨 Server alert session started: ${data.alert_id}`);
+        return data.alert_id;
+      }
+      console.log('⚠️ Could not start server alert session:', data.error);
+    } catch (error) {
+      console.log('⚠️ Could not start server alert session:', error);
+    }
+    return null;
+  };
 
-    // Reset message index and enable spam
-    messageIndexRef.current = 0;
-    shouldStopSpamRef.current = false;
+  const cancelServerAlert = async (alertId: string | null = alertSessionIdRef.current): Promise<void> => {
+    alertSessionIdRef.current = null;
+    if (!alertId) return;
+    try {
+      await fetch(`${API_BASE_URL}/alerts/${alertId}`, { method: 'DELETE' });
+      console.log(`🛑 Server alert session cancelled: ${alertId}`);
+    } catch (error) {
+      console.log(`Failed to cancel alert session ${alertId}:`, error);
+    }
+  };
 
+  const pollAlertProgress = async (alertId: string): Promise<void> => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/alerts/${alertId}`);
+      const data = await response.json();
+      if (response.ok && data.success && !shouldStopSpamRef.current) {
+        setMessagesSent(data.messages_sent);
+      }
+    } catch (error) {
+      console.log('Failed to fetch alert progress');
+    }
+  };
+
+  // Fallback: send alert messages from the app itself, once per second
+  const startClientAlertLoop = () => {
     // Start sending messages
     sendMessageToAll().then(sent => setMessagesSent(sent));
     
@@ -1193,8 +1244,43 @@ export default function HomeScreen() {
           trigger: { seconds: i },
         }).catch(() => {}); // Silently fail if limit reached
       }
-    };
-    scheduleBackgroundMessageNotifications();
+      };
+      scheduleBackgroundMessageNotifications();
+  };
+
+  // When breathe timer (10s) reaches 0 → go to ALERTING
+  // Works like friends/leaderboard - just changes status, no navigation
+  const handleBreatheTimeout = () => {
+    const currentStatus = statusRef.current;
+    
+    // Only allow transition from MONITORING
+    if (currentStatus !== AppStatus.MONITORING) {
+      return;
+    }
+    
+    // Clear notification interval (but keep timer interval for alert timer)
+    if (notificationIntervalRef.current) clearInterval(notificationIntervalRef.current);
+
+    // Reset message index and enable spam
+    messageIndexRef.current = 0;
+    shouldStopSpamRef.current = false;
+
+    // Let the server run the alert session; fall back to sending from the app
+    // if the session can't be started (e.g. older server or network error)
+    startServerAlert().then(alertId => {
+      if (alertId) {
+        if (shouldStopSpamRef.current) {
+          // False alarm pressed while the session was being created
+          cancelServerAlert(alertId);
+          return;
+        }
+        alertSessionIdRef.current = alertId;
+        // Refresh the "messages sent" badge from the server's progress
+        spamMessageIntervalRef.current = setInterval(() => pollAlertProgress(alertId), ALERT_PROGRESS_POLL_INTERVAL);
+      } else if (!shouldStopSpamRef.current) {
+        startClientAlertLoop();
+      }
+    });
 
     // Go to ALERTING screen with 60s timer
     // This transition happens in the background - user will see ALERTING screen (60s countdown)
@@ -1210,7 +1296,7 @@ export default function HomeScreen() {
       return;
     }
     
-    const finalMessage = 'YOUR WARD IS MOST PROBABLY DEAD';
+    const finalMessage = FINAL_ALERT_MESSAGE;
     const guardiansToMessage = connectedGuardiansRef.current;
     
     console.log('💀 Sending final message to guardians:', guardiansToMessage);
@@ -1220,7 +1306,7 @@ export default function HomeScreen() {
         const response = await fetch(`${API_BASE_URL}/send-message`, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ target_username: guardian, message: finalMessage }),
+          body: JSON.stringify({ target_username: guardian, message: finalMessage, priority: 'high' }),
         });
         const data = await response.json();
         if (response.ok && data.success) {
@@ -1251,7 +1337,12 @@ export default function HomeScreen() {
     }
     
     // Send final message to all guardians before going to REST
-    await sendFinalMessage();
+    // (a server-side alert session sends it itself when it runs out)
+    if (alertSessionIdRef.current) {
+      alertSessionIdRef.current = null;
+    } else {
+      await sendFinalMessage();
+    }
     
     // Set status to REST first, then increment (useEffect will also catch it as backup)
     setStatus(AppStatus.REST);
@@ -1324,6 +1415,8 @@ export default function HomeScreen() {
       spamMessageIntervalRef.current = null;
     }
     
+    cancelServerAlert();
+    
     setSupportMessage("You're safe now! 💖✨");
     setTimeout(() => setSupportMessage("Stay Safe"), 5000);
     
@@ -1437,6 +1530,7 @@ export default function HomeScreen() {
 
   const handleResetApp = async () => {
     // Clear all intervals and stop messages
+    cancelServerAlert();
     [timerIntervalRef, alertTimerIntervalRef, notificationIntervalRef, spamMessageIntervalRef].forEach(ref => {
       if (ref.current) {
         clearInterval(ref.current);
@@ -1480,6 +1574,7 @@ export default function HomeScreen() {
       clearInterval(alertTimerIntervalRef.current);
       alertTimerIntervalRef.current = null;
     }
+    cancelServerAlert();
     
     setStatus(AppStatus.MONITORING);
     setTimer(BREATHE_TIMER);
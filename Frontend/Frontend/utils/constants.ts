@@ -2,6 +2,7 @@
 export const BREATHE_TIMER = 5; // 10 seconds for breathing screen
 export const ALERT_TIMER = 20;   // 60 seconds for alerting screen before REST
 export const NOTIFICATION_INTERVAL = 1000; // 1 second
+export const ALERT_PROGRESS_POLL_INTERVAL = 5000; // 5 seconds between alert session progress checks
 
 // Cycling messages for alerts
 export const ALERT_MESSAGES = [
@@ -12,6 +13,9 @@ export const ALERT_MESSAGES = [
   "HELP ME PLS 😭",
 ];
 
+// Sent to guardians when the alert timer runs out
+export const FINAL_ALERT_MESSAGE = 'YOUR WARD IS MOST PROBABLY DEAD';
+
 // App status enum
 export enum AppStatus {
   SETUP = 'SETUP',